@@ -0,0 +1,143 @@
+# benchmarks/bench_security.py
+"""
+安全校验的微基准测试。
+
+对比旧实现 (每次校验解析两次 SQL 并递归查找 Identifier)、
+单次解析的分析器 (冷启动，不命中缓存) 和按 SQL 哈希缓存的校验结论 (热路径)。
+
+用法 (在项目根目录下):
+    python -m benchmarks.bench_security [--repeat 200] [--json]
+"""
+import json
+import time
+import argparse
+import statistics
+
+import sqlparse
+from sqlparse.sql import Identifier
+
+from core import security
+
+# 基于 college 库的、具有代表性的 LLM 生成查询
+CORPUS = [
+    "SELECT title, credits FROM course ORDER BY title, credits;",
+    "SELECT course_id, title, dept_name, credits FROM course WHERE dept_name = 'Comp. Sci.';",
+    "SELECT T.title FROM course AS T LEFT JOIN prereq AS P ON T.course_id = P.course_id WHERE P.prereq_id IS NULL;",
+    "SELECT S.name FROM student AS S JOIN advisor AS A ON S.ID = A.s_ID GROUP BY S.ID, S.name HAVING count(*) > 1;",
+    "SELECT dept_name, budget FROM department WHERE budget > 85000;",
+    "SELECT C.title, C.credits, C.dept_name FROM course AS C JOIN prereq AS P ON C.course_id = P.course_id "
+    "GROUP BY C.course_id, C.title, C.credits, C.dept_name HAVING COUNT(*) > 1;",
+    "SELECT DISTINCT I.name FROM instructor AS I JOIN teaches AS T ON I.ID = T.ID "
+    "WHERE T.semester = 'Fall' AND T.year = 2009;",
+    "SELECT building, room_number, capacity FROM classroom WHERE capacity > 50 ORDER BY capacity DESC;",
+    "SELECT S.ID, S.name, SUM(C.credits) AS total FROM student S JOIN takes T ON S.ID = T.ID "
+    "JOIN course C ON T.course_id = C.course_id GROUP BY S.ID, S.name ORDER BY total DESC LIMIT 10;",
+    "SELECT name FROM student WHERE ID IN (SELECT ID FROM takes WHERE grade = 'A+') AND dept_name = 'Physics';",
+    "SELECT dept_name, COUNT(*) AS num_students FROM student GROUP BY dept_name ORDER BY num_students DESC;",
+    "SELECT C.title FROM course C WHERE NOT EXISTS (SELECT 1 FROM section S WHERE S.course_id = C.course_id);",
+    "SELECT I.name, D.building FROM instructor I JOIN department D ON I.dept_name = D.dept_name "
+    "WHERE D.building = 'Watson';",
+    "SELECT T.time_slot_id, T.day, T.start_hr, T.start_min FROM time_slot T WHERE T.day = 'M' ORDER BY T.start_hr;",
+    "SELECT sec.course_id, sec.sec_id, sec.semester, sec.year, cl.capacity FROM section sec "
+    "JOIN classroom cl ON sec.building = cl.building AND sec.room_number = cl.room_number WHERE sec.year = 2010;",
+    "WITH busy AS (SELECT ID, COUNT(*) AS n FROM teaches GROUP BY ID) "
+    "SELECT I.name, busy.n FROM instructor I JOIN busy ON I.ID = busy.ID WHERE busy.n > 3;",
+    "SELECT * FROM department;",
+    "SELECT S.* FROM student S WHERE S.tot_cred > 100;",
+    # 应被拒绝的查询
+    "SELECT name, salary FROM instructor ORDER BY salary DESC;",
+    "SELECT * FROM instructor;",
+    "DELETE FROM student WHERE tot_cred < 10;",
+    "SELECT AVG(salary) FROM instructor GROUP BY dept_name;",
+]
+
+SCHEMA_COLUMNS = {
+    "department": ["dept_name", "building", "budget"],
+    "student": ["ID", "name", "dept_name", "tot_cred"],
+    "instructor": ["ID", "name", "dept_name", "salary"],
+}
+
+QUESTION = "Which instructors teach in the Watson building in Fall 2009?"
+
+
+# --- 旧实现，作为对照 ---
+def _legacy_find_identifiers(tokens):
+    for token in tokens:
+        if isinstance(token, Identifier):
+            yield token
+        elif token.is_group:
+            yield from _legacy_find_identifiers(token.tokens)
+
+
+def legacy_checks(question, sql):
+    if security.SQLI_PATTERNS.search(question):
+        return False
+    for statement in sqlparse.parse(sql):
+        if statement.get_type() != 'SELECT':
+            return False
+    parsed = sqlparse.parse(sql)[0]
+    for identifier in _legacy_find_identifiers(parsed.tokens):
+        real_name = identifier.get_real_name()
+        if real_name and real_name.lower() in security.FORBIDDEN_FIELDS:
+            return False
+    return True
+
+
+def _reset_caches():
+    security._summaries.clear()
+    security._verdicts.clear()
+
+
+def _measure(fn, repeat):
+    """返回每次遍历整个语料的耗时 (秒) 列表"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="输出机器可读的 JSON")
+    args = parser.parse_args()
+
+    # 校验时会记录警告日志，基准测试中关闭
+    security.logging.disable(security.logging.WARNING)
+    security.set_schema_columns(SCHEMA_COLUMNS, "bench")
+
+    def run_legacy():
+        for sql in CORPUS:
+            legacy_checks(QUESTION, sql)
+
+    def run_cold():
+        _reset_caches()
+        for sql in CORPUS:
+            security.run_all_security_checks(QUESTION, sql)
+
+    def run_warm():
+        for sql in CORPUS:
+            security.run_all_security_checks(QUESTION, sql)
+
+    run_warm()  # 预热缓存
+    results = {}
+    for name, fn in (("legacy", run_legacy), ("single_pass", run_cold), ("memoized", run_warm)):
+        samples = _measure(fn, args.repeat)
+        per_query = statistics.median(samples) / len(CORPUS)
+        results[name] = {"median_us_per_query": round(per_query * 1e6, 2)}
+    base = results["legacy"]["median_us_per_query"]
+    for name in results:
+        results[name]["speedup"] = round(base / results[name]["median_us_per_query"], 1)
+
+    if args.json:
+        print(json.dumps({"queries": len(CORPUS), "repeat": args.repeat, "results": results}))
+        return
+    print(f"语料: {len(CORPUS)} 条 SQL, 重复 {args.repeat} 次")
+    for name, r in results.items():
+        print(f"  {name:<12} {r['median_us_per_query']:>10.2f} us/query   x{r['speedup']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/bench_startup.py
+"""
+启动耗时基准测试。
+
+在全新的解释器进程中多次导入各模块，报告导入耗时的中位数，以及导入后是否已加载
+dashscope 等只应在使用时才加载的重量级依赖 (不需要数据库或 API Key)。
+加上 --serve 时再启动完整的服务器 (假模型 + .env 中的数据库)，测量从启动进程到
+/health 可用的时间与各启动阶段 (配置校验、连接池、Schema 目录、预热等) 的耗时。
+
+用法 (在项目根目录下):
+    python -m benchmarks.bench_startup [--repeat 5] [--serve] [--json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["core.llm_handler", "core.orchestrator", "mcp_server.server"]
+# 导入服务器模块时不应加载的依赖
+LAZY = ["dashscope", "aiohttp_cors"]
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": len(sys.modules),
+                   "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    # 导入不应依赖 API Key
+    env.pop("DASHSCOPE_API_KEY", None)
+    return env
+
+
+def measure_import(module, repeat):
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, lazy=LAZY)],
+                             cwd=ROOT, env=_env(), capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "median_ms": round(statistics.median(s["seconds"] for s in samples) * 1000, 1),
+        "min_ms": round(min(s["seconds"] for s in samples) * 1000, 1),
+        "modules": samples[-1]["modules"],
+        "heavy_loaded": samples[-1]["loaded"],
+    }
+
+
+def measure_serve(port, timeout):
+    """启动服务器进程，轮询 /health 直到就绪"""
+    env = _env()
+    env.update({"PORT": str(port), "LLM_BACKEND": "fake"})
+    start = time.perf_counter()
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen([sys.executable, "-m", "mcp_server.server"], cwd=ROOT, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                log.seek(0)
+                raise RuntimeError(f"服务器进程已退出:\n{log.read().decode(errors='replace')[-2000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as resp:
+                    health = json.load(resp)
+                return {"ready_ms": round((time.perf_counter() - start) * 1000, 1),
+                        "startup_ms": health["startup_ms"]}
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError(f"服务器在 {timeout}s 内没有就绪")
+    finally:
+        process.terminate()
+        process.wait()
+        log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--serve", action="store_true", help="同时测量服务器启动到就绪的时间 (需要数据库)")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true", help="输出机器可读的 JSON")
+    args = parser.parse_args()
+
+    results = {"imports": {m: measure_import(m, args.repeat) for m in MODULES}}
+    if args.serve:
+        results["serve"] = measure_serve(args.port, args.timeout)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False))
+        return
+    print(f"导入耗时 (全新进程, {args.repeat} 次的中位数):")
+    for module, r in results["imports"].items():
+        heavy = ", ".join(r["heavy_loaded"]) or "无"
+        print(f"  {module:20s} {r['median_ms']:7.1f} ms   模块数 {r['modules']:5d}   已加载的延迟依赖: {heavy}")
+    if args.serve:
+        serve = results["serve"]
+        print(f"启动到就绪: {serve['ready_ms']} ms")
+        for stage, ms in serve["startup_ms"].items():
+            print(f"  {stage:20s} {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
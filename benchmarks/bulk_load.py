@@ -0,0 +1,293 @@
+# benchmarks/bulk_load.py
+"""
+college.sql 这类逐行 INSERT 的转储文件的快速导入工具。
+
+流式读取转储文件 (不整体读入内存)，把同一张表连续的单行 INSERT 合并成多行的批量 INSERT，
+由多个连接并行写入 (不同表的批次互不等待)，写入期间关闭外键与唯一性检查，最后报告每秒行数。
+--scale N 把 student / takes / advisor 扩充为 N 倍 (复制的学生使用新的 ID)，用于压测更大的数据量；
+--output 只把改写后的 SQL 写入文件，可交给 mysql 客户端导入。
+
+用法 (在项目根目录下，连接参数默认读取 .env 中的 DB_*):
+    python -m benchmarks.bulk_load [college.sql] [--db-name college_bench] [--workers 4] [--scale 10] [--json]
+    python -m benchmarks.bulk_load college.sql --scale 10 --output college_x10.sql
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+
+import aiomysql
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 扩充数据时需要改写的表及其学生 ID 所在的列序号
+SCALE_COLUMNS = {"student": 0, "takes": 0, "advisor": 0}
+# 复制出的学生 ID 只由大写字母组成 (原 ID 均为数字，不会冲突)，5 个字母最多容纳 117 份副本
+MAX_SCALE = 117
+
+_INSERT_RE = re.compile(r"INSERT\s+INTO\s+(`[^`]+`|\w+)\s*(\([^)]*\))?\s*VALUES\s*", re.IGNORECASE)
+# DDL 等语句作用的表 (外键 REFERENCES 中的表不算)
+_TARGET_RE = re.compile(r"\b(?:TABLES?|INTO|UPDATE|FROM)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(`[^`]+`|\w+)",
+                        re.IGNORECASE)
+
+
+def iter_statements(path):
+    """按行切分转储文件 (每条语句以行尾的分号结束)，跳过注释"""
+    buffer = []
+    in_comment = False
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            stripped = line.strip()
+            if in_comment:
+                in_comment = "*/" not in stripped
+                continue
+            if not buffer and stripped.startswith("/*") and "*/" not in stripped:
+                in_comment = True
+                continue
+            if not buffer and (not stripped or stripped.startswith("--")):
+                continue
+            buffer.append(line)
+            if stripped.endswith(";"):
+                yield "".join(buffer).strip()
+                buffer = []
+    if buffer:
+        yield "".join(buffer).strip()
+
+
+def split_top_level(text, separator=","):
+    """在括号与引号之外按分隔符切分"""
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    i = 0
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if quote is not None:
+            if ch == "\\":
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in "'\"`":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == separator and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+        i += 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+def _synthetic_id(copy, original):
+    """第 copy 份副本中学生 original 的 ID：copy * 100000 + 原 ID 的 26 进制大写字母表示"""
+    n = copy * 100000 + int(original)
+    letters = []
+    while n:
+        n, r = divmod(n, 26)
+        letters.append(chr(ord("A") + r))
+    return "".join(reversed(letters)).rjust(5, "A")
+
+
+def _scaled_rows(table, rows, scale):
+    column = SCALE_COLUMNS.get(table)
+    if column is None or scale <= 1:
+        return rows
+    out = list(rows)
+    for row in rows:
+        fields = split_top_level(row[1:-1])
+        original = fields[column].strip("'")
+        if not original.isdigit():
+            continue
+        for copy in range(1, scale):
+            fields[column] = f"'{_synthetic_id(copy, original)}'"
+            out.append("(" + ", ".join(fields) + ")")
+    return out
+
+
+def plan(path, batch_rows=2000, max_batch_bytes=1 << 20, scale=1):
+    """
+    把转储文件改写为执行计划：依次产出 ("sql", 语句) 与 ("batch", 表名, 批量 INSERT, 行数)。
+    同一张表 (且列清单相同) 的连续 INSERT 合并为一批，达到行数或字节数上限时切分。
+    """
+    prefix = table = None
+    rows = []
+    size = 0
+
+    def flush():
+        statement = prefix + ",\n".join(rows) + ";"
+        return "batch", table, statement, len(rows)
+
+    for statement in iter_statements(path):
+        match = _INSERT_RE.match(statement)
+        if match is None:
+            if rows:
+                yield flush()
+                rows, size = [], 0
+            yield "sql", statement
+            continue
+        head = f"INSERT INTO {match.group(1)} {match.group(2) or ''}VALUES "
+        name = match.group(1).strip("`")
+        values = statement[match.end():].rstrip().rstrip(";")
+        if rows and head != prefix:
+            yield flush()
+            rows, size = [], 0
+        prefix, table = head, name
+        for row in _scaled_rows(name, split_top_level(values), scale):
+            if rows and (len(rows) >= batch_rows or size + len(row) > max_batch_bytes):
+                yield flush()
+                rows, size = [], 0
+            rows.append(row)
+            size += len(row) + 2
+    if rows:
+        yield flush()
+
+
+def _targets(statement):
+    return {name.strip("`").lower() for name in _TARGET_RE.findall(statement)}
+
+
+async def load(path, host, port, user, password, db, workers=4, batch_rows=2000,
+               max_batch_bytes=1 << 20, scale=1, create_db=True):
+    """
+    按 plan() 导入数据库，返回 {"rows", "seconds", "rows_per_sec", "tables": {表: 行数}}。
+    DDL 与 SET 语句在主连接上按顺序执行；批量 INSERT 经有界队列分发给 workers 个连接并行写入。
+    DDL 涉及仍有批次未写完的表时，先等待队列清空。
+    """
+    if not 1 <= scale <= MAX_SCALE:
+        raise ValueError(f"scale must be between 1 and {MAX_SCALE}")
+    conn_args = dict(host=host, port=port, user=user, password=password, charset="utf8mb4",
+                     autocommit=True)
+    main = await aiomysql.connect(**conn_args)
+    queue = asyncio.Queue(maxsize=workers * 2)
+    errors = []
+    counts = {}
+
+    async def writer():
+        # 出错后继续取出队列中的批次 (不再执行)，使主流程不会阻塞在 put / join 上
+        conn = cur = None
+        try:
+            conn = await aiomysql.connect(db=db, **conn_args)
+            cur = await conn.cursor()
+            await cur.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+        except Exception as e:
+            errors.append(e)
+        try:
+            while True:
+                item = await queue.get()
+                try:
+                    if item is None:
+                        return
+                    if not errors:
+                        await cur.execute(item)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    queue.task_done()
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def check():
+        if errors:
+            raise errors[0]
+
+    tasks = []
+    start = time.perf_counter()
+    try:
+        async with main.cursor() as cur:
+            if create_db:
+                await cur.execute(f"CREATE DATABASE IF NOT EXISTS `{db}`")
+            await cur.execute(f"USE `{db}`")
+            await cur.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+            tasks = [asyncio.create_task(writer()) for _ in range(workers)]
+            pending = set()
+            for step in plan(path, batch_rows, max_batch_bytes, scale):
+                check()
+                if step[0] == "sql":
+                    if pending & _targets(step[1]):
+                        await queue.join()
+                        check()
+                        pending.clear()
+                    await cur.execute(step[1])
+                    continue
+                _, table, statement, n = step
+                pending.add(table.lower())
+                counts[table] = counts.get(table, 0) + n
+                await queue.put(statement)
+            await queue.join()
+            check()
+            # 转储末尾的 SET FOREIGN_KEY_CHECKS = 1 只作用于主连接，这里恢复会话设置
+            await cur.execute("SET SESSION foreign_key_checks = 1, unique_checks = 1")
+    finally:
+        for task in tasks:
+            if not task.done():
+                await queue.put(None)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        main.close()
+    elapsed = time.perf_counter() - start
+    rows = sum(counts.values())
+    return {"rows": rows, "seconds": round(elapsed, 3), "rows_per_sec": round(rows / elapsed, 1),
+            "tables": counts}
+
+
+def write_sql(path, output, batch_rows=2000, max_batch_bytes=1 << 20, scale=1):
+    """把改写后的语句写入文件 (不连接数据库)，返回各表的行数"""
+    counts = {}
+    with open(output, "w", encoding="utf-8") as f:
+        f.write("SET NAMES utf8mb4;\nSET FOREIGN_KEY_CHECKS = 0;\nSET UNIQUE_CHECKS = 0;\n")
+        for step in plan(path, batch_rows, max_batch_bytes, scale):
+            if step[0] == "batch":
+                counts[step[1]] = counts.get(step[1], 0) + step[3]
+            f.write(step[-2] if step[0] == "batch" else step[1])
+            f.write("\n")
+        f.write("SET UNIQUE_CHECKS = 1;\nSET FOREIGN_KEY_CHECKS = 1;\n")
+    return counts
+
+
+def main():
+    load_dotenv(os.path.join(ROOT, ".env"))
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sql_file", nargs="?", default=os.path.join(ROOT, "college.sql"))
+    parser.add_argument("--db-host", default=os.getenv("DB_HOST", "127.0.0.1"))
+    parser.add_argument("--db-port", type=int, default=int(os.getenv("DB_PORT", 3306)))
+    parser.add_argument("--db-user", default=os.getenv("DB_USER", "root"))
+    parser.add_argument("--db-password", default=os.getenv("DB_PASSWORD", ""))
+    parser.add_argument("--db-name", default=os.getenv("DB_NAME", "college"))
+    parser.add_argument("--workers", type=int, default=4, help="并行写入的连接数")
+    parser.add_argument("--batch-rows", type=int, default=2000, help="每个批量 INSERT 的最大行数")
+    parser.add_argument("--max-batch-bytes", type=int, default=1 << 20,
+                        help="每个批量 INSERT 的最大字节数 (须小于 max_allowed_packet)")
+    parser.add_argument("--scale", type=int, default=1, help="student / takes / advisor 扩充的倍数")
+    parser.add_argument("--output", help="只把改写后的 SQL 写入该文件，不连接数据库")
+    parser.add_argument("--json", action="store_true", help="输出机器可读的 JSON")
+    args = parser.parse_args()
+
+    if args.output:
+        start = time.perf_counter()
+        counts = write_sql(args.sql_file, args.output, args.batch_rows, args.max_batch_bytes, args.scale)
+        elapsed = time.perf_counter() - start
+        rows = sum(counts.values())
+        result = {"rows": rows, "seconds": round(elapsed, 3), "rows_per_sec": round(rows / elapsed, 1),
+                  "tables": counts, "output": args.output}
+    else:
+        result = asyncio.run(load(args.sql_file, args.db_host, args.db_port, args.db_user,
+                                  args.db_password, args.db_name, args.workers, args.batch_rows,
+                                  args.max_batch_bytes, args.scale))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    print(f"导入 {result['rows']} 行, 用时 {result['seconds']}s, {result['rows_per_sec']:.0f} 行/秒")
+    for table, n in sorted(result["tables"].items()):
+        print(f"  {table:12s} {n:9d} 行")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/eval_schema_linking.py
+"""
+Schema 链接的正确性检查。
+
+用 college.sql 中的表结构 (另加一张列数超过 SCHEMA_LINK_MAX_COLUMNS 的宽表) 建立索引，检查：
+- 链接结果包含期望的表、不包含会误导连接路径的表；
+- 关系词找不到对应桥接表、或置信度不足时退回完整 Schema；
+- 退回完整 Schema 时宽表保留全部列，而不是只剩键列。
+
+用法 (在项目根目录下):
+    python -m benchmarks.eval_schema_linking [--json]
+"""
+import os
+import re
+import json
+import argparse
+
+from core.schema_linking import SchemaIndex, parse_create_table, SCHEMA_LINK_MAX_COLUMNS
+
+COLLEGE_SQL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "college.sql")
+_CREATE_RE = re.compile(r"CREATE TABLE `(\w+)`\s*\((.*?)\n\)[^;]*;", re.S)
+
+# 列数超过上限、只有主键的宽表
+WIDE_COLUMNS = SCHEMA_LINK_MAX_COLUMNS + 8
+WIDE_DDL = "CREATE TABLE `wide` (\n  `id` int NOT NULL,\n" + "".join(
+    f"  `metric_{i}` int DEFAULT NULL,\n" for i in range(WIDE_COLUMNS - 1)) + "  PRIMARY KEY (`id`)\n)"
+
+# (问题, 必须包含的表, 不能包含的表)；必须包含的表为 None 表示应退回完整 Schema
+CASES = [
+    ("students who took courses in 2009 taught by Einstein",
+     {"student", "takes", "section", "teaches", "instructor", "course"}, {"department"}),
+    ("Find students enrolled in courses taught by Einstein",
+     {"student", "takes", "teaches", "instructor"}, {"department", "advisor"}),
+    ("Find the advisor of student Zhang", {"advisor", "student", "instructor"}, set()),
+    ("List all courses in the Physics department", {"course", "department"}, {"takes", "teaches"}),
+    ("Find departments with budget greater than 100000", {"department"}, set()),
+    ("找出 2009 年选修课程的学生", None, set()),
+    ("Show everything", None, set()),
+]
+
+
+def load_tables(path=COLLEGE_SQL):
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    tables = [parse_create_table(m.group(1), f"CREATE TABLE `{m.group(1)}` (\n{m.group(2)}\n)")
+              for m in _CREATE_RE.finditer(source)]
+    tables.append(parse_create_table("wide", WIDE_DDL))
+    return tables
+
+
+def evaluate():
+    index = SchemaIndex(load_tables())
+    failures = []
+    for question, required, forbidden in CASES:
+        linked = index.link(question)
+        if required is None:
+            if linked is not None:
+                failures.append({"question": question, "error": "expected full schema",
+                                 "tables": linked[0]})
+            continue
+        if linked is None:
+            failures.append({"question": question, "error": "fell back to full schema"})
+            continue
+        tables = set(linked[0])
+        if not required <= tables or tables & forbidden:
+            failures.append({"question": question, "error": "wrong tables", "tables": linked[0],
+                             "missing": sorted(required - tables), "unexpected": sorted(tables & forbidden)})
+
+    # 完整 Schema 中宽表的每一列都应出现
+    full = index.prune("Show everything")
+    line = next(l for l in full.splitlines() if l.startswith("wide("))
+    rendered = len(re.findall(r"metric_\d+", line)) + 1
+    if rendered != WIDE_COLUMNS:
+        failures.append({"question": "Show everything", "error": "wide table truncated in full schema",
+                         "columns": rendered})
+    return {"cases": len(CASES) + 1, "failures": failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="输出机器可读的 JSON")
+    args = parser.parse_args()
+
+    result = evaluate()
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    print(f"检查项: {result['cases']} 个, 失败 {len(result['failures'])} 个")
+    for failure in result["failures"]:
+        print(f"  - [{failure['error']}] {failure['question']}"
+              + (f" -> {failure['tables']}" if "tables" in failure else ""))
+    if result["failures"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
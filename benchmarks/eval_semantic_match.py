@@ -0,0 +1,158 @@
+# benchmarks/eval_semantic_match.py
+"""
+近似问题匹配的命中率 / 准确率评估。
+
+用一组已验证的 问题 → SQL 建立示例库，再用改写、换值和语义不同的问题检索：
+命中率 = 跳过 LLM 的问题比例，准确率 = 命中的问题中 SQL 与期望一致的比例。
+期望为 None 的问题不应命中 (否定、增加条件、换了统计口径等)。
+
+用法 (在项目根目录下):
+    python -m benchmarks.eval_semantic_match [--min-score 0.6] [--json]
+"""
+import json
+import time
+import argparse
+
+from core.examples import ExampleStore
+from core.semantic_match import SemanticMatcher
+from core.sql_cache import normalize_question
+from core.result_cache import canonicalize_sql
+
+# 已验证的示例 (问题, SQL)
+SEED = [
+    ("How many students are in the Comp. Sci. department?",
+     "SELECT COUNT(*) FROM student WHERE dept_name = 'Comp. Sci.';"),
+    ("Which departments have a budget over 500000?",
+     "SELECT dept_name FROM department WHERE budget > 500000;"),
+    ("Which instructors taught in Fall 2009?",
+     "SELECT DISTINCT I.name FROM instructor I JOIN teaches T ON I.ID = T.ID "
+     "WHERE T.semester = 'Fall' AND T.year = 2009;"),
+    ("List the courses offered by the Physics department",
+     "SELECT title FROM course WHERE dept_name = 'Physics';"),
+    ("What is the building of the History department?",
+     "SELECT building FROM department WHERE dept_name = 'History';"),
+    ("Top 10 students by total credits",
+     "SELECT name, tot_cred FROM student ORDER BY tot_cred DESC LIMIT 10;"),
+    ("Which classrooms in Taylor have capacity above 50?",
+     "SELECT room_number, capacity FROM classroom WHERE building = 'Taylor' AND capacity > 50;"),
+    ("What are the titles of courses without prerequisites?",
+     "SELECT T.title FROM course AS T LEFT JOIN prereq AS P ON T.course_id = P.course_id "
+     "WHERE P.prereq_id IS NULL;"),
+    ("计算机科学系有多少学生",
+     "SELECT COUNT(*) FROM student WHERE dept_name = 'Comp. Sci.';"),
+]
+
+# 测试问题与期望的 SQL (None 表示应交给 LLM)
+CASES = [
+    # 只有措辞不同
+    ("how many students are in the Comp. Sci. department", SEED[0][1]),
+    ("Show the courses offered by the Physics department", SEED[3][1]),
+    ("What are titles of all courses without prerequisites?", SEED[7][1]),
+    # 只有字面值不同
+    ("How many students are in the Biology department?",
+     "SELECT COUNT(*) FROM student WHERE dept_name = 'Biology';"),
+    ("How many students are in the Elec. Eng. department?",
+     "SELECT COUNT(*) FROM student WHERE dept_name = 'Elec. Eng.';"),
+    ("Which departments have a budget over 800000?",
+     "SELECT dept_name FROM department WHERE budget > 800000;"),
+    ("Which instructors taught in Spring 2010?",
+     "SELECT DISTINCT I.name FROM instructor I JOIN teaches T ON I.ID = T.ID "
+     "WHERE T.semester = 'Spring' AND T.year = 2010;"),
+    ("List the courses offered by the Math department",
+     "SELECT title FROM course WHERE dept_name = 'Math';"),
+    ("What is the building of the Finance department?",
+     "SELECT building FROM department WHERE dept_name = 'Finance';"),
+    ("Top 5 students by total credits",
+     "SELECT name, tot_cred FROM student ORDER BY tot_cred DESC LIMIT 5;"),
+    ("Which classrooms in Painter have capacity above 30?",
+     "SELECT room_number, capacity FROM classroom WHERE building = 'Painter' AND capacity > 30;"),
+    # 语义不同，不应命中
+    ("How many students are not in the Comp. Sci. department?", None),
+    ("How many students are in the computer science department?", None),
+    ("Which departments have a budget under 500000?", None),
+    ("Which instructors taught in Fall 2009 in the Physics department?", None),
+    ("List the courses offered by the Physics department with more than 3 credits", None),
+    ("What is the budget of the History department?", None),
+    ("Bottom 10 students by total credits", None),
+    ("What are the titles of courses with prerequisites?", None),
+    ("物理系有多少学生", None),
+    # 构造的反例：多个值、调换词序、无法确认的值与注入
+    ("Which instructors taught in Fall 2009 or Spring 2010?", None),
+    ("Which classrooms in Taylor and Painter have capacity above 50?", None),
+    ("Top 10 credits by total students", None),
+    ("How many students are in the Underwater Basket Weaving department?", None),
+    ("How many students are in the Bio\\' OR 1=1 -- department?", None),
+]
+
+# 数据库中真实存在的字符串值 (取自 college.sql)，用于校验替换进去的字面值
+KNOWN_VALUES = {
+    "Accounting", "Astronomy", "Athletics", "Biology", "Civil Eng.", "Comp. Sci.", "Cybernetics",
+    "Elec. Eng.", "English", "Finance", "Geology", "History", "Languages", "Marketing", "Math",
+    "Mech. Eng.", "Physics", "Pol. Sci.", "Psychology", "Statistics",
+    "Saucon", "Taylor", "Bronfman", "Candlestick", "Chandler", "Lamberton", "Mercer", "Main",
+    "Palmer", "Linderman", "Lambeau", "Brodhead", "Rauch", "Wrigley", "Whitman", "Thompson",
+    "Painter", "Packard", "Watson", "Fairchild",
+    "Fall", "Spring", "Summer", "Winter",
+}
+
+
+def evaluate(min_score):
+    store = ExampleStore()
+    for question, sql in SEED:
+        store.add(question, sql)
+    known = {normalize_question(v) for v in KNOWN_VALUES}
+    # 与服务器相同：索引中找不到的值视为无法确认 (None)，而不是确定不存在
+    matcher = SemanticMatcher(store, value_check=lambda v: True if normalize_question(v) in known else None,
+                              enabled=True, min_score=min_score)
+
+    hits = correct = false_hits = 0
+    failures = []
+    start = time.perf_counter()
+    for question, expected in CASES:
+        match = matcher.lookup(question)
+        if match is None:
+            if expected is not None:
+                failures.append({"question": question, "error": "miss"})
+            continue
+        hits += 1
+        if expected is not None and canonicalize_sql(match.sql) == canonicalize_sql(expected):
+            correct += 1
+        else:
+            false_hits += 1
+            failures.append({"question": question, "error": "wrong", "sql": match.sql})
+    elapsed = time.perf_counter() - start
+
+    answerable = sum(1 for _, expected in CASES if expected is not None)
+    return {
+        "cases": len(CASES),
+        "answerable": answerable,
+        "hits": hits,
+        "hit_rate": round(correct / answerable, 3),
+        "precision": round(correct / hits, 3) if hits else None,
+        "false_hits": false_hits,
+        "us_per_lookup": round(elapsed / len(CASES) * 1e6, 1),
+        "failures": failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-score", type=float, default=0.6)
+    parser.add_argument("--json", action="store_true", help="输出机器可读的 JSON")
+    args = parser.parse_args()
+
+    result = evaluate(args.min_score)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    print(f"测试问题: {result['cases']} 个 (其中 {result['answerable']} 个可复用)")
+    print(f"  命中率   {result['hit_rate']:.1%}   (命中 {result['hits']} 个)")
+    if result["precision"] is not None:
+        print(f"  准确率   {result['precision']:.1%}   (错误命中 {result['false_hits']} 个)")
+    print(f"  每次检索 {result['us_per_lookup']} us")
+    for failure in result["failures"]:
+        print(f"  - [{failure['error']}] {failure['question']}" + (f" -> {failure['sql']}" if "sql" in failure else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+# benchmarks/load_test.py
+"""
+MCP 服务器的端到端压测。
+
+启动 mcp_server.server 子进程，LLM 使用假模型 (固定的 问题 → SQL 映射与可配置的延迟分布)，
+数据库使用由 college.sql 导入的本地库；以开环方式 (按预先生成的泊松到达时间发请求，
+不等待前一个请求返回) 向 /query、/schema、/logs 施加目标 RPS 的负载，
+输出各接口的延迟分位数、吞吐量、连接池等待时间和分阶段耗时 (取自 /metrics)。
+相同的 --seed 生成完全相同的请求序列，--baseline 与上一次的 --output 结果对比。
+
+用法 (在项目根目录下，需要本地 MySQL，连接参数默认读取 .env 中的 DB_*):
+    python -m benchmarks.load_test [--rps 20] [--duration 30] [--db-name college_bench] [--json]
+    python -m benchmarks.load_test --output base.json
+    python -m benchmarks.load_test --baseline base.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+import aiohttp
+import aiomysql
+from dotenv import load_dotenv
+
+from benchmarks import bulk_load
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# college 库上的问题与期望的 SQL (假模型按问题原文返回)
+QUESTIONS = {
+    "How many students are there?": "SELECT COUNT(*) FROM student;",
+    "List all departments and their budgets": "SELECT dept_name, budget FROM department;",
+    "Which departments have a budget over 500000?":
+        "SELECT dept_name FROM department WHERE budget > 500000;",
+    "How many students are in the Comp. Sci. department?":
+        "SELECT COUNT(*) FROM student WHERE dept_name = 'Comp. Sci.';",
+    "Top 10 students by total credits":
+        "SELECT name, tot_cred FROM student ORDER BY tot_cred DESC LIMIT 10;",
+    "How many instructors are in each department?":
+        "SELECT dept_name, COUNT(*) FROM instructor GROUP BY dept_name;",
+    "List the courses offered by the Physics department":
+        "SELECT title FROM course WHERE dept_name = 'Physics';",
+    "Which instructors taught in Fall 2009?":
+        "SELECT DISTINCT I.name FROM instructor I JOIN teaches T ON I.ID = T.ID "
+        "WHERE T.semester = 'Fall' AND T.year = 2009;",
+    "How many sections were offered each year?":
+        "SELECT year, COUNT(*) FROM section GROUP BY year ORDER BY year;",
+    "Which classrooms have capacity above 50?":
+        "SELECT building, room_number, capacity FROM classroom WHERE capacity > 50;",
+    "What are the titles of courses without prerequisites?":
+        "SELECT C.title FROM course C LEFT JOIN prereq P ON C.course_id = P.course_id "
+        "WHERE P.prereq_id IS NULL;",
+    "How many courses did each student take?":
+        "SELECT ID, COUNT(*) FROM takes GROUP BY ID ORDER BY COUNT(*) DESC;",
+    "Grade distribution across all enrollments":
+        "SELECT grade, COUNT(*) FROM takes GROUP BY grade ORDER BY grade;",
+    "Who advises the most students?":
+        "SELECT I.name, COUNT(*) AS advisees FROM advisor A JOIN instructor I ON A.i_ID = I.ID "
+        "GROUP BY I.name ORDER BY advisees DESC LIMIT 5;",
+    "List students with their advisors":
+        "SELECT S.name, I.name FROM student S JOIN advisor A ON S.ID = A.s_ID "
+        "JOIN instructor I ON A.i_ID = I.ID;",
+}
+
+# /schema 与 /logs 的请求参数
+SCHEMA_PARAMS = [{}, {"table_name": "student"}, {"table_name": "course"}]
+LOGS_PARAMS = [{"limit": "50"}, {"status": "success", "limit": "20"}, {"q": "student", "limit": "20"}]
+
+
+def _percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def _parse_mix(text):
+    """解析 "query=0.8,schema=0.1,logs=0.1" 形式的请求比例"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("query", "schema", "logs"):
+            raise argparse.ArgumentTypeError(f"unknown endpoint: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+# --- 测试数据库 ---
+
+async def prepare_database(args):
+    """表不完整或指定了 --reload 时用 bulk_load 从 college.sql 导入压测库，返回导入结果"""
+    conn = await aiomysql.connect(host=args.db_host, port=args.db_port, user=args.db_user,
+                                  password=args.db_password)
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = %s",
+                              (args.db_name,))
+            (tables,) = await cur.fetchone()
+    finally:
+        conn.close()
+    if tables >= 11 and not args.reload:
+        return None
+    return await bulk_load.load(args.sql_file, args.db_host, args.db_port, args.db_user,
+                                args.db_password, args.db_name, scale=args.db_scale)
+
+
+# --- 服务器进程 ---
+
+def _write_responses(path, questions):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(questions, f, ensure_ascii=False)
+
+
+def start_server(args, workdir, questions):
+    responses = os.path.join(workdir, "responses.json")
+    _write_responses(responses, questions)
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(args.port),
+        "DB_HOST": args.db_host, "DB_PORT": str(args.db_port), "DB_USER": args.db_user,
+        "DB_PASSWORD": args.db_password, "DB_NAME": args.db_name,
+        "LLM_BACKEND": "fake",
+        "LLM_FAKE_RESPONSES": responses,
+        "LLM_FAKE_LATENCY": str(args.llm_latency),
+        "LLM_FAKE_JITTER": str(args.llm_jitter),
+        "LLM_FAKE_TAIL_PROB": str(args.llm_tail_prob),
+        "LLM_FAKE_TAIL_LATENCY": str(args.llm_tail_latency),
+        "LLM_FAKE_TOKEN_LATENCY": str(args.llm_token_latency),
+        "LLM_FAKE_SEED": str(args.seed),
+        "QUERY_LOG_DIR": os.path.join(workdir, "queries"),
+        "SQL_CACHE_PATH": "",
+    })
+    for item in args.server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    process = subprocess.Popen([sys.executable, "-m", "mcp_server.server"], cwd=ROOT, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    process.log_path = log.name
+    return process
+
+
+async def wait_ready(session, url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            with open(process.log_path, encoding="utf-8", errors="replace") as f:
+                tail = f.read()[-2000:]
+            raise RuntimeError(f"服务器进程已退出 (code {process.returncode}):\n{tail}")
+        try:
+            async with session.get(f"{url}/metrics") as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"服务器在 {timeout}s 内没有就绪")
+
+
+def stop_server(process):
+    # SIGINT 触发 aiohttp 的正常关闭流程 (写出日志、关闭连接池)
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# --- /metrics ---
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+_LABEL_RE = re.compile(r'(\w+)="([^"]*)"')
+
+
+def parse_metrics(text):
+    """Prometheus 文本格式 -> {(指标名, 标签元组): 数值}"""
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE_RE.match(line)
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        key = tuple(sorted(_LABEL_RE.findall(labels or "")))
+        samples[(name, key)] = float(value)
+    return samples
+
+
+async def scrape(session, url):
+    async with session.get(f"{url}/metrics") as resp:
+        return parse_metrics(await resp.text())
+
+
+def _delta(after, before, name, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    return after.get(key, 0.0) - before.get(key, 0.0)
+
+
+def _histogram_quantile(after, before, name, q):
+    """由两次抓取之间的分桶计数估算分位数 (取所在桶的上界)"""
+    buckets = []
+    for (metric, labels), _ in after.items():
+        if metric == f"{name}_bucket":
+            le = dict(labels)["le"]
+            buckets.append((float("inf") if le == "+Inf" else float(le), labels))
+    buckets.sort()
+    total = _delta(after, before, f"{name}_count")
+    if not total:
+        return None
+    for bound, labels in buckets:
+        if after[(f"{name}_bucket", labels)] - before.get((f"{name}_bucket", labels), 0.0) >= total * q:
+            return bound
+    return None
+
+
+def server_breakdown(before, after):
+    count = _delta(after, before, "nl2sql_db_pool_wait_seconds_count")
+    wait_sum = _delta(after, before, "nl2sql_db_pool_wait_seconds_sum")
+    p95 = _histogram_quantile(after, before, "nl2sql_db_pool_wait_seconds", 0.95)
+    pool_wait = {
+        "count": int(count),
+        "mean_ms": round(wait_sum / count * 1000, 3) if count else None,
+        "p95_le_ms": None if p95 is None else (p95 * 1000 if p95 != float("inf") else "+Inf"),
+    }
+    stages = {}
+    for (metric, labels), _ in after.items():
+        if metric != "nl2sql_stage_seconds_count":
+            continue
+        stage = dict(labels)["stage"]
+        n = _delta(after, before, metric, stage=stage)
+        if n:
+            total = _delta(after, before, "nl2sql_stage_seconds_sum", stage=stage)
+            stages[stage] = {"count": int(n), "mean_ms": round(total / n * 1000, 3)}
+    errors = {}
+    for (metric, labels), _ in after.items():
+        if metric == "nl2sql_errors_total":
+            n = _delta(after, before, metric, **dict(labels))
+            if n:
+                errors[",".join(f"{k}={v}" for k, v in labels)] = int(n)
+    return {"pool_wait": pool_wait, "stages": dict(sorted(stages.items())), "errors": errors}
+
+
+# --- 负载生成 ---
+
+def build_schedule(args, duration, seed, unique_ratio):
+    """
+    按目标 RPS 生成泊松到达的请求序列: [(相对时间, 接口, 参数)]。
+    /query 以 unique_ratio 的比例使用从未出现过的问题 (加编号的变体)，使其必须经过 LLM。
+    """
+    rng = random.Random(seed)
+    questions = list(QUESTIONS)
+    variants = 0
+    endpoints = list(args.mix)
+    weights = [args.mix[e] for e in endpoints]
+    schedule = []
+    t = rng.expovariate(args.rps)
+    while t < duration:
+        endpoint = rng.choices(endpoints, weights)[0]
+        if endpoint == "query":
+            question = rng.choice(questions)
+            if rng.random() < unique_ratio:
+                variants += 1
+                question = f"{question} (variant {seed}.{variants})"
+            params = {"prompt": question}
+        elif endpoint == "schema":
+            params = rng.choice(SCHEMA_PARAMS)
+        else:
+            params = rng.choice(LOGS_PARAMS)
+        schedule.append((t, endpoint, params))
+        t += rng.expovariate(args.rps)
+    return schedule
+
+
+async def _fire(session, url, endpoint, params, timeout):
+    if endpoint == "query":
+        request = session.post(f"{url}/query", json=params, timeout=timeout)
+    else:
+        request = session.get(f"{url}/{endpoint}", params=params, timeout=timeout)
+    async with request as resp:
+        body = await resp.read()
+        if resp.status == 200 and endpoint == "query":
+            # /query 以 200 返回 LLM 无法回答等业务错误
+            return "error" not in json.loads(body)
+        return resp.status == 200
+
+
+async def run_load(session, url, schedule, timeout):
+    """
+    开环发送：每个请求在计划时间发出，不等待其他请求完成。
+    延迟从计划时间算起，客户端积压造成的延迟也计入 (避免协调遗漏)。
+    """
+    loop = asyncio.get_running_loop()
+    results = []
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def one(scheduled, endpoint, params):
+        ok = False
+        try:
+            ok = await _fire(session, url, endpoint, params, client_timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        results.append((endpoint, ok, loop.time() - scheduled))
+
+    start = loop.time()
+    tasks = []
+    for offset, endpoint, params in schedule:
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(start + offset, endpoint, params)))
+    await asyncio.gather(*tasks)
+    return results, loop.time() - start
+
+
+def summarize(results, elapsed):
+    def stats(rows):
+        latencies = [latency for _, _, latency in rows]
+        ok = sum(1 for _, success, _ in rows if success)
+        return {
+            "count": len(rows),
+            "errors": len(rows) - ok,
+            "throughput_rps": round(ok / elapsed, 2),
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+            "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1),
+        }
+
+    endpoints = {}
+    for endpoint in sorted({e for e, _, _ in results}):
+        endpoints[endpoint] = stats([r for r in results if r[0] == endpoint])
+    return {"overall": stats(results), "endpoints": endpoints}
+
+
+def compare(current, baseline, tolerance, min_delta_ms):
+    """
+    与基线对比延迟分位数和吞吐量，返回 (对比行, 是否存在超出容差的退化)。
+    延迟的绝对变化不超过 min_delta_ms 时不算退化 (几毫秒的接口抖动比例很大)。
+    """
+    lines = []
+    regressed = False
+    sections = [("overall", current["overall"], baseline.get("overall"))]
+    sections += [(e, s, baseline.get("endpoints", {}).get(e)) for e, s in current["endpoints"].items()]
+    for name, now, before in sections:
+        if not before:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            if not before.get(key):
+                continue
+            change = (now[key] - before[key]) / before[key]
+            if key == "throughput_rps":
+                worse = change < -tolerance
+            else:
+                worse = change > tolerance and now[key] - before[key] > min_delta_ms
+            regressed |= worse and key != "p50_ms"
+            lines.append(f"  {name:8s} {key:15s} {before[key]:9.1f} -> {now[key]:9.1f}  "
+                         f"{change:+.1%}{'  !' if worse else ''}")
+    return lines, regressed
+
+
+async def main_async(args):
+    result = {"config": {k: v for k, v in vars(args).items()
+                         if k not in ("db_password", "json", "output", "baseline")}}
+    if args.url is None:
+        result["db_load"] = await prepare_database(args)
+
+    # 预热只使用基础问题，填充缓存
+    warm = build_schedule(args, args.warmup, args.seed + 1, 0.0)
+    schedule = build_schedule(args, args.duration, args.seed, args.unique_ratio)
+    questions = dict(QUESTIONS)
+    for _, endpoint, params in schedule:
+        if endpoint == "query":
+            questions[params["prompt"]] = QUESTIONS[params["prompt"].rsplit(" (variant ", 1)[0]]
+
+    workdir = tempfile.mkdtemp(prefix="nl2sql-load-")
+    process = None
+    url = args.url or f"http://127.0.0.1:{args.port}"
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        try:
+            if args.url is None:
+                process = start_server(args, workdir, questions)
+            await wait_ready(session, url, process)
+            if warm:
+                await run_load(session, url, warm, args.timeout)
+            before = await scrape(session, url)
+            results, elapsed = await run_load(session, url, schedule, args.timeout)
+            after = await scrape(session, url)
+        finally:
+            if process is not None:
+                stop_server(process)
+    result.update(summarize(results, elapsed))
+    result["target_rps"] = args.rps
+    result["elapsed_seconds"] = round(elapsed, 2)
+    result["server"] = server_breakdown(before, after)
+    result["server_log"] = None if process is None else process.log_path
+    return result
+
+
+def main():
+    load_dotenv(os.path.join(ROOT, ".env"))
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rps", type=float, default=20, help="目标请求速率")
+    parser.add_argument("--duration", type=float, default=30, help="计入统计的压测时长 (秒)")
+    parser.add_argument("--warmup", type=float, default=3, help="不计入统计的预热时长 (秒)")
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("query=0.8,schema=0.1,logs=0.1"),
+                        help="各接口的请求比例")
+    parser.add_argument("--unique-ratio", type=float, default=0.2,
+                        help="/query 中首次出现、不能命中缓存的问题比例")
+    parser.add_argument("--timeout", type=float, default=60, help="单个请求的超时 (秒)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="假模型的基础延迟 (秒)")
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--llm-tail-prob", type=float, default=0.02)
+    parser.add_argument("--llm-tail-latency", type=float, default=2.0)
+    parser.add_argument("--llm-token-latency", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--url", help="压测已在运行的服务器 (不启动子进程、不导入数据库)")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="传给服务器进程的额外环境变量，可重复")
+    parser.add_argument("--db-host", default=os.getenv("DB_HOST", "127.0.0.1"))
+    parser.add_argument("--db-port", type=int, default=int(os.getenv("DB_PORT", 3306)))
+    parser.add_argument("--db-user", default=os.getenv("DB_USER", "root"))
+    parser.add_argument("--db-password", default=os.getenv("DB_PASSWORD", ""))
+    parser.add_argument("--db-name", default="college_bench")
+    parser.add_argument("--sql-file", default=os.path.join(ROOT, "college.sql"))
+    parser.add_argument("--reload", action="store_true", help="重新导入压测库")
+    parser.add_argument("--db-scale", type=int, default=1,
+                        help="导入时把 student / takes / advisor 扩充的倍数 (改变后需加 --reload)")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="与之前 --output 写出的结果对比")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="p95 / p99 / 吞吐量的退化超过该比例时以状态码 1 退出")
+    parser.add_argument("--min-delta-ms", type=float, default=5,
+                        help="延迟增加不超过该值 (毫秒) 时不算退化")
+    parser.add_argument("--json", action="store_true", help="输出机器可读的 JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    regressed = False
+    comparison = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            comparison, regressed = compare(result, json.load(f), args.tolerance, args.min_delta_ms)
+        result["regressed"] = regressed
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        overall = result["overall"]
+        print(f"目标 {args.rps} rps, {result['elapsed_seconds']}s, 共 {overall['count']} 个请求, "
+              f"失败 {overall['errors']} 个, 吞吐量 {overall['throughput_rps']} rps")
+        for name, r in [("overall", overall)] + list(result["endpoints"].items()):
+            print(f"  {name:8s} p50 {r['p50_ms']:8.1f} ms   p95 {r['p95_ms']:8.1f} ms   "
+                  f"p99 {r['p99_ms']:8.1f} ms   n={r['count']}")
+        pool_wait = result["server"]["pool_wait"]
+        print(f"  连接池等待: 平均 {pool_wait['mean_ms']} ms, p95 <= {pool_wait['p95_le_ms']} ms")
+        for stage, s in result["server"]["stages"].items():
+            print(f"  阶段 {stage:20s} 平均 {s['mean_ms']:9.3f} ms   n={s['count']}")
+        if comparison:
+            print(f"与基线 {args.baseline} 对比:")
+            print("\n".join(comparison))
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -26,6 +26,19 @@ def query_mcp_server(prompt, offset=0):
     except requests.exceptions.RequestException as e:
         return {"error": f"连接 MCP 服务器失败: {e}"}
 
+def fetch_next_page(cursor_id):
+    """通过服务端游标获取下一页，不会重新生成 SQL"""
+    try:
+        response = requests.post(
+            f"{MCP_SERVER_URL}/query/next",
+            json={"cursor": cursor_id},
+            timeout=60
+        )
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        return {"error": f"连接 MCP 服务器失败: {e}"}
+
 def display_results(result):
     """以表格形式美观地展示查询结果"""
     if not result or not result.get("data"):
@@ -52,11 +65,10 @@ def main():
     console.print("[bold cyan]欢迎使用自然语言数据库查询 CLI[/bold cyan]")
     console.print(f"后端服务器: [link={MCP_SERVER_URL}]{MCP_SERVER_URL}[/link]")
     
-    last_prompt = ""
-    current_offset = 0
+    cursor_id = None
 
     while True:
-        if not last_prompt:
+        if not cursor_id:
             prompt = console.input("[bold]请输入你的问题 (输入 'exit' 退出): [/bold]")
         else:
             prompt = console.input(f"[bold]输入 'next' 获取下一页, 'exit' 退出, 或输入新问题: [/bold]")
@@ -65,18 +77,16 @@ def main():
             break
             
         if prompt.lower() == 'next':
-            if not last_prompt:
+            if not cursor_id:
                 console.print("[yellow]没有可用于翻页的查询，请输入一个新问题。[/yellow]")
                 continue
-            prompt_to_send = last_prompt
+            with console.status("[bold green]正在加载下一页...[/bold green]"):
+                result = fetch_next_page(cursor_id)
         else:
             # 是一个新问题，重置状态
-            current_offset = 0
-            last_prompt = prompt
-            prompt_to_send = prompt
-
-        with console.status("[bold green]正在查询...[/bold green]"):
-            result = query_mcp_server(prompt_to_send, current_offset)
+            cursor_id = None
+            with console.status("[bold green]正在查询...[/bold green]"):
+                result = query_mcp_server(prompt)
 
         if "error" in result:
             console.print(f"[bold red]错误: {result['error']}[/bold red]")
@@ -84,7 +94,7 @@ def main():
                 console.print("生成的 (错误的) SQL:")
                 syntax = Syntax(result["generated_sql"], "sql", theme="default", line_numbers=True)
                 console.print(syntax)
-            last_prompt = "" # 出错了，重置
+            cursor_id = None # 出错了，重置
             continue
 
         console.print("\n[bold blue]LLM 生成的 SQL:[/bold blue]")
@@ -93,13 +103,12 @@ def main():
         
         display_results(result)
 
-        if result.get("next_offset"):
-            current_offset = result["next_offset"]
+        if result.get("cursor"):
+            cursor_id = result["cursor"]
             console.print("[cyan]提示: 查询结果有多页，输入 'next' 查看下一页。[/cyan]\n")
         else:
             console.print("[cyan]已是最后一页。[/cyan]\n")
-            last_prompt = "" # 最后一页，重置
-            current_offset = 0
+            cursor_id = None # 最后一页，重置
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+# core/cost_guard.py
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+# 成本闸门模式: reject (超限时拒绝执行) | warn (只在响应中提示) | off
+COST_GATE_MODE = os.getenv("COST_GATE_MODE", "reject").lower()
+# 优化器估算的查询成本与结果行数上限
+QUERY_MAX_COST = float(os.getenv("QUERY_MAX_COST", 5_000_000))
+QUERY_MAX_ROWS = float(os.getenv("QUERY_MAX_ROWS", 10_000_000))
+# 对超过该行数的表做全表扫描时视为超限
+QUERY_FULL_SCAN_ROWS = float(os.getenv("QUERY_FULL_SCAN_ROWS", 1_000_000))
+# 单条语句的执行时间上限 (秒)，同时用于 MAX_EXECUTION_TIME 提示与客户端超时
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", 30))
+# 执行计划的缓存时间 (秒)；数据量变化后估算值会随之变化
+COST_PLAN_TTL = float(os.getenv("COST_PLAN_TTL", 300))
+COST_PLAN_CACHE_SIZE = int(os.getenv("COST_PLAN_CACHE_SIZE", 1024))
+
+# 客户端超时比服务端多留一点时间，让 MAX_EXECUTION_TIME 先生效并返回明确的错误
+_CLIENT_GRACE = 1.0
+# MySQL 中表示语句被中断 / 超时的错误码
+_TIMEOUT_ERRORS = {1317, 3024}
+
+
+class QueryTimeoutError(Exception):
+    """查询超过执行时间上限，已在服务端终止"""
+
+
+class PlanSummary:
+    """EXPLAIN FORMAT=JSON 的摘要：估算成本、结果行数、大表全表扫描与排序/临时表"""
+
+    __slots__ = ("cost", "rows", "full_scans", "filesort", "temporary", "violations")
+
+    def __init__(self, cost=0.0, rows=0.0):
+        self.cost = cost
+        self.rows = rows
+        self.full_scans = []  # [(表名, 估算扫描行数)]
+        self.filesort = False
+        self.temporary = False
+        self.violations = []
+
+    def to_dict(self):
+        result = {"query_cost": self.cost, "estimated_rows": self.rows}
+        if self.full_scans:
+            result["full_scans"] = [{"table": t, "rows": r} for t, r in self.full_scans]
+        if self.filesort:
+            result["using_filesort"] = True
+        if self.temporary:
+            result["using_temporary"] = True
+        if self.violations:
+            result["violations"] = list(self.violations)
+        return result
+
+    def describe(self):
+        """供日志或提示词使用的一行文字描述"""
+        parts = [f"cost={self.cost:.0f}", f"rows={self.rows:.0f}"]
+        parts += [f"full scan on {t} ({r:.0f} rows)" for t, r in self.full_scans]
+        if self.filesort:
+            parts.append("filesort")
+        if self.temporary:
+            parts.append("temporary table")
+        return ", ".join(parts)
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _walk_plan(node, summary):
+    if isinstance(node, list):
+        for item in node:
+            _walk_plan(item, summary)
+        return
+    if not isinstance(node, dict):
+        return
+    if node.get("using_filesort"):
+        summary.filesort = True
+    if node.get("using_temporary_table"):
+        summary.temporary = True
+    table = node.get("table")
+    if isinstance(table, dict) and "table_name" in table:
+        produced = _number(table.get("rows_produced_per_join"))
+        summary.rows = max(summary.rows, produced)
+        examined = _number(table.get("rows_examined_per_scan"))
+        if table.get("access_type") == "ALL" and examined >= QUERY_FULL_SCAN_ROWS:
+            summary.full_scans.append((table["table_name"], examined))
+    for value in node.values():
+        if isinstance(value, (dict, list)):
+            _walk_plan(value, summary)
+
+
+def summarize_plan(plan: dict) -> PlanSummary:
+    """从 EXPLAIN FORMAT=JSON 的结果中提取成本信息，并按阈值给出超限原因"""
+    block = plan.get("query_block", plan)
+    summary = PlanSummary(cost=_number(block.get("cost_info", {}).get("query_cost")))
+    _walk_plan(block, summary)
+    if summary.cost > QUERY_MAX_COST:
+        summary.violations.append(f"estimated cost {summary.cost:.0f} exceeds {QUERY_MAX_COST:.0f}")
+    if summary.rows > QUERY_MAX_ROWS:
+        summary.violations.append(f"estimated rows {summary.rows:.0f} exceed {QUERY_MAX_ROWS:.0f}")
+    for table, rows in summary.full_scans:
+        summary.violations.append(f"full table scan on {table} ({rows:.0f} rows)")
+    return summary
+
+
+class CostGuard:
+    """
+    执行前用 EXPLAIN 估算生成 SQL 的成本，超过阈值时拒绝 (或标记)。
+    执行计划按 (规范化 SQL, Schema 版本) 缓存，缓存命中的问题不会重复 EXPLAIN。
+    """
+
+    def __init__(self, mode=COST_GATE_MODE, ttl=COST_PLAN_TTL, max_entries=COST_PLAN_CACHE_SIZE):
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._plans = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    async def explain(self, pool, sql, key=None) -> PlanSummary:
+        """执行 EXPLAIN FORMAT=JSON 并返回摘要；SQL 本身有错时抛出数据库异常"""
+        if key is not None:
+            cached = self._plans.get(key)
+            if cached is not None and time.monotonic() - cached[1] <= self.ttl:
+                self._plans.move_to_end(key)
+                return cached[0]
+
+        statement = sql.strip().rstrip(";")
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"EXPLAIN FORMAT=JSON {statement}")
+                row = await cursor.fetchone()
+        summary = summarize_plan(json.loads(row[0]))
+
+        if key is not None:
+            self._plans[key] = (summary, time.monotonic())
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+        return summary
+
+    def rejects(self, summary: PlanSummary) -> bool:
+        return self.mode == "reject" and bool(summary.violations)
+
+
+def with_time_limit(sql: str, seconds=QUERY_TIMEOUT) -> str:
+    """为以 SELECT 开头的语句加上 MAX_EXECUTION_TIME 优化器提示 (毫秒)"""
+    stripped = sql.lstrip()
+    if seconds <= 0 or stripped[:6].upper() != "SELECT" or not stripped[6:7].isspace():
+        return sql
+    return f"SELECT /*+ MAX_EXECUTION_TIME({int(seconds * 1000)}) */{stripped[6:]}"
+
+
+def is_timeout_error(error) -> bool:
+    if isinstance(error, (QueryTimeoutError, asyncio.TimeoutError)):
+        return True
+    args = getattr(error, "args", ())
+    return bool(args) and args[0] in _TIMEOUT_ERRORS
+
+
+async def kill_query(pool, conn):
+    """通过另一个连接终止 conn 上正在执行的语句 (尽力而为)"""
+    try:
+        thread_id = conn.thread_id()
+        async with pool.acquire() as killer:
+            async with killer.cursor() as cursor:
+                await cursor.execute("KILL QUERY %s", (thread_id,))
+        logging.warning(f"已终止超时的查询 (连接 {thread_id})。")
+    except Exception as e:
+        logging.warning(f"终止超时查询失败: {e}")
+
+
+async def run_bounded(pool, conn, coro, timeout=QUERY_TIMEOUT, deadline=None):
+    """
+    在客户端超时内等待 conn 上的数据库操作。
+    deadline (time.monotonic() 时刻) 用于跨多次调用的总时限 (如逐批读取的流式查询)，
+    给出时按它计算剩余时间，timeout 只用于错误信息。
+    超时或被取消时在服务端终止该语句，并关闭连接 (协议状态已不可复用，连接池会丢弃它)。
+    """
+    if timeout <= 0:
+        return await coro
+    wait = timeout if deadline is None else deadline - time.monotonic()
+    try:
+        return await asyncio.wait_for(coro, max(wait + _CLIENT_GRACE, 0))
+    except asyncio.TimeoutError:
+        conn.close()
+        try:
+            await asyncio.wait_for(kill_query(pool, conn), 5)
+        except asyncio.TimeoutError:
+            logging.warning("终止超时查询时获取连接超时。")
+        raise QueryTimeoutError(f"Query exceeded the {timeout:g}s execution time limit.")
+    except asyncio.CancelledError:
+        conn.close()
+        asyncio.ensure_future(kill_query(pool, conn))
+        raise
@@ -0,0 +1,114 @@
+# core/cursors.py
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+# 游标空闲多久后过期 (秒)
+CURSOR_IDLE_TTL = float(os.getenv("CURSOR_IDLE_TTL", 300))
+# 同时保留的游标数上限，超过时淘汰最久未使用的游标
+CURSOR_MAX_OPEN = int(os.getenv("CURSOR_MAX_OPEN", 1000))
+
+
+class QueryCursor:
+    """绑定到一条已通过安全校验的 SQL 的分页游标"""
+
+    __slots__ = ("id", "question", "sql", "page_size", "next_offset", "plan", "after", "last_used")
+
+    def __init__(self, question, sql, page_size, next_offset, plan=None, after=None, cursor_id=None):
+        self.id = cursor_id or uuid.uuid4().hex
+        self.question = question
+        self.sql = sql
+        self.page_size = page_size
+        self.next_offset = next_offset
+        # 分页方案与键集分页的 seek 起点 (上一页最后一行的键值)
+        self.plan = plan
+        self.after = after
+        self.last_used = time.monotonic()
+
+
+class CursorStore:
+    """
+    服务端结果游标存储。
+    翻页时直接使用游标里保存的 SQL，不再调用 LLM 和安全校验；
+    游标按最近使用顺序保存，空闲超时或数量超限时淘汰。
+    配置了 shared (SharedCache) 时游标状态以共享缓存为准，任一工作进程都能继续翻页：
+    save 写入当前位置，lookup 读取最新位置 (本进程没有该游标时据此重建)。
+    """
+
+    def __init__(self, idle_ttl=CURSOR_IDLE_TTL, max_open=CURSOR_MAX_OPEN, shared=None):
+        self.idle_ttl = idle_ttl
+        self.max_open = max_open
+        self.shared = shared
+        self._cursors = OrderedDict()
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.idle_ttl
+        while self._cursors:
+            oldest = next(iter(self._cursors.values()))
+            if oldest.last_used > deadline:
+                break
+            self._cursors.popitem(last=False)
+
+    def open(self, question, sql, page_size, next_offset, plan=None, after=None):
+        """创建一个新游标并返回它"""
+        return self._add(QueryCursor(question, sql, page_size, next_offset, plan, after))
+
+    def _add(self, cursor):
+        self._expire()
+        while len(self._cursors) >= self.max_open:
+            self._cursors.popitem(last=False)
+        self._cursors[cursor.id] = cursor
+        return cursor
+
+    @property
+    def _sharing(self):
+        return self.shared is not None and self.shared.enabled
+
+    async def save(self, cursor):
+        """把游标的当前位置写入共享缓存 (未配置时不做任何事)"""
+        if self._sharing:
+            await self.shared.write("cursor", cursor.id, {
+                "question": cursor.question, "sql": cursor.sql, "page_size": cursor.page_size,
+                "next_offset": cursor.next_offset, "after": cursor.after,
+            })
+
+    async def lookup(self, cursor_id, plan_for):
+        """
+        与 get 相同，但配置了共享缓存时以共享缓存中的位置为准。
+        plan_for(sql) 用于在本进程重建游标时重新生成分页方案。
+        """
+        cursor = self.get(cursor_id)
+        if not self._sharing:
+            return cursor
+        entry = await self.shared.get("cursor", cursor_id)
+        if entry is None or time.time() - entry[1] > self.idle_ttl:
+            self._cursors.pop(cursor_id, None)
+            return None
+        state = entry[0]
+        after = tuple(state["after"]) if state["after"] is not None else None
+        if cursor is None:
+            cursor = self._add(QueryCursor(state["question"], state["sql"], state["page_size"],
+                                           state["next_offset"], plan_for(state["sql"]), after,
+                                           cursor_id=cursor_id))
+        else:
+            cursor.next_offset = state["next_offset"]
+            cursor.after = after
+        return cursor
+
+    def get(self, cursor_id):
+        """取出游标并刷新其使用时间；不存在或已过期时返回 None"""
+        self._expire()
+        cursor = self._cursors.get(cursor_id)
+        if cursor is not None:
+            cursor.last_used = time.monotonic()
+            self._cursors.move_to_end(cursor_id)
+        return cursor
+
+    def close(self, cursor_id):
+        self._cursors.pop(cursor_id, None)
+        if self.shared is not None:
+            self.shared.delete("cursor", cursor_id)
@@ -0,0 +1,137 @@
+# core/examples.py
+import os
+import zlib
+import logging
+
+import numpy as np
+
+from .sql_cache import normalize_question
+
+# 每个 Prompt 中放入的相似示例数量 (0 表示始终使用内置示例)
+FEW_SHOT_K = int(os.getenv("FEW_SHOT_K", 3))
+# 相似度低于该值的示例不使用
+FEW_SHOT_MIN_SCORE = float(os.getenv("FEW_SHOT_MIN_SCORE", 0.3))
+# 示例库最多保存的 (问题, SQL) 对数，超出后淘汰最早加入的
+FEW_SHOT_MAX_EXAMPLES = int(os.getenv("FEW_SHOT_MAX_EXAMPLES", 2000))
+
+# 字符 n-gram 哈希到的维度 (2 的幂)
+VECTOR_DIM = 2048
+_NGRAM_SIZES = (2, 3)
+
+
+def ngram_counts(text: str) -> np.ndarray:
+    """问题的字符 n-gram 词频向量 (哈希到 VECTOR_DIM 维，次线性缩放)"""
+    padded = f" {normalize_question(text)} "
+    indices = [
+        zlib.crc32(padded[i:i + n].encode("utf-8")) & (VECTOR_DIM - 1)
+        for n in _NGRAM_SIZES
+        for i in range(len(padded) - n + 1)
+    ]
+    counts = np.bincount(indices, minlength=VECTOR_DIM).astype(np.float32)
+    nonzero = counts > 0
+    counts[nonzero] = 1.0 + np.log(counts[nonzero])
+    return counts
+
+
+class ExampleStore:
+    """
+    已验证 (执行成功) 的 问题 → SQL 示例库，用字符 n-gram TF-IDF 余弦相似度检索。
+    词频矩阵按行追加，文档频率随之增量更新；IDF 加权后的行范数只在示例变化后的首次检索时重算。
+    """
+
+    def __init__(self, max_examples=FEW_SHOT_MAX_EXAMPLES):
+        self.max_examples = max_examples
+        self._tf = np.zeros((0, VECTOR_DIM), dtype=np.float32)
+        self._df = np.zeros(VECTOR_DIM, dtype=np.float32)
+        self._questions = []
+        self._sqls = []
+        self._slots = {}  # 规范化问题 -> 行号
+        self._oldest = 0  # 满员后下一个被覆盖的行
+        self._norms = None
+
+    def __len__(self):
+        return len(self._questions)
+
+    def add(self, question, sql):
+        """加入或更新一个示例"""
+        key = normalize_question(question)
+        if not key or self.max_examples <= 0:
+            return
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._questions[slot] = question
+            self._sqls[slot] = sql
+            return
+
+        tf = ngram_counts(question)
+        if len(self._questions) < self.max_examples:
+            slot = len(self._questions)
+            self._grow(slot + 1)
+            self._questions.append(question)
+            self._sqls.append(sql)
+        else:
+            slot = self._oldest
+            self._oldest = (slot + 1) % self.max_examples
+            del self._slots[normalize_question(self._questions[slot])]
+            self._df -= self._tf[slot] > 0
+            self._questions[slot] = question
+            self._sqls[slot] = sql
+        self._tf[slot] = tf
+        self._df += tf > 0
+        self._slots[key] = slot
+        self._norms = None
+
+    def _grow(self, rows):
+        capacity = self._tf.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = min(max(rows, capacity * 2, 64), self.max_examples)
+        grown = np.zeros((new_capacity, VECTOR_DIM), dtype=np.float32)
+        grown[:capacity] = self._tf
+        self._tf = grown
+
+    def _idf(self):
+        n = len(self._questions)
+        return np.log((1.0 + n) / (1.0 + self._df)) + 1.0
+
+    def search(self, question, k=FEW_SHOT_K, min_score=FEW_SHOT_MIN_SCORE):
+        """返回最相似的至多 k 个示例 [(相似度, 问题, SQL)]，按相似度从高到低排列"""
+        n = len(self._questions)
+        if n == 0 or k <= 0:
+            return []
+        idf = self._idf()
+        query = ngram_counts(question) * idf
+        query_norm = float(np.linalg.norm(query))
+        if query_norm == 0.0:
+            return []
+        tf = self._tf[:n]
+        if self._norms is None:
+            # ||tf * idf|| = sqrt(tf² · idf²)，无需物化加权矩阵
+            self._norms = np.sqrt((tf * tf) @ (idf * idf))
+        scores = (tf @ (query * idf)) / (np.maximum(self._norms, 1e-12) * query_norm)
+
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self._questions[i], self._sqls[i])
+                for i in top if scores[i] >= min_score]
+
+    def load_from_log(self, entries):
+        """用查询日志中执行成功的条目 (从新到旧) 初始化示例库，每个问题只保留最新的 SQL"""
+        seen = set()
+        selected = []
+        for entry in entries:
+            if entry.get("status") != "success" or not entry.get("sql"):
+                continue
+            key = normalize_question(entry["question"])
+            if key in seen:
+                continue
+            seen.add(key)
+            selected.append(entry)
+            if len(selected) >= self.max_examples:
+                break
+        # 按时间顺序加入，使淘汰顺序与日志一致
+        for entry in reversed(selected):
+            self.add(entry["question"], entry["sql"])
+        if selected:
+            logging.info(f"已从查询日志加载 {len(self)} 个 few-shot 示例。")
@@ -0,0 +1,167 @@
+# core/hedging.py
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from . import metrics
+
+# 生成调度模式: hedge (主请求过慢时补发一次) | race (同时请求所有模型) | off
+LLM_HEDGE_MODE = os.getenv("LLM_HEDGE_MODE", "hedge").lower()
+# 补发前的等待时间取最近调用耗时的该分位数
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+# 耗时样本不足时使用的等待时间，以及等待时间的下限 (秒)
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", 3.0))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", 0.5))
+# 额外请求的预算：每个主请求积攒的额度 (0.1 即额外请求最多为主请求的 10%) 与额度上限
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", 0.1))
+LLM_HEDGE_BURST = float(os.getenv("LLM_HEDGE_BURST", 5))
+
+# 用于估算分位数的最近耗时样本数，以及开始使用分位数所需的最少样本数
+_LATENCY_WINDOW = 200
+_MIN_SAMPLES = 20
+
+
+class HedgeBudget:
+    """令牌桶：每个主请求存入 ratio 个令牌，每个额外请求消耗一个，最多积攒 burst 个"""
+
+    def __init__(self, ratio=LLM_HEDGE_BUDGET, burst=LLM_HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LatencyTracker:
+    """最近若干次调用的耗时 (被取消的调用记为已等待的时间)，用于确定补发请求的等待时间"""
+
+    def __init__(self, window=_LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, p):
+        """第 p 百分位的耗时；样本不足时返回 None"""
+        if len(self._samples) < _MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class GenerationScheduler:
+    """
+    在一个或多个 LLM 客户端之间调度一次生成，降低长尾延迟：
+    hedge 模式先只请求主模型，超过最近耗时的分位数仍未返回时向下一个模型
+    (只配置了一个模型时为同一模型) 补发一次；race 模式同时请求所有模型。
+    采用第一个通过 accept 校验的输出并取消其余请求；主请求出错或输出未通过校验时立即补发。
+    所有额外请求都受 HedgeBudget 限制，预算用完时退化为单次调用。
+    """
+
+    def __init__(self, clients, mode=LLM_HEDGE_MODE, percentile=LLM_HEDGE_PERCENTILE,
+                 delay=LLM_HEDGE_DELAY, min_delay=LLM_HEDGE_MIN_DELAY, budget=None):
+        self.clients = list(clients)
+        self.mode = mode
+        self.percentile = percentile
+        self.delay = delay
+        self.min_delay = min_delay
+        self.budget = budget or HedgeBudget()
+        self.latency = LatencyTracker()
+
+    @property
+    def pending(self):
+        return sum(c.pending for c in self.clients)
+
+    @property
+    def timeout(self):
+        return self.clients[0].timeout
+
+    def hedge_delay(self):
+        observed = self.latency.percentile(self.percentile)
+        return max(self.min_delay, self.delay if observed is None else observed)
+
+    async def generate(self, prompt: str, timeout=None, accept=None) -> str:
+        """
+        返回第一个通过 accept(输出) 校验的模型输出；都未通过时返回最先完成的输出，
+        全部失败时抛出第一个异常。timeout 覆盖包括补发在内的全部请求。
+        """
+        return await asyncio.wait_for(self._generate(prompt, accept), timeout or self.timeout)
+
+    async def _call(self, index, prompt):
+        client = self.clients[index]
+        start = time.perf_counter()
+        try:
+            text = await client.generate(prompt)
+        except asyncio.CancelledError:
+            # 被取消的请求 (补发后落败、整体超时) 往往正是最慢的那些：只统计完成的请求会系统性地
+            # 低估分位数，使等待时间越来越短、补发越来越多。以已等待的时间作为其耗时的下限计入。
+            self.latency.observe(time.perf_counter() - start)
+            raise
+        elapsed = time.perf_counter() - start
+        self.latency.observe(elapsed)
+        metrics.LLM_CALL_SECONDS.observe(elapsed, model=client.model)
+        return text
+
+    def _extra(self, tasks, index, prompt):
+        """在预算允许时发出一个额外请求"""
+        if not self.budget.try_spend():
+            metrics.LLM_HEDGES.inc(event="budget_exhausted")
+            return False
+        metrics.LLM_HEDGES.inc(event="fired")
+        tasks[asyncio.ensure_future(self._call(index, prompt))] = (index, True)
+        return True
+
+    async def _generate(self, prompt, accept):
+        self.budget.deposit()
+        # 任务 -> (客户端序号, 是否额外请求)
+        tasks = {asyncio.ensure_future(self._call(0, prompt)): (0, False)}
+        hedging = self.mode == "hedge"
+        if self.mode == "race":
+            for index in range(1, len(self.clients)):
+                self._extra(tasks, index, prompt)
+        hedge_at = time.monotonic() + self.hedge_delay()
+        fallback = None
+        try:
+            while tasks:
+                wait = max(0.0, hedge_at - time.monotonic()) if hedging else None
+                done, _ = await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 主请求超过等待时间仍未返回
+                    hedging = False
+                    self._extra(tasks, 1 % len(self.clients), prompt)
+                    continue
+                for task in done:
+                    index, extra = tasks.pop(task)
+                    try:
+                        text = task.result()
+                    except Exception as e:
+                        logging.warning(f"LLM 调用失败 ({self.clients[index].model}): {e}")
+                        if fallback is None:
+                            fallback = e
+                    else:
+                        if accept is None or accept(text):
+                            if extra:
+                                metrics.LLM_HEDGES.inc(event="won")
+                            return text
+                        metrics.LLM_HEDGES.inc(event="rejected")
+                        if fallback is None or isinstance(fallback, Exception):
+                            fallback = text
+                if hedging and not tasks:
+                    # 主请求失败或输出未通过校验，不再等待，立即补发
+                    hedging = False
+                    self._extra(tasks, 1 % len(self.clients), prompt)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if isinstance(fallback, Exception):
+            raise fallback
+        return fallback
@@ -1,25 +1,385 @@
 # core/llm_handler.py
 import os
+import json
+import random
+import asyncio
 import logging
-from dashscope import Generation
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# 确保 API Key 已加载
+from . import metrics
+from . import security
+from . import hedging
+from .hedging import GenerationScheduler
+from .sql_extract import extract_sql, read_first_statement
+
+# --- LLM 客户端配置 ---
+LLM_BACKEND = os.getenv("LLM_BACKEND", "dashscope")          # dashscope | fake
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen-turbo")             # 或 qwen-plus
+# 补发 / 竞速请求使用的其他模型 (逗号分隔)；未配置时补发给同一模型
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 32))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))
+# 流式读取模型输出，识别出第一条完整的 SQL 后立即停止生成 (设为 0 时等待完整输出)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") != "0"
+
+# API Key 在服务器启动时由 config_errors() 检查 (使用假模型时不需要)
 QWEN_API_KEY = os.getenv("DASHSCOPE_API_KEY")
-if not QWEN_API_KEY:
-    raise ValueError("错误：环境变量 DASHSCOPE_API_KEY 未设置。")
 
-def build_prompt(user_question: str, schema_string: str) -> str:
+CANNOT_ANSWER = "Error: Cannot answer the question with the given schema."
+
+
+class LLMError(Exception):
+    """LLM 后端调用失败"""
+
+
+class LLMOverloadedError(LLMError):
+    """等待队列已满，拒绝新的 LLM 调用"""
+
+
+class LLMBackend:
+    """LLM 后端接口：接收完整 prompt，返回模型的原始文本输出。"""
+
+    name = "base"
+
+    async def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def stream(self, prompt: str):
+        """增量返回模型输出的异步迭代器；关闭迭代器即中止生成。默认一次性返回完整输出。"""
+        yield await self.generate(prompt)
+
+    async def warm_up(self):
+        """启动时的预热 (如加载 SDK)，避免落在第一个请求上"""
+
+    def close(self):
+        pass
+
+
+def _generation():
+    """首次使用时才导入 dashscope SDK (导入耗时较长，且使用假模型时不需要)"""
+    from dashscope import Generation
+    return Generation
+
+
+class DashScopeBackend(LLMBackend):
+    """
+    通义千问后端。同步 SDK 调用被派发到专用线程池，不会阻塞事件循环。
+    调用方取消 (超时、补发落败、客户端断开) 时通过 stop 事件通知工作线程，线程在收到下一段输出时
+    断开连接并退出；在那之前 (如仍在等待第一段输出) 线程仍被占用，因此线程池比并发上限多留出
+    同样数量的线程，避免新的调用排在这些即将结束的调用之后。
+    """
+
+    name = "dashscope"
+
+    def __init__(self, model=LLM_MODEL, api_key=QWEN_API_KEY, max_workers=2 * LLM_MAX_CONCURRENCY):
+        self.model = model
+        self.api_key = api_key
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dashscope")
+
+    async def generate(self, prompt: str) -> str:
+        # 也走流式接口：非流式的 SDK 调用无法中途停止，被取消后仍会占用线程直到模型生成完毕
+        chunks = self.stream(prompt)
+        try:
+            return "".join([chunk async for chunk in chunks])
+        finally:
+            await chunks.aclose()
+
+    def _stream_call(self, prompt, emit, stop):
+        responses = _generation().call(
+            model=self.model,
+            prompt=prompt,
+            api_key=self.api_key,
+            result_format='text',
+            stream=True,
+            incremental_output=True
+        )
+        try:
+            for response in responses:
+                if response.status_code != 200:
+                    raise LLMError(f"LLM API call failed with message: {response.message}")
+                emit(response.output.text)
+                if stop.is_set():
+                    break
+        finally:
+            # 关闭生成器会断开 HTTP 连接，服务端随之停止生成
+            responses.close()
+
+    async def stream(self, prompt: str):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def emit(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                stop.set()  # 事件循环已关闭
+
+        def run():
+            if stop.is_set():
+                return  # 还在线程池中排队时调用方就已取消
+            try:
+                self._stream_call(prompt, emit, stop)
+                emit(done)
+            except Exception as e:
+                emit(e)
+
+        loop.run_in_executor(self._executor, run)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    async def warm_up(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, _generation)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class FakeBackend(LLMBackend):
+    """
+    本地假模型，用于测试与压测。
+    responses 为 {问题: SQL} 字典或 callable(question) -> str；字典的值也可以是 SQL 列表，
+    同一问题的第 n 次调用返回第 n 个 (用完后重复最后一个)，用于模拟修复后的输出；
+    每次调用会先等待 latency + [0, jitter) 秒以模拟模型延迟，
+    并以 tail_prob 的概率额外等待 tail_latency 秒，模拟长尾的慢请求；
+    之后按约 4 个字符一个 token 输出，每个 token 等待 token_latency 秒。
+    seed 固定随机延迟的序列，便于压测结果在多次运行之间对比。
+    """
+
+    name = "fake"
+
+    def __init__(self, responses=None, latency=0.0, jitter=0.0, default=CANNOT_ANSWER,
+                 tail_prob=0.0, tail_latency=0.0, token_latency=0.0, model="fake", seed=None):
+        self.responses = responses or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_prob = tail_prob
+        self.tail_latency = tail_latency
+        self.token_latency = token_latency
+        self.model = model
+        self.tokens_sent = 0
+        self.default = default
+        self.calls = 0
+        self._question_calls = {}
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_env(cls, model="fake"):
+        """从环境变量 LLM_FAKE_RESPONSES (JSON 文件) 和 LLM_FAKE_LATENCY 等构造"""
+        responses = {}
+        path = os.getenv("LLM_FAKE_RESPONSES")
+        if path:
+            with open(path, encoding="utf-8") as f:
+                responses = json.load(f)
+        latency = float(os.getenv("LLM_FAKE_LATENCY", 0))
+        jitter = float(os.getenv("LLM_FAKE_JITTER", 0))
+        tail_prob = float(os.getenv("LLM_FAKE_TAIL_PROB", 0))
+        tail_latency = float(os.getenv("LLM_FAKE_TAIL_LATENCY", 0))
+        token_latency = float(os.getenv("LLM_FAKE_TOKEN_LATENCY", 0))
+        seed = os.getenv("LLM_FAKE_SEED")
+        return cls(responses, latency=latency, jitter=jitter, tail_prob=tail_prob,
+                   tail_latency=tail_latency, token_latency=token_latency, model=model,
+                   seed=int(seed) if seed else None)
+
+    async def generate(self, prompt: str) -> str:
+        return "".join([chunk async for chunk in self.stream(prompt)])
+
+    async def stream(self, prompt: str):
+        self.calls += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if self.tail_prob and self._random.random() < self.tail_prob:
+            delay += self.tail_latency
+        if delay:
+            await asyncio.sleep(delay)
+        text = self._respond(prompt)
+        for i in range(0, len(text), 4):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            self.tokens_sent += 1
+            yield text[i:i + 4]
+
+    def _respond(self, prompt):
+        question = extract_question(prompt)
+        if callable(self.responses):
+            return self.responses(question)
+        response = self.responses.get(question, self.default)
+        if isinstance(response, list):
+            n = self._question_calls.get(question, 0)
+            self._question_calls[question] = n + 1
+            response = response[min(n, len(response) - 1)]
+        return response
+
+
+def create_backend(name=LLM_BACKEND, model=LLM_MODEL) -> LLMBackend:
+    """按名称创建 LLM 后端"""
+    if name == "dashscope":
+        return DashScopeBackend(model=model)
+    if name == "fake":
+        return FakeBackend.from_env(model)
+    raise ValueError(f"未知的 LLM 后端: {name}")
+
+
+def config_errors():
+    """检查 LLM 相关配置，返回问题描述列表 (服务器启动时调用，导入模块时不检查)"""
+    errors = []
+    if LLM_BACKEND not in ("dashscope", "fake"):
+        errors.append(f"未知的 LLM 后端 LLM_BACKEND={LLM_BACKEND}。")
+    if LLM_BACKEND == "dashscope" and not QWEN_API_KEY:
+        errors.append("环境变量 DASHSCOPE_API_KEY 未设置。")
+    if LLM_MAX_CONCURRENCY < 1:
+        errors.append("LLM_MAX_CONCURRENCY 必须是正整数。")
+    if hedging.LLM_HEDGE_MODE not in ("hedge", "race", "off"):
+        errors.append(f"未知的生成调度模式 LLM_HEDGE_MODE={hedging.LLM_HEDGE_MODE}。")
+    return errors
+
+
+class LLMClient:
+    """
+    有界的异步 LLM 客户端。
+    最多 max_concurrency 个调用同时进行，其余排队；排队数超过 max_queue 时直接拒绝。
+    timeout 覆盖排队与生成的总时间；调用方被取消 (如 HTTP 客户端断开) 时会释放并发名额。
+    backend 可以是 LLMBackend 实例，也可以是创建后端的函数 (首次使用时才调用)。
+    """
+
+    def __init__(self, backend, max_concurrency=LLM_MAX_CONCURRENCY,
+                 max_queue=LLM_MAX_QUEUE, timeout=LLM_TIMEOUT, streaming=LLM_STREAMING):
+        self._backend = backend if isinstance(backend, LLMBackend) else None
+        self._factory = None if isinstance(backend, LLMBackend) else backend
+        self.streaming = streaming
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = 0  # 排队中 + 进行中的调用数
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self._factory()
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def model(self):
+        return getattr(self.backend, "model", self.backend.name)
+
+    async def _generate(self, prompt):
+        async with self._semaphore:
+            if not self.streaming:
+                return await self.backend.generate(prompt)
+            sql, early = await read_first_statement(self.backend.stream(prompt))
+            if early:
+                metrics.LLM_EARLY_STOPS.inc()
+            return sql
+
+    async def generate(self, prompt: str, timeout=None) -> str:
+        if self._pending >= self.max_concurrency + self.max_queue:
+            raise LLMOverloadedError("LLM is busy, too many queued requests.")
+        self._pending += 1
+        try:
+            return await asyncio.wait_for(self._generate(prompt), timeout or self.timeout)
+        finally:
+            self._pending -= 1
+
+    async def warm_up(self):
+        await self.backend.warm_up()
+
+    def close(self):
+        if self._backend is not None:
+            self._backend.close()
+
+
+llm_client = LLMClient(create_backend)
+
+# 生成调度：主模型过慢、出错或输出未通过安全校验时，在预算内补发给其他模型 (或同一模型)
+llm_scheduler = GenerationScheduler(
+    [llm_client] + [LLMClient(functools.partial(create_backend, model=m)) for m in LLM_FALLBACK_MODELS])
+
+
+async def warm_up_clients():
+    await asyncio.gather(*(client.warm_up() for client in llm_scheduler.clients))
+
+
+def close_clients():
+    for client in llm_scheduler.clients:
+        client.close()
+
+
+# 没有检索到相似示例时使用的内置示例 [(问题, 说明, SQL)]
+DEFAULT_EXAMPLES = [
+    ("List the names of all courses ordered by their titles and credits.", None,
+     "SELECT title, credits FROM course ORDER BY title, credits;"),
+    ("What are the titles of courses without prerequisites?",
+     "Efficient query using LEFT JOIN...IS NULL pattern",
+     "SELECT T.title FROM course AS T LEFT JOIN prereq AS P ON T.course_id = P.course_id WHERE P.prereq_id IS NULL;"),
+    ("What are the names of students who have more than one advisor?",
+     "Efficient query using GROUP BY and HAVING",
+     "SELECT S.name FROM student AS S JOIN advisor AS A ON S.ID = A.s_ID GROUP BY S.ID, S.name HAVING count(*) > 1;"),
+]
+
+
+def render_examples(examples=None) -> str:
+    """
+    渲染 few-shot 示例。examples 为检索到的 [(问题, SQL)]，
+    不足 len(DEFAULT_EXAMPLES) 个时用内置示例补足。
+    """
+    blocks = [f"# Question: {' '.join(q.split())}\n{sql.strip()}" for q, sql in examples or ()]
+    for question, note, sql in DEFAULT_EXAMPLES[len(blocks):]:
+        comment = f"# {note}\n" if note else ""
+        blocks.append(f"# Question: {question}\n{comment}{sql}")
+    return "\n\n".join(blocks)
+
+
+def render_value_hints(value_hints=None) -> str:
+    """渲染问题中提到的列取值 [(表, 列, 取值)]；没有时返回空字符串"""
+    if not value_hints:
+        return ""
+    # 同一个取值常出现在多张表的外键列中，合并成一行
+    columns = {}
+    for table, column, value in value_hints:
+        columns.setdefault(value, []).append(f"{table}.{column}")
+    lines = "\n".join(f"- '{value}': {', '.join(names)}" for value, names in columns.items())
+    return f"""
+### 相关取值 (Column values):
+以下是数据库中与问题相关的真实取值，在条件中请使用完全相同的写法：
+{lines}
+"""
+
+
+def build_prompt(user_question: str, schema_string: str, examples=None, value_hints=None) -> str:
     """
     构建一个包含指令、Schema 和示例的复杂 Prompt。
+    examples 为与问题相似的已验证 [(问题, SQL)]，未提供时使用内置示例。
+    value_hints 为问题中提到的列取值 [(表, 列, 取值)]。
     """
     return f"""
 ### 任务
 你是一个专业的数据库专家，擅长将自然语言问题转换为 MySQL 查询语句。
 请根据下面提供的数据库表结构和用户问题，生成一个准确、高效的 MySQL 查询。
 
-### 数据库表结构 (CREATE TABLE statements):
+### 数据库表结构:
 {schema_string}
-
+{render_value_hints(value_hints)}
 ### 指示
 1.  **只生成 `SELECT` 类型的 SQL 查询。**
 2.  确保 SQL 语法正确无误，并且符合 MySQL 规范。
@@ -28,16 +388,7 @@ def build_prompt(user_question: str, schema_string: str) -> str:
 5.  如果问题无法根据提供的表结构回答，请返回 "Error: Cannot answer the question with the given schema."
 
 ### 示例 (Few-shot examples):
-# Question: List the names of all courses ordered by their titles and credits.
-SELECT title, credits FROM course ORDER BY title, credits;
-
-# Question: What are the titles of courses without prerequisites?
-# Efficient query using LEFT JOIN...IS NULL pattern
-SELECT T.title FROM course AS T LEFT JOIN prereq AS P ON T.course_id = P.course_id WHERE P.prereq_id IS NULL;
-
-# Question: What are the names of students who have more than one advisor?
-# Efficient query using GROUP BY and HAVING
-SELECT S.name FROM student AS S JOIN advisor AS A ON S.ID = A.s_ID GROUP BY S.ID, S.name HAVING count(*) > 1;
+{render_examples(examples)}
 
 ### 用户问题
 {user_question}
@@ -45,30 +396,87 @@ SELECT S.name FROM student AS S JOIN advisor AS A ON S.ID = A.s_ID GROUP BY S.ID
 ### 生成的 SQL 查询:
 """
 
-async def get_sql_from_llm(user_question: str, db_schema: dict) -> str:
-    """使用通义千问将自然语言转换为 SQL"""
-    schema_string = "\n\n".join(db_schema.values())
-    prompt = build_prompt(user_question, schema_string)
+
+def build_repair_prompt(user_question: str, schema_string: str, attempts, examples=None,
+                        value_hints=None) -> str:
+    """
+    在原 Prompt 中加入之前生成的 SQL 及其问题 (MySQL 报错或执行计划摘要)，要求模型修正。
+    attempts 为 [(sql, 问题描述)]，按时间顺序排列。
+    """
+    history = "\n\n".join(
+        f"# 第 {i} 次生成的 SQL:\n{sql}\n# 问题: {feedback}"
+        for i, (sql, feedback) in enumerate(attempts, 1)
+    )
+    repair = f"""### 之前的尝试
+{history}
+
+请针对上述问题给出修正后的 SQL：修复语法或列名错误；对代价过高的计划，避免笛卡尔积、
+为连接补全关联条件、尽量让过滤和连接条件命中主键或索引。只输出 SQL。
+
+### 用户问题
+"""
+    prompt = build_prompt(user_question, schema_string, examples, value_hints)
+    head, sep, tail = prompt.rpartition("### 用户问题\n")
+    return head + repair + tail
+
+
+def extract_question(prompt: str) -> str:
+    """从 build_prompt 生成的 prompt 中取回用户问题"""
+    _, sep, tail = prompt.rpartition("### 用户问题\n")
+    if not sep:
+        return prompt.strip()
+    return tail.split("\n\n### 生成的 SQL 查询:", 1)[0].strip()
+
+
+async def get_sql_from_llm(user_question: str, db_schema: dict, schema_text: str = None,
+                           examples=None, value_hints=None) -> str:
+    """
+    使用通义千问将自然语言转换为 SQL。
+    schema_text 为裁剪后的紧凑 Schema；未提供时使用 db_schema 中的完整 CREATE TABLE 语句。
+    examples 为检索到的相似 [(问题, SQL)] 示例，value_hints 为问题中提到的列取值。
+    """
+    schema_string = schema_text or "\n\n".join(db_schema.values())
+    prompt = build_prompt(user_question, schema_string, examples, value_hints)
+    return await _complete(prompt, question=user_question)
+
+
+async def repair_sql_with_llm(user_question: str, db_schema: dict, schema_text: str,
+                              attempts, timeout=None, examples=None, value_hints=None) -> str:
+    """把之前失败或代价过高的 SQL 及原因交给模型，重新生成 SQL；返回值约定与 get_sql_from_llm 相同"""
+    schema_string = schema_text or "\n\n".join(db_schema.values())
+    prompt = build_repair_prompt(user_question, schema_string, attempts, examples, value_hints)
+    return await _complete(prompt, timeout, question=user_question)
+
+
+async def _complete(prompt: str, timeout=None, question=None) -> str:
+    """
+    调用模型并清理输出；失败时返回以 "Error:" 开头的字符串。
+    提供 question 时，未通过安全校验的输出视为失败，由调度器改用补发请求的输出；
+    模型明确表示无法回答时不再补发。
+    """
+    metrics.PROMPT_TOKENS.observe(metrics.estimate_tokens(prompt))
+    accept = None
+    if question is not None:
+        def accept(text):
+            sql = extract_sql(text)
+            # 只校验生成的 SQL：问题本身在生成前已经检查过，问题中含有 "select " 等词时
+            # 若在这里再检查，每个输出都会被拒绝，白白耗尽补发预算
+            return sql.lower().startswith("error:") or security.check_sql(sql)[0]
 
     try:
-        response = Generation.call(
-            model="qwen-turbo", # 或 qwen-plus
-            prompt=prompt,
-            api_key=QWEN_API_KEY,
-            result_format='text'
-        )
-        if response.status_code == 200:
-            generated_sql = response.output.text.strip()
-            # 清理模型可能返回的 markdown 代码块
-            if generated_sql.startswith("```sql"):
-                generated_sql = generated_sql[6:].strip()
-            if generated_sql.endswith("```"):
-                generated_sql = generated_sql[:-3].strip()
-            return generated_sql
-        else:
-            logging.error(f"通义千问 API 调用失败: {response.message}")
-            return f"Error: LLM API call failed with message: {response.message}"
-            
+        with metrics.stage("llm"):
+            generated_sql = await llm_scheduler.generate(prompt, timeout, accept)
+    except asyncio.TimeoutError:
+        logging.error(f"LLM 调用超时 ({timeout or llm_scheduler.timeout}s)")
+        metrics.record_error("llm", "timeout")
+        return "Error: LLM call timed out."
+    except LLMError as e:
+        logging.error(f"通义千问 API 调用失败: {e}")
+        metrics.record_error("llm", "overloaded" if isinstance(e, LLMOverloadedError) else "api_error")
+        return f"Error: {e}"
     except Exception as e:
         logging.error(f"调用 LLM 时发生异常: {e}")
-        return f"Error: An exception occurred during the LLM call."
\ No newline at end of file
+        metrics.record_error("llm", type(e).__name__)
+        return f"Error: An exception occurred during the LLM call."
+
+    return extract_sql(generated_sql)
@@ -0,0 +1,190 @@
+# core/metrics.py
+"""
+进程内指标与分阶段计时，输出 Prometheus 文本格式。
+
+热路径上只做 perf_counter、bisect 和字典累加；缓存命中数、游标数等状态量
+在抓取 /metrics 时通过回调读取，不在请求路径上额外记录。
+"""
+import time
+import bisect
+import contextvars
+from contextlib import contextmanager
+
+# 延迟类指标的默认分桶 (秒)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [每个桶的计数..., +Inf 桶计数, 总和]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    抓取时通过回调取值的指标；回调返回数值，或 {标签值元组: 数值}。
+    对象自身维护的累计计数 (如缓存命中数) 以 kind="counter" 导出。
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        value = self.callback()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for key, v in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "nl2sql_stage_seconds", "Time spent in each stage of query processing.", ["stage"]))
+HTTP_SECONDS = registry.register(Histogram(
+    "nl2sql_http_request_seconds", "HTTP request latency by route.", ["route", "status"]))
+POOL_WAIT_SECONDS = registry.register(Histogram(
+    "nl2sql_db_pool_wait_seconds", "Time spent waiting for a database connection from the pool."))
+PROMPT_TOKENS = registry.register(Histogram(
+    "nl2sql_llm_prompt_tokens", "Estimated number of tokens in each LLM prompt.",
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000)))
+ROWS_RETURNED = registry.register(Histogram(
+    "nl2sql_rows_returned", "Number of rows returned per page.",
+    buckets=(0, 1, 10, 50, 100, 500, 1000, 10000, 100000)))
+LLM_CALL_SECONDS = registry.register(Histogram(
+    "nl2sql_llm_call_seconds", "Latency of individual LLM calls by model.", ["model"]))
+QUERY_COST = registry.register(Histogram(
+    "nl2sql_query_cost", "Optimizer cost estimate (EXPLAIN) of generated SQL.",
+    buckets=(10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000)))
+SEMANTIC_MATCHES = registry.register(Counter(
+    "nl2sql_semantic_matches_total", "Near-duplicate question lookups by result.", ["kind"]))
+REPAIRS = registry.register(Counter(
+    "nl2sql_repairs_total", "SQL repair loop runs by outcome.", ["outcome"]))
+LLM_EARLY_STOPS = registry.register(Counter(
+    "nl2sql_llm_early_stops_total", "LLM generations stopped as soon as a complete SQL statement was read."))
+LLM_HEDGES = registry.register(Counter(
+    "nl2sql_llm_hedges_total", "Extra (hedged or raced) LLM requests by event.", ["event"]))
+VALUE_CORRECTIONS = registry.register(Counter(
+    "nl2sql_value_corrections_total", "String literals in generated SQL replaced by indexed column values."))
+SHARED_CACHE_LOOKUPS = registry.register(Counter(
+    "nl2sql_shared_cache_lookups_total", "Lookups in the cross-process shared cache by cache and result.",
+    ["cache", "result"]))
+ERRORS = registry.register(Counter(
+    "nl2sql_errors_total", "Failed queries by stage and error class.", ["stage", "error_class"]))
+
+# 当前请求的分阶段耗时 (毫秒)；未开启时为 None
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def request_timings():
+    """在 with 块内为当前请求开启分阶段计时，产出将被填充的 {阶段: 毫秒} 字典"""
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def current_timings():
+    return _request_timings.get()
+
+
+@contextmanager
+def stage(name):
+    """记录一个处理阶段的耗时：写入直方图，并在开启时写入当前请求的计时字典"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = round(timings.get(name, 0.0) + elapsed * 1000, 3)
+
+
+def record_error(stage_name, error_class):
+    ERRORS.inc(stage=stage_name, error_class=error_class)
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符各算一个，其余按 4 个字符一个"""
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return cjk + (len(text) - cjk) // 4
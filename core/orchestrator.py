@@ -1,98 +1,560 @@
 # core/orchestrator.py
+import os
+import time
+import asyncio
 import logging
+import contextlib
 import aiomysql
 from datetime import datetime
 
 from . import llm_handler
 from . import security
+from . import pagination
+from . import sql_cache
+from . import metrics
+from .schema_catalog import SchemaCatalog
+from .cursors import CursorStore
+from .singleflight import SingleFlight
+from .result_cache import ResultCache, canonicalize_sql
+from .schema_linking import SchemaLinker
+from .query_log import QueryLogStore, format_timestamp
+from . import cost_guard
+from .examples import ExampleStore, FEW_SHOT_K
+from .semantic_match import SemanticMatcher
+from .value_index import ValueIndex
+from .shared_cache import SharedCache
 
-# 在内存中存储日志
-# 注意：在生产环境中，日志应写入文件或日志系统
-query_logs = []
+# 流式输出的行数上限与每批从服务端游标读取的行数
+STREAM_MAX_ROWS = int(os.getenv("STREAM_MAX_ROWS", 100000))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+# 流式导出的服务端执行时间上限 (秒)，比普通查询宽松
+STREAM_TIMEOUT = float(os.getenv("STREAM_TIMEOUT", 300))
+# SQL 修复循环：EXPLAIN 报错或成本超限时最多重新生成的次数 (0 关闭) 与总时间预算 (秒)
+REPAIR_MAX_ATTEMPTS = int(os.getenv("REPAIR_MAX_ATTEMPTS", 2))
+REPAIR_BUDGET = float(os.getenv("REPAIR_BUDGET", 20))
+# 批量查询：单次最多的问题数，以及 LLM 阶段与数据库阶段各自的并发上限
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 4))
+BATCH_DB_CONCURRENCY = int(os.getenv("BATCH_DB_CONCURRENCY", 4))
+
+# 查询日志：内存中保留最近的条目，由服务器启动的后台任务批量写入分段文件
+query_log = QueryLogStore()
+
+# 进程内的 Schema 目录，由服务器在启动时加载
+schema_catalog = SchemaCatalog()
+
+# 多个工作进程共享的缓存层 (SHARED_CACHE_PATH 未设置时不启用)
+shared_cache = SharedCache()
+
+# 服务端结果游标，翻页时复用已校验的 SQL
+result_cursors = CursorStore(shared=shared_cache)
+
+# 问题 → SQL 缓存，命中时跳过 LLM 调用 (但仍会经过安全校验)
+question_cache = sql_cache.QuestionSQLCache(shared=shared_cache)
+
+# 合并并发的相同请求：LLM 阶段按缓存键合并，数据库阶段按 (SQL, 分页参数) 合并
+llm_flights = SingleFlight()
+db_flights = SingleFlight()
+
+# 查询结果缓存，按引用表的变更标记失效
+result_cache = ResultCache(shared=shared_cache)
+
+# Schema 链接：只把与问题相关的表发送给 LLM
+schema_linker = SchemaLinker()
+
+# 执行前的 EXPLAIN 成本闸门
+query_cost_guard = cost_guard.CostGuard()
+
+# 执行成功的 问题 → SQL 示例库，为 Prompt 检索相似的 few-shot 示例
+example_store = ExampleStore()
+
+def _learn_from_peer(entry):
+    """其他工作进程执行成功的查询同样加入示例库 (近似问题匹配也因此可以复用)"""
+    if entry.get("status") == "success":
+        example_store.add(entry["question"], entry["sql"])
+
+query_log.peer_listeners.append(_learn_from_peer)
+
+# 低基数文本列的取值索引：为 Prompt 提供真实取值，并校正生成 SQL 中写错的字面值
+value_index = ValueIndex()
+
+def _known_value(value):
+    if value_index.has_value(value):
+        return True
+    index = schema_linker.index
+    return index.has_value(value) if index is not None else None
+
+# 近似问题匹配：措辞或字面值不同的已验证问题直接复用 SQL，跳过 LLM
+semantic_matcher = SemanticMatcher(example_store, value_check=_known_value)
+
+# 状态类指标在抓取 /metrics 时读取
+metrics.registry.register(metrics.Gauge(
+    "nl2sql_cache_hits_total", "Cache hits.",
+    lambda: {("question",): question_cache.hits, ("result",): result_cache.hits}, ["cache"], kind="counter"))
+metrics.registry.register(metrics.Gauge(
+    "nl2sql_cache_misses_total", "Cache misses.",
+    lambda: {("question",): question_cache.misses, ("result",): result_cache.misses}, ["cache"], kind="counter"))
+metrics.registry.register(metrics.Gauge(
+    "nl2sql_result_cache_bytes", "Bytes held by the result cache.", lambda: result_cache.bytes))
+metrics.registry.register(metrics.Gauge(
+    "nl2sql_coalesced_calls_total", "Calls served by joining an identical in-flight call.",
+    lambda: {("llm",): llm_flights.shared, ("db",): db_flights.shared}, ["stage"], kind="counter"))
+metrics.registry.register(metrics.Gauge(
+    "nl2sql_llm_pending", "LLM calls queued or in progress.", lambda: llm_handler.llm_scheduler.pending))
+metrics.registry.register(metrics.Gauge(
+    "nl2sql_open_cursors", "Open result cursors.", lambda: len(result_cursors)))
+metrics.registry.register(metrics.Gauge(
+    "nl2sql_value_index_values", "Distinct column values held by the value index.", lambda: len(value_index)))
+
+# 预热时解析的示例 SQL，覆盖 JOIN / WHERE / GROUP BY / ORDER BY 等常见结构
+_WARM_UP_SQL = ("SELECT d.dept_name, COUNT(*) AS n FROM student AS s JOIN department AS d "
+                "ON s.dept_name = d.dept_name WHERE s.tot_cred > 30 GROUP BY d.dept_name "
+                "ORDER BY n DESC LIMIT 10;")
+
+async def warm_up():
+    """
+    启动预热：让 SQL 解析器、分页改写、示例检索和 LLM SDK 的首次加载发生在服务器就绪之前，
+    而不是落在第一个请求上。须在 Schema 目录加载之后调用。
+    """
+    security.analyze_sql(_WARM_UP_SQL)
+    pagination.plan_pagination(_WARM_UP_SQL, schema_catalog.primary_keys)
+    canonicalize_sql(_WARM_UP_SQL)
+    example_store.search("How many students are in each department?", FEW_SHOT_K)
+    await llm_handler.warm_up_clients()
 
 async def get_db_schema(pool, table_name=None):
-    """从数据库获取表结构 (CREATE TABLE 语句)"""
-    schema = {}
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("SHOW TABLES")
-            tables = await cursor.fetchall()
-            table_list = [table[0] for table in tables]
-
-            if table_name:
-                if table_name in table_list:
-                    await cursor.execute(f"SHOW CREATE TABLE `{table_name}`")
-                    result = await cursor.fetchone()
-                    if result:
-                      schema[table_name] = result[1]
-                # 如果找不到表，返回空 dict
-            else:
-                for t in table_list:
-                    await cursor.execute(f"SHOW CREATE TABLE `{t}`")
-                    result = await cursor.fetchone()
-                    if result:
-                      schema[t] = result[1]
-    return schema
-
-async def execute_query_in_db(pool, sql, page_size=10, offset=0):
-    """在数据库中执行最终的 SQL"""
-    paginated_sql = f"{sql.strip(';')} LIMIT {page_size} OFFSET {offset}"
-    
+    """从进程内 Schema 目录获取表结构 (CREATE TABLE 语句)"""
+    return await schema_catalog.get(pool, table_name)
+
+async def execute_query_in_db(pool, sql, page_size=10, offset=0, plan=None, after=None):
+    """
+    在数据库中执行最终的 SQL，返回一页结果。
+    能确定唯一键时使用键集分页 (after 为上一页最后一行的键值)，否则退回 LIMIT/OFFSET。
+    """
+    if plan is None:
+        plan = pagination.plan_pagination(sql, schema_catalog.primary_keys)
+    paginated_sql, args = pagination.build_page_query(plan, page_size, offset, after)
+    paginated_sql = cost_guard.with_time_limit(paginated_sql)
+
+    async def run(cursor):
+        await cursor.execute(paginated_sql, args)
+        return await cursor.fetchall()
+
+    wait_start = time.perf_counter()
     async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            await cursor.execute(paginated_sql)
-            results = await cursor.fetchall()
-            
-            has_more = len(results) == page_size
-            next_offset = offset + page_size if has_more else None
-            
-            return {"data": results, "next_offset": next_offset}
+        metrics.POOL_WAIT_SECONDS.observe(time.perf_counter() - wait_start)
+        cursor = await conn.cursor(aiomysql.DictCursor)
+        # 超时会在服务端终止语句并丢弃连接，此时不再关闭游标
+        results = await cost_guard.run_bounded(pool, conn, run(cursor))
+        description = cursor.description
+        await cursor.close()
 
-async def process_natural_language_query(pool, question, page_size=10, offset=0):
+    # 多取了一行，据此精确判断是否还有下一页
+    has_more = len(results) > page_size
+    results = list(results[:page_size])
+    metrics.ROWS_RETURNED.observe(len(results))
+    next_offset = offset + page_size if has_more else None
+    # 列名与行的键一致 (DictCursor 会给重名列加表名前缀)；没有行时取自结果集描述，
+    # 使空结果也能带上列信息 (列式 / Arrow 格式需要它来构造表头)
+    columns = list(results[0].keys()) if results else [d[0] for d in description or ()]
+
+    return {"data": results, "columns": columns, "next_offset": next_offset}
+
+async def execute_query_shared(pool, sql, page_size=10, offset=0, plan=None, after=None):
     """
-    处理自然语言查询的完整流程编排。
+    与 execute_query_in_db 相同，但会先查结果缓存，
+    且相同 SQL 与分页参数的并发请求只执行一次。返回结果带有 cached 标记。
     """
+    key = (canonicalize_sql(sql), page_size, offset, after)
+    tables = markers = None
+    if result_cache.enabled:
+        await result_cache.refresh_markers(pool)
+        cached = await result_cache.lookup(key)
+        if cached is not None:
+            return {**cached, "cached": True}
+        tables = frozenset(security.analyze_sql(sql).tables)
+        markers = result_cache.snapshot(tables)
+
+    async def run():
+        result = await execute_query_in_db(pool, sql, page_size, offset, plan=plan, after=after)
+        if result_cache.enabled:
+            result_cache.put(key, result, tables, markers)
+        return result
+
+    result = await db_flights.do(key, run)
+    # 结果在多个请求间共享，返回拷贝以便调用方追加字段
+    return {**result, "cached": False}
+
+async def linked_schema_text(pool, question):
+    """裁剪后的 Schema 文本；未开启或裁剪失败时返回 None (使用完整 Schema)"""
+    try:
+        with metrics.stage("schema_linking"):
+            return await schema_linker.schema_text(pool, schema_catalog, question)
+    except Exception as e:
+        logging.warning(f"Schema 链接失败，使用完整 Schema: {e}")
+        return None
+
+def similar_examples(question):
+    """检索与问题最相似的已验证示例 [(问题, SQL)]"""
+    with metrics.stage("example_retrieval"):
+        return [(q, sql) for _, q, sql in example_store.search(question, FEW_SHOT_K)]
+
+def value_hints(question):
+    """问题中提到的已索引列取值 [(表, 列, 取值)]"""
+    if not value_index.enabled:
+        return []
+    with metrics.stage("value_hints"):
+        return value_index.hints(question)
+
+def ground_literals(sql):
+    """把 SQL 中与已索引列比较的字面值校正为真实取值，返回 (SQL, 校正列表)"""
+    if not value_index.enabled:
+        return sql, []
+    with metrics.stage("value_correction"):
+        corrected, corrections = value_index.correct_sql(sql)
+    if corrections:
+        metrics.VALUE_CORRECTIONS.inc(len(corrections))
+        logging.info(f"校正 SQL 中的字面值 {corrections}: {corrected}")
+    return corrected, corrections
+
+async def generate_sql(pool, question, db_schema):
+    """裁剪 Schema、检索相似示例与列取值后调用 LLM 生成 SQL"""
+    schema_text = await linked_schema_text(pool, question)
+    examples = similar_examples(question)
+    return await llm_handler.get_sql_from_llm(question, db_schema, schema_text, examples,
+                                              value_hints(question))
+
+async def explain_sql(pool, sql):
+    """EXPLAIN 一条 SQL，返回 (PlanSummary, None) 或 (None, 数据库异常)"""
+    try:
+        with metrics.stage("explain"):
+            plan = await query_cost_guard.explain(
+                pool, sql, key=(canonicalize_sql(sql), schema_catalog.etag))
+    except Exception as e:
+        metrics.record_error("explain", type(e).__name__)
+        return None, e
+    metrics.QUERY_COST.observe(plan.cost)
+    return plan, None
+
+def _repair_feedback(plan, error):
+    if error is not None:
+        return f"MySQL 报错: {error}"
+    return f"执行计划代价过高 ({plan.describe()}): {'; '.join(plan.violations)}"
+
+async def repair_sql(pool, question, db_schema, sql, plan, error):
+    """
+    有界修复循环：把 MySQL 报错或执行计划摘要交给 LLM 重新生成，直到得到没有超限的计划、
+    用完次数或超出时间预算。所有 EXPLAIN 成功的候选中，优先选没有超限的，其次选成本最低的。
+    返回 (sql, plan, 修复信息)；没有任何可用候选时 plan 为 None，error 为最后一次的异常。
+    """
+    deadline = time.monotonic() + REPAIR_BUDGET
+    schema_text = await linked_schema_text(pool, question)
+    examples = similar_examples(question)
+    hints = value_hints(question)
+    candidates = [(sql, plan)] if plan is not None else []
+    attempts = []
+    current, feedback = sql, _repair_feedback(plan, error)
+
+    while len(attempts) < REPAIR_MAX_ATTEMPTS:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        attempts.append((current, feedback))
+        with metrics.stage("repair"):
+            current = await llm_handler.repair_sql_with_llm(
+                question, db_schema, schema_text, attempts, timeout=remaining,
+                examples=examples, value_hints=hints)
+        if current.lower().startswith("error:"):
+            break
+        current, _ = ground_literals(current)
+        is_safe, error_message = security.check_sql(current)
+        if not is_safe:
+            feedback = error_message
+            continue
+        new_plan, error = await explain_sql(pool, current)
+        if new_plan is None:
+            feedback = _repair_feedback(None, error)
+            continue
+        candidates.append((current, new_plan))
+        if not new_plan.violations:
+            break
+        feedback = _repair_feedback(new_plan, None)
+
+    repair = {"attempts": len(attempts), "initial_cost": plan.cost if plan is not None else None}
+    if not candidates:
+        metrics.REPAIRS.inc(outcome="failed")
+        logging.warning(f"SQL 修复失败 ({len(attempts)} 轮): {question}")
+        return sql, None, repair, error
+    chosen_sql, chosen_plan = min(candidates, key=lambda c: (bool(c[1].violations), c[1].cost))
+    repair["cost"] = chosen_plan.cost
+    if plan is not None:
+        repair["cost_delta"] = chosen_plan.cost - plan.cost
+    if chosen_sql == sql:
+        outcome = "unchanged"
+    elif plan is None:
+        outcome = "fixed_error"
+    else:
+        outcome = "reduced_cost"
+    metrics.REPAIRS.inc(outcome=outcome)
+    logging.info(f"SQL 修复 {len(attempts)} 轮 ({outcome})，成本 {repair['initial_cost']} → "
+                 f"{chosen_plan.cost}: {chosen_sql}")
+    return chosen_sql, chosen_plan, repair, None
+
+def db_error_class(error):
+    """数据库错误在指标中的分类"""
+    return "timeout" if cost_guard.is_timeout_error(error) else type(error).__name__
+
+def log_query(question, sql, status, error_message=None):
+    """记录一次查询的结果"""
+    log_entry = {
+        "question": question,
+        "sql": sql,
+        "timestamp": format_timestamp(datetime.utcnow()),
+        "status": status
+    }
+    if error_message is not None:
+        log_entry["error_message"] = error_message
+    query_log.append(log_entry)
+    if status == "success":
+        # 执行成功的 SQL 即为已验证的示例
+        example_store.add(question, sql)
+
+async def prepare_sql(pool, question, llm_slot=None):
+    """
+    生成并校验 SQL (Schema → 缓存/近似问题/LLM → 字面值校正 → 安全校验 → 成本评估)。
+    返回 {"generated_sql": ..., "cache_key": ..., "cost": ...}，失败时返回带 error 的 dict。
+    llm_slot 为调用 LLM (生成与修复) 前需要进入的异步上下文 (如批量查询的信号量)。
+    """
+    llm_slot = llm_slot or contextlib.nullcontext()
     # 1. 获取数据库 Schema
-    db_schema = await get_db_schema(pool)
+    with metrics.stage("schema"):
+        db_schema = await get_db_schema(pool)
     if not db_schema:
+        metrics.record_error("schema", "unavailable")
         return {"error": "Failed to retrieve database schema."}
+    security.set_schema_columns(schema_catalog.columns, schema_catalog.etag)
 
-    # 2. 调用 LLM 生成 SQL
-    generated_sql = await llm_handler.get_sql_from_llm(question, db_schema)
-    if generated_sql.lower().startswith("error:"):
-        return {"error": generated_sql}
-    logging.info(f"LLM 生成的 SQL: {generated_sql}")
+    # 2. 查询缓存，未命中时调用 LLM 生成 SQL
+    cache_key = sql_cache.make_key(question, schema_catalog.etag)
+    generated_sql = await question_cache.lookup(cache_key)
+    prepared = {"cache_key": cache_key}
+    if generated_sql is None and semantic_matcher.enabled:
+        with metrics.stage("semantic_match"):
+            match = semantic_matcher.lookup(question)
+        metrics.SEMANTIC_MATCHES.inc(kind=match.kind if match else "miss")
+        if match is not None:
+            generated_sql, corrections = ground_literals(match.sql)
+            if corrections:
+                prepared["value_corrections"] = corrections
+            prepared["semantic_match"] = match.to_dict()
+            logging.info(f"复用近似问题的 SQL ({match.kind}, {match.score:.2f}): {generated_sql}")
+    if generated_sql is None:
+        async with llm_slot:
+            with metrics.stage("sql_generation"):
+                generated_sql = await llm_flights.do(
+                    cache_key, lambda: generate_sql(pool, question, db_schema)
+                )
+        if generated_sql.lower().startswith("error:"):
+            if generated_sql == llm_handler.CANNOT_ANSWER:
+                metrics.record_error("llm", "cannot_answer")
+            return {"error": generated_sql}
+        logging.info(f"LLM 生成的 SQL: {generated_sql}")
+        generated_sql, corrections = ground_literals(generated_sql)
+        if corrections:
+            prepared["value_corrections"] = corrections
     
-    # 3. 运行所有安全校验
-    is_safe, error_message = security.run_all_security_checks(question, generated_sql)
+    # 3. 运行所有安全校验 (缓存命中的 SQL 同样需要校验)
+    with metrics.stage("security"):
+        is_safe, error_message = security.run_all_security_checks(question, generated_sql)
     if not is_safe:
+        metrics.record_error("security", "rejected")
         return {"error": error_message, "generated_sql": generated_sql}
 
+    # 4. 用 EXPLAIN 估算成本，拦截笛卡尔积、大表全表扫描等代价过高的查询
+    prepared["generated_sql"] = generated_sql
+    if query_cost_guard.enabled:
+        plan, error = await explain_sql(pool, generated_sql)
+        # 5. EXPLAIN 报错或成本超限时，把原因反馈给 LLM 尝试修复
+        if (plan is None or plan.violations) and REPAIR_MAX_ATTEMPTS > 0:
+            async with llm_slot:
+                generated_sql, plan, prepared["repair"], error = await repair_sql(
+                    pool, question, db_schema, generated_sql, plan, error)
+            prepared["generated_sql"] = generated_sql
+        if plan is None:
+            logging.error(f"EXPLAIN 生成的 SQL 时出错: {error}")
+            log_query(question, generated_sql, "error", str(error))
+            prepared.pop("cache_key")
+            return {"error": f"Database execution error: {error}", **prepared}
+        prepared["cost"] = plan.to_dict()
+        if query_cost_guard.rejects(plan):
+            logging.warning(f"查询成本超限被拒绝 ({plan.describe()}): {generated_sql}")
+            metrics.record_error("cost", "over_budget")
+            prepared.pop("cache_key")
+            return {"error": "Query rejected by cost gate: " + "; ".join(plan.violations), **prepared}
+    return prepared
+
+async def process_natural_language_query(pool, question, page_size=10, offset=0):
+    """
+    处理自然语言查询的完整流程编排。
+    """
+    prepared = await prepare_sql(pool, question)
+    if "error" in prepared:
+        return prepared
+    return await execute_prepared(pool, question, prepared, page_size, offset)
+
+async def execute_prepared(pool, question, prepared, page_size=10, offset=0):
+    """执行 prepare_sql 得到的 SQL 并返回第一页 (记录日志、写入缓存，还有更多结果时打开游标)"""
+    generated_sql = prepared["generated_sql"]
+
     # 4. 执行查询
     try:
-        result = await execute_query_in_db(pool, generated_sql, page_size, offset)
+        with metrics.stage("db"):
+            plan = pagination.plan_pagination(generated_sql, schema_catalog.primary_keys)
+            result = await execute_query_shared(pool, generated_sql, page_size, offset, plan=plan)
         
         # 5. 记录成功的查询
-        log_entry = {
-            "question": question,
-            "sql": generated_sql,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "status": "success"
-        }
-        query_logs.append(log_entry)
-        
+        log_query(question, generated_sql, "success")
+        # 只缓存执行成功的 SQL
+        question_cache.put(prepared["cache_key"], generated_sql)
+
+        # 还有更多结果时打开游标，后续页通过 fetch_next_page 获取
+        if result["next_offset"] is not None:
+            after = plan.key_of(result["data"][-1]) if plan.keyset else None
+            cursor = result_cursors.open(question, generated_sql, page_size, result["next_offset"],
+                                         plan=plan, after=after)
+            await result_cursors.save(cursor)
+            result["cursor"] = cursor.id
+
+        for key in ("cost", "repair", "semantic_match", "value_corrections"):
+            if key in prepared:
+                result[key] = prepared[key]
         return {
             "generated_sql": generated_sql,
             **result
         }
     except Exception as e:
         logging.error(f"数据库执行 SQL 时出错: {e}")
-        log_entry = {
-            "question": question,
-            "sql": generated_sql,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "status": "error",
-            "error_message": str(e)
-        }
-        query_logs.append(log_entry)
-        return {"error": f"Database execution error: {e}", "generated_sql": generated_sql}
\ No newline at end of file
+        metrics.record_error("db", db_error_class(e))
+        log_query(question, generated_sql, "error", str(e))
+        return {"error": f"Database execution error: {e}", "generated_sql": generated_sql}
+
+async def run_batch(pool, questions, page_size=10,
+                    llm_concurrency=BATCH_LLM_CONCURRENCY, db_concurrency=BATCH_DB_CONCURRENCY):
+    """
+    批量处理问题。归一化后相同的问题只处理一次；LLM 阶段与数据库阶段分别用信号量限制并发，
+    前一个问题等待数据库时，后面的问题可以继续生成 SQL。某个问题出错不影响其余问题。
+    按完成顺序产出 (下标列表, 结果)，下标列表为提交了该问题的所有位置。
+    """
+    groups = {}
+    for index, question in enumerate(questions):
+        groups.setdefault(sql_cache.normalize_question(question), []).append(index)
+    llm_slots = asyncio.Semaphore(llm_concurrency)
+    db_slots = asyncio.Semaphore(db_concurrency)
+
+    async def run(indices):
+        question = questions[indices[0]]
+        try:
+            prepared = await prepare_sql(pool, question, llm_slot=llm_slots)
+            if "error" in prepared:
+                return indices, prepared
+            async with db_slots:
+                return indices, await execute_prepared(pool, question, prepared, page_size)
+        except Exception as e:
+            logging.error(f"批量查询中的问题处理失败: {question}: {e}", exc_info=True)
+            return indices, {"error": f"An internal error occurred: {e}"}
+
+    tasks = [asyncio.ensure_future(run(indices)) for indices in groups.values()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # 调用方提前退出 (如客户端断开) 时取消尚未完成的问题
+        for task in tasks:
+            task.cancel()
+
+async def fetch_next_page(pool, cursor_id):
+    """
+    通过游标获取下一页结果。
+    直接执行游标绑定的 SQL，不再调用 LLM，也不重复安全校验。
+    """
+    cursor = await result_cursors.lookup(
+        cursor_id, lambda sql: pagination.plan_pagination(sql, schema_catalog.primary_keys))
+    if cursor is None:
+        return {"error": "Cursor not found or expired. Please submit the query again."}
+
+    try:
+        with metrics.stage("db"):
+            result = await execute_query_shared(pool, cursor.sql, cursor.page_size, cursor.next_offset,
+                                                plan=cursor.plan, after=cursor.after)
+    except Exception as e:
+        logging.error(f"数据库执行 SQL 时出错: {e}")
+        metrics.record_error("db", db_error_class(e))
+        result_cursors.close(cursor_id)
+        return {"error": f"Database execution error: {e}", "generated_sql": cursor.sql}
+
+    if result["next_offset"] is None:
+        result_cursors.close(cursor_id)
+    else:
+        cursor.next_offset = result["next_offset"]
+        if cursor.plan.keyset:
+            cursor.after = cursor.plan.key_of(result["data"][-1])
+        await result_cursors.save(cursor)
+        result["cursor"] = cursor_id
+
+    return {
+        "generated_sql": cursor.sql,
+        **result
+    }
+
+
+class RowStream:
+    """
+    通过服务端 (非缓冲) 游标分批读取查询结果，不在内存中物化整个结果集。
+    用法: async for rows in stream: ...  每批是若干行元组；列名在 columns 中。
+    """
+
+    def __init__(self, pool, sql, max_rows=STREAM_MAX_ROWS, batch_size=STREAM_BATCH_SIZE):
+        self.pool = pool
+        self.sql = sql
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.columns = None
+        self.row_count = 0
+        self.truncated = False
+
+    async def __aiter__(self):
+        plan = pagination.plan_pagination(self.sql, schema_catalog.primary_keys)
+        # 多取一行用于判断结果是否被截断
+        query, args = pagination.build_page_query(plan, self.max_rows)
+        query = cost_guard.with_time_limit(query, STREAM_TIMEOUT)
+        # 服务端的执行时间限制覆盖整个读取过程 (非缓冲游标的语句在结果读完前一直在执行)，
+        # 客户端同样按整个流的截止时间等待，而不是每批单独计时
+        bounds = {"timeout": STREAM_TIMEOUT, "deadline": time.monotonic() + STREAM_TIMEOUT}
+        async with self.pool.acquire() as conn:
+            cursor = await conn.cursor(aiomysql.SSCursor)
+            completed = False
+            try:
+                await cost_guard.run_bounded(self.pool, conn, cursor.execute(query, args), **bounds)
+                self.columns = [d[0] for d in cursor.description]
+                while True:
+                    rows = await cost_guard.run_bounded(self.pool, conn, cursor.fetchmany(self.batch_size),
+                                                        **bounds)
+                    if not rows:
+                        break
+                    remaining = self.max_rows - self.row_count
+                    if len(rows) > remaining:
+                        rows = rows[:remaining]
+                        self.truncated = True
+                    if rows:
+                        self.row_count += len(rows)
+                        yield rows
+                    if self.truncated:
+                        break
+                completed = True
+            finally:
+                if completed:
+                    await cursor.close()
+                else:
+                    # 中途放弃 (如客户端断开) 时直接断开连接，
+                    # 避免关闭非缓冲游标时把剩余结果全部读完
+                    conn.close()
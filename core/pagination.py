@@ -0,0 +1,176 @@
+# core/pagination.py
+import re
+import sqlparse
+from sqlparse import tokens as T
+from sqlparse.sql import Identifier, IdentifierList, Where
+
+# 形如 `t`.`col` [AS] `alias` 的简单列引用
+_COLUMN_RE = re.compile(
+    r"^(?:`?\w+`?\.)?`?(\w+)`?(?:\s+(?:AS\s+)?`?(\w+)`?)?$", re.IGNORECASE
+)
+# 形如 `db`.`table` [AS] `alias` 的简单表引用
+_TABLE_RE = re.compile(r"^(?:`?\w+`?\.)?`?\w+`?(?:\s+(?:AS\s+)?`?\w+`?)?$", re.IGNORECASE)
+_STAR_RE = re.compile(r"^(?:`?\w+`?\.)?\*$")
+
+
+class PagePlan:
+    """
+    一条 SQL 的分页方案。
+    key_columns 不为空时使用键集 (seek) 分页：按唯一键排序，翻页使用 WHERE (key) > (last_key)；
+    否则退回 LIMIT/OFFSET。wrap 表示原 SQL 需要包成派生表后才能追加分页子句。
+    """
+
+    __slots__ = ("sql", "key_columns", "wrap")
+
+    def __init__(self, sql, key_columns=None, wrap=False):
+        self.sql = sql
+        self.key_columns = tuple(key_columns) if key_columns else None
+        self.wrap = wrap
+
+    @property
+    def keyset(self):
+        return self.key_columns is not None
+
+    def key_of(self, row):
+        """取出一行结果中的键值，作为下一页的 seek 起点"""
+        values = []
+        for column in self.key_columns:
+            if column in row:
+                values.append(row[column])
+            else:
+                # MySQL 列名大小写不敏感，结果集中的列名可能与 SQL 中的写法不同
+                lowered = column.lower()
+                values.append(next(v for k, v in row.items() if k.lower() == lowered))
+        return tuple(values)
+
+
+def _quote(name):
+    return f"`{name}`"
+
+
+def _select_items(tokens):
+    """返回 SELECT 与 FROM 之间的选择项；遇到 DISTINCT 等修饰时返回 None"""
+    items = []
+    for token in tokens:
+        if token.is_whitespace or token.ttype in T.Comment:
+            continue
+        if token.ttype is T.Keyword:
+            # DISTINCT / SQL_CALC_FOUND_ROWS 等都会改变结果集的唯一性
+            return None
+        if isinstance(token, IdentifierList):
+            items.extend(t for t in token.tokens
+                         if not t.is_whitespace and t.ttype is not T.Punctuation)
+        else:
+            items.append(token)
+    return items
+
+
+def _output_columns(items):
+    """
+    计算选择项的输出列名。
+    返回 (是否包含 *, {真实列名小写: 输出列名})；出现无法识别的形态时返回 None。
+    """
+    star = False
+    columns = {}
+    outputs = set()
+    for item in items:
+        text = str(item).strip()
+        if item.ttype is T.Wildcard or _STAR_RE.match(text):
+            star = True
+            continue
+        match = _COLUMN_RE.match(text) if isinstance(item, Identifier) else None
+        if not match:
+            # 表达式列：不参与键的判断，但其输出名 (有别名时为别名) 仍可能与键列重名，
+            # 如 SELECT ID, tot_cred+1 id —— 派生表中会出现两个 id 列，只能退回 OFFSET 分页
+            alias = item.get_alias() if isinstance(item, Identifier) else None
+            output = (alias or text).lower()
+            if output in outputs:
+                return None
+            outputs.add(output)
+            continue
+        real, alias = match.group(1), match.group(2)
+        output = alias or real
+        if output.lower() in outputs:
+            return None
+        outputs.add(output.lower())
+        columns.setdefault(real.lower(), output)
+    if star and (columns or outputs):
+        # SELECT *, col 可能产生重名列，派生表无法承载
+        return None
+    return star, columns
+
+
+def plan_pagination(sql: str, primary_keys: dict) -> PagePlan:
+    """
+    分析生成的 SQL，决定分页方式。
+    仅当查询是单表、无 JOIN/GROUP BY/DISTINCT/ORDER BY/LIMIT 且结果包含该表的全部主键列时，
+    使用键集分页；其余情况退回 LIMIT/OFFSET。
+    """
+    sql = sql.strip().rstrip(";").strip()
+    statements = [s for s in sqlparse.parse(sql) if str(s).strip()]
+    if len(statements) != 1:
+        return PagePlan(sql)
+    tokens = [t for t in statements[0].tokens if not t.is_whitespace and t.ttype not in T.Comment]
+
+    has_limit = any(t.ttype is T.Keyword and t.normalized == "LIMIT" for t in tokens)
+    fallback = PagePlan(sql, wrap=has_limit)
+
+    if not tokens or tokens[0].ttype is not T.DML or tokens[0].normalized != "SELECT":
+        return fallback
+    from_index = next((i for i, t in enumerate(tokens)
+                       if t.ttype is T.Keyword and t.normalized == "FROM"), None)
+    if from_index is None or from_index + 1 >= len(tokens):
+        return fallback
+
+    # FROM 之后只允许一个简单表引用和可选的 WHERE
+    table = tokens[from_index + 1]
+    if not isinstance(table, Identifier) or not _TABLE_RE.match(str(table).strip()):
+        return fallback
+    if any(not isinstance(t, Where) and t.ttype is not T.Punctuation for t in tokens[from_index + 2:]):
+        return fallback
+
+    pk = primary_keys.get(table.get_real_name())
+    if not pk:
+        return fallback
+
+    items = _select_items(tokens[1:from_index])
+    if not items:
+        return fallback
+    outputs = _output_columns(items)
+    if outputs is None:
+        return fallback
+    star, columns = outputs
+    if star:
+        return PagePlan(sql, key_columns=pk)
+    if all(col.lower() in columns for col in pk):
+        return PagePlan(sql, key_columns=[columns[col.lower()] for col in pk])
+    return fallback
+
+
+def build_page_query(plan: PagePlan, page_size: int, offset: int = 0, after=None):
+    """
+    生成获取一页数据的 SQL 与参数。
+    多取一行 (page_size + 1) 用于精确判断是否还有下一页。
+    """
+    limit = int(page_size) + 1
+    if not plan.keyset:
+        if plan.wrap:
+            return f"SELECT * FROM ({plan.sql}) AS _page LIMIT {limit} OFFSET {int(offset)}", None
+        return f"{plan.sql} LIMIT {limit} OFFSET {int(offset)}", None
+
+    order_by = ", ".join(_quote(c) for c in plan.key_columns)
+    if after is None:
+        query = f"SELECT * FROM ({plan.sql}) AS _page ORDER BY {order_by} LIMIT {limit}"
+        if offset:
+            query += f" OFFSET {int(offset)}"
+        return query, None
+
+    if len(plan.key_columns) == 1:
+        predicate = f"{order_by} > %s"
+    else:
+        placeholders = ", ".join(["%s"] * len(plan.key_columns))
+        predicate = f"({order_by}) > ({placeholders})"
+    # 使用参数化查询时，原 SQL 中的 % (如 LIKE '%x%') 需要转义
+    inner = plan.sql.replace("%", "%%")
+    query = f"SELECT * FROM ({inner}) AS _page WHERE {predicate} ORDER BY {order_by} LIMIT {limit}"
+    return query, tuple(after)
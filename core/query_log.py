@@ -0,0 +1,389 @@
+# core/query_log.py
+import os
+import json
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from datetime import datetime, timezone
+
+# 内存中保留的最近日志条数
+QUERY_LOG_BUFFER = int(os.getenv("QUERY_LOG_BUFFER", 1000))
+# 日志分段文件所在目录，设为空字符串只保留内存中的日志
+QUERY_LOG_DIR = os.getenv("QUERY_LOG_DIR", os.path.join("logs", "queries"))
+# 单个分段文件的大小上限 (字节) 与保留的分段数
+QUERY_LOG_SEGMENT_BYTES = int(os.getenv("QUERY_LOG_SEGMENT_BYTES", 4 * 1024 * 1024))
+QUERY_LOG_MAX_SEGMENTS = int(os.getenv("QUERY_LOG_MAX_SEGMENTS", 20))
+# 后台批量写盘的间隔 (秒) 与触发立即写盘的批大小
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", 1.0))
+QUERY_LOG_BATCH_SIZE = int(os.getenv("QUERY_LOG_BATCH_SIZE", 200))
+
+# 写盘跟不上时最多积压的条数，超出后丢弃最旧的待写条目
+_MAX_PENDING = 50000
+
+# 多进程运行时由主进程设置的工作进程编号 (见 mcp_server.workers)，单进程时为 0
+_WORKER_SLOT = int(os.getenv("SERVER_WORKER_SLOT", 0))
+# 日志 id = 毫秒时间戳 * LOG_ID_WORKERS + 工作进程编号：
+# 各进程独立分配、互不冲突，且大致按时间排序，可以直接作为跨进程的翻页游标
+LOG_ID_WORKERS = 1000
+
+_SEGMENT_PREFIX = "queries-"
+_SEGMENT_SUFFIX = ".jsonl"
+
+
+def format_timestamp(dt: datetime) -> str:
+    """固定宽度的 UTC 时间戳，保证字符串顺序与时间顺序一致"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat(timespec="milliseconds") + "Z"
+
+
+def parse_timestamp(value: str) -> str:
+    """把 ISO 8601 时间 (可带时区或只有日期) 规范化为日志时间戳格式，格式错误时抛出 ValueError"""
+    return format_timestamp(datetime.fromisoformat(value.strip().replace("Z", "+00:00")))
+
+
+class LogFilter:
+    """日志查询条件；未设置的条件不参与过滤"""
+
+    __slots__ = ("status", "since", "until", "text")
+
+    def __init__(self, status=None, since=None, until=None, text=None):
+        self.status = status
+        self.since = since
+        self.until = until
+        self.text = text.casefold() if text else None
+
+    def matches(self, entry):
+        if self.status is not None and entry["status"] != self.status:
+            return False
+        if self.since is not None and entry["timestamp"] < self.since:
+            return False
+        if self.until is not None and entry["timestamp"] >= self.until:
+            return False
+        if self.text is not None:
+            haystack = f"{entry['question']}\n{entry['sql']}\n{entry.get('error_message', '')}"
+            if self.text not in haystack.casefold():
+                return False
+        return True
+
+
+def _parse_segment(name):
+    """
+    分段文件名 queries-w<工作进程编号>-<第一条 id>.jsonl -> (编号, 第一条 id)。
+    旧格式 queries-<第一条 id>.jsonl 的编号为 None；不是分段文件时返回 None。
+    """
+    if not (name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)):
+        return None
+    worker, _, first_id = name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)].rpartition("-")
+    try:
+        if not worker:
+            return None, int(first_id)
+        if worker.startswith("w"):
+            return int(worker[1:]), int(first_id)
+    except ValueError:
+        pass
+    return None
+
+
+def _entry_id(entry):
+    return entry["id"]
+
+
+class QueryLogStore:
+    """
+    查询日志：最近的条目保存在定长环形缓冲区中，同时由后台任务批量追加到 JSONL 分段文件。
+    每条日志带有递增的 id (见 LOG_ID_WORKERS)，查询按 id 从新到旧返回，并以最后一条的 id 作为下一页游标。
+
+    多个工作进程共用同一个目录：各进程只写文件名带自己编号的分段 (并各自轮转)，
+    查询时合并所有进程的分段，因此无论请求落到哪个进程，结果与游标都相同
+    (其他进程最近约 flush_interval 秒内尚未写盘的日志暂时不可见)。
+    后台任务还会读取其他进程新追加的日志并通知 peer_listeners，使示例库等派生索引学到全部流量。
+    分段文件名包含其第一条日志的 id，翻页时只读取可能包含目标 id 的分段。
+    """
+
+    def __init__(self, capacity=QUERY_LOG_BUFFER, directory=QUERY_LOG_DIR,
+                 segment_bytes=QUERY_LOG_SEGMENT_BYTES, max_segments=QUERY_LOG_MAX_SEGMENTS,
+                 flush_interval=QUERY_LOG_FLUSH_INTERVAL, batch_size=QUERY_LOG_BATCH_SIZE,
+                 worker=_WORKER_SLOT):
+        self.directory = directory or None
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.worker = worker
+        self.dropped = 0
+        # 其他工作进程新写入的日志的回调 (在事件循环线程中按 id 顺序调用)
+        self.peer_listeners = []
+        self._buffer = deque(maxlen=capacity)
+        self._last_tick = 0
+        self._last_id = 0
+        self._pending = []
+        self._wakeup = None
+        self._task = None
+        self._segment = None  # (路径, 当前大小)
+        self._peer_offsets = {}  # 其他进程的分段文件名 -> 已读取到的字节位置
+
+    def __len__(self):
+        return len(self._buffer)
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def _new_id(self):
+        # 同一毫秒内 (或时钟回拨时) 顺延到下一个毫秒，保证本进程的 id 严格递增
+        self._last_tick = max(int(time.time() * 1000), self._last_tick + 1)
+        self._last_id = self._last_tick * LOG_ID_WORKERS + self.worker
+        return self._last_id
+
+    def append(self, entry):
+        """记录一条日志 (只做内存操作，写盘由后台任务完成)"""
+        entry = {"id": self._new_id(), **entry}
+        self._buffer.append(entry)
+        if self._task is not None:
+            self._pending.append(entry)
+            if len(self._pending) > _MAX_PENDING:
+                del self._pending[0]
+                self.dropped += 1
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+        return entry
+
+    def query(self, log_filter=None, before=None, limit=50):
+        """
+        按 id 从新到旧返回最多 limit 条满足条件的日志 (只查本进程的内存缓冲区)。
+        before 为游标：只返回 id 小于它的条目。返回 (条目列表, 是否已查完缓冲区)。
+        """
+        results = []
+        # id 递增但不一定连续 (从分段恢复的缓冲区可能有空缺)，二分查找游标位置而不是按差值推算
+        end = len(self._buffer) if before is None else self._bisect(before)
+        for entry in itertools.islice(reversed(self._buffer), len(self._buffer) - end, None):
+            if log_filter is None or log_filter.matches(entry):
+                results.append(entry)
+                if len(results) >= limit:
+                    return results, False
+        return results, True
+
+    def _bisect(self, before):
+        """缓冲区中 id 小于 before 的条目数"""
+        lo, hi = 0, len(self._buffer)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._buffer[mid]["id"] < before:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    async def search(self, log_filter=None, before=None, limit=50):
+        """
+        按 id 从新到旧查询全部日志：本进程的日志先查内存缓冲区，再合并分段文件中
+        (包括其他工作进程写入的) 更早的日志。返回 {"logs": [...], "next_cursor": id 或 None}。
+        """
+        if not self.directory:
+            results, _ = self.query(log_filter, before, limit)
+        else:
+            # 缓冲区在事件循环线程中取快照，文件在线程池中读取
+            end = len(self._buffer) if before is None else self._bisect(before)
+            recent = list(itertools.islice(reversed(self._buffer), len(self._buffer) - end, None))
+            oldest = self._buffer[0]["id"] if self._buffer else None
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(
+                None, self._search_all, log_filter, before, limit, recent, oldest)
+        next_cursor = results[-1]["id"] if len(results) >= limit else None
+        return {"logs": results, "next_cursor": next_cursor}
+
+    def _search_all(self, log_filter, before, limit, recent, oldest):
+        """按 id 合并各进程的日志流 (每个流都是从新到旧)，取前 limit 条满足条件的"""
+        streams = []
+        for worker, names in self._segment_groups().items():
+            if worker == self.worker:
+                # 本进程的分段中比缓冲区更新的部分已经在 recent 里
+                floor = oldest if before is None else min(oldest or before, before)
+                streams.append(itertools.chain(recent, self._segment_entries(names, floor)))
+                recent = None
+            else:
+                streams.append(self._segment_entries(names, before))
+        if recent is not None:
+            streams.append(iter(recent))
+        results = []
+        for entry in heapq.merge(*streams, key=_entry_id, reverse=True):
+            if log_filter is None or log_filter.matches(entry):
+                results.append(entry)
+                if len(results) >= limit:
+                    break
+        return results
+
+    # --- 持久化 ---
+
+    def _segment_groups(self):
+        """{工作进程编号: 按第一条 id 升序排列的分段文件名}；旧格式的分段归在 None 下"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return {}
+        groups = {}
+        for name in names:
+            parsed = _parse_segment(name)
+            if parsed is not None:
+                groups.setdefault(parsed[0], []).append((parsed[1], name))
+        return {worker: [name for _, name in sorted(items)] for worker, items in groups.items()}
+
+    def _segments(self):
+        """本进程的分段文件名 (按第一条 id 升序)"""
+        return self._segment_groups().get(self.worker, [])
+
+    def _read_segment(self, name):
+        entries = []
+        try:
+            with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue  # 进程异常退出时最后一行可能不完整
+        except OSError as e:
+            logging.warning(f"读取查询日志分段 {name} 失败: {e}")
+        return entries
+
+    def _segment_entries(self, names, before=None):
+        """从新到旧逐个读取分段 (按需读取)，只产出 id 小于 before 的条目"""
+        for name in reversed(names):
+            if before is not None and _parse_segment(name)[1] >= before:
+                continue
+            for entry in reversed(self._read_segment(name)):
+                if before is None or entry["id"] < before:
+                    yield entry
+
+    def history(self):
+        """从新到旧遍历全部日志 (包括所有工作进程已落盘的分段)，供启动时重建派生索引使用"""
+        if not self.directory:
+            yield from reversed(self._buffer)
+            return
+        streams = [self._segment_entries(names) for names in self._segment_groups().values()]
+        yield from heapq.merge(*streams, key=_entry_id, reverse=True)
+
+    def load(self):
+        """启动时从本进程最近的分段文件恢复缓冲区和 id 序号"""
+        if not self.directory:
+            return
+        entries = []
+        for name in reversed(self._segments()):
+            entries[:0] = self._read_segment(name)
+            if len(entries) >= self._buffer.maxlen:
+                break
+        if not entries:
+            return
+        self._buffer.extend(entries[-self._buffer.maxlen:])
+        self._last_id = max(self._last_id, entries[-1]["id"])
+        self._last_tick = max(self._last_tick, self._last_id // LOG_ID_WORKERS)
+        logging.info(f"已从 {self.directory} 恢复 {len(self._buffer)} 条查询日志。")
+
+    def _peer_segments(self):
+        return [name for worker, names in self._segment_groups().items()
+                if worker is not None and worker != self.worker for name in names]
+
+    def _read_peers(self):
+        """读取其他工作进程自上次以来追加的日志 (只读到最后一个完整的行)"""
+        entries = []
+        offsets = {}
+        for name in self._peer_segments():
+            offset = self._peer_offsets.get(name, 0)
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    f.seek(offset)
+                    data = f.read()
+            except OSError:
+                continue  # 可能刚被轮转删除
+            complete = data.rfind(b"\n") + 1
+            for line in data[:complete].splitlines():
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+            offsets[name] = offset + complete
+        # 已删除的分段随之丢弃
+        self._peer_offsets = offsets
+        entries.sort(key=_entry_id)
+        return entries
+
+    async def _poll_peers(self):
+        loop = asyncio.get_running_loop()
+        try:
+            entries = await loop.run_in_executor(None, self._read_peers)
+        except OSError as e:
+            logging.warning(f"读取其他工作进程的查询日志失败: {e}")
+            return
+        for entry in entries:
+            for listener in self.peer_listeners:
+                try:
+                    listener(entry)
+                except Exception as e:
+                    logging.warning(f"处理其他工作进程的查询日志失败: {e}")
+
+    def _write(self, batch):
+        """在线程池中把一批日志追加到当前分段，超过大小上限时开启新分段"""
+        if self._segment is None or self._segment[1] >= self.segment_bytes:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory,
+                                f"{_SEGMENT_PREFIX}w{self.worker}-{batch[0]['id']:016d}{_SEGMENT_SUFFIX}")
+            self._segment = (path, 0)
+            # 新分段即将创建，本进程的旧分段只保留 max_segments - 1 个，合计恰好 max_segments 个
+            names = self._segments()
+            for name in names[:max(0, len(names) + 1 - max(self.max_segments, 1))]:
+                os.remove(os.path.join(self.directory, name))
+        path, size = self._segment
+        data = "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in batch)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(data)
+        self._segment = (path, size + len(data.encode("utf-8")))
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write, batch)
+        except OSError as e:
+            self.dropped += len(batch)
+            logging.warning(f"写入查询日志失败，丢弃 {len(batch)} 条: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+            if self.peer_listeners:
+                await self._poll_peers()
+
+    def start(self):
+        """启动后台写盘任务 (未配置目录时不做任何事)"""
+        if not self.directory or self._task is not None:
+            return
+        # 启动前已有的日志由 history() 读取，之后只通知新追加的部分
+        for name in self._peer_segments():
+            try:
+                self._peer_offsets[name] = os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并写出剩余的日志"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._flush()
@@ -0,0 +1,181 @@
+# core/result_cache.py
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+import sqlparse
+
+from .shared_cache import encode
+
+# 结果缓存的总容量 (字节)，设为 0 关闭结果缓存
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# 表变更标记的轮询间隔 (秒)，也是缓存结果可能陈旧的最长时间
+RESULT_CACHE_CHECK_INTERVAL = float(os.getenv("RESULT_CACHE_CHECK_INTERVAL", 5))
+
+# 每张表的变更标记。MySQL 8 默认缓存 information_schema 统计信息，
+# 查询前需把 information_schema_stats_expiry 设为 0 才能看到最新的 UPDATE_TIME。
+MARKERS_SQL = """
+SELECT TABLE_NAME, UPDATE_TIME, CREATE_TIME
+FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = DATABASE()
+"""
+
+
+def canonicalize_sql(sql: str) -> str:
+    """去掉注释、统一关键字大小写并合并空白，使格式不同的相同 SQL 得到相同的缓存键"""
+    formatted = sqlparse.format(sql, keyword_case="upper", strip_comments=True)
+    return " ".join(formatted.split()).rstrip(";").strip()
+
+
+def _estimate_size(value) -> int:
+    return len(json.dumps(value, default=str, ensure_ascii=False).encode("utf-8"))
+
+
+class _Entry:
+    __slots__ = ("value", "tables", "markers", "size")
+
+    def __init__(self, value, tables, markers, size):
+        self.value = value
+        self.tables = tables
+        self.markers = markers
+        self.size = size
+
+
+class ResultCache:
+    """
+    查询结果缓存，键为规范化后的 SQL + 分页参数，按字节数限制容量 (LRU 淘汰)。
+    每个条目记录执行前所引用各表的变更标记；标记变化后条目失效。
+    配置了 shared (SharedCache) 时新条目同时写入共享缓存；由 lookup 读到的共享条目
+    同样按本进程看到的当前标记校验。
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, check_interval=RESULT_CACHE_CHECK_INTERVAL,
+                 shared=None):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._markers = {}
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def refresh_markers(self, pool):
+        """按间隔轮询表变更标记，并丢弃引用了已变更表的条目"""
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        async with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return
+            try:
+                async with pool.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        try:
+                            await cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+                        except Exception:
+                            pass  # MariaDB / 旧版本 MySQL 没有这个变量
+                        await cursor.execute(MARKERS_SQL)
+                        rows = await cursor.fetchall()
+            except Exception as e:
+                # 拿不到标记时清空缓存，宁可少命中也不返回可能陈旧的数据
+                logging.warning(f"读取表变更标记失败，清空结果缓存: {e}")
+                self.clear()
+                self._checked_at = time.monotonic()
+                return
+
+            # 与 security.analyze_sql 收集的表名一致，按小写登记
+            markers = {name.lower(): f"{updated}|{created}" for name, updated, created in rows}
+            changed = {t for t, m in self._markers.items() if markers.get(t) != m}
+            self._markers = markers
+            self._checked_at = time.monotonic()
+            for table in changed:
+                self.invalidate_table(table)
+
+    def snapshot(self, tables):
+        """执行查询前记下相关表的当前标记"""
+        return {t: self._markers.get(t) for t in tables}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if any(self._markers.get(t) != m for t, m in entry.markers.items()):
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    async def lookup(self, key):
+        """先查内存，未命中时查共享缓存 (标记仍然有效的条目放入内存)"""
+        value = self.get(key)
+        if value is not None or self.shared is None or not self.shared.enabled:
+            return value
+        entry = await self.shared.get("result", encode(key))
+        if entry is None:
+            return None
+        stored = entry[0]
+        if any(self._markers.get(t) != m for t, m in stored["markers"].items()):
+            return None
+        self._insert(key, stored["value"], frozenset(stored["tables"]), stored["markers"])
+        return stored["value"]
+
+    def put(self, key, value, tables, markers):
+        if self._insert(key, value, tables, markers) and self.shared is not None:
+            self.shared.put("result", encode(key),
+                            {"value": value, "tables": sorted(tables), "markers": markers})
+
+    def _insert(self, key, value, tables, markers):
+        size = _estimate_size(value)
+        # 单个结果超过总容量的 1/8 时不缓存，避免一次大查询冲掉整个缓存
+        if size > self.max_bytes // 8:
+            return False
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, tables, markers, size)
+        self.bytes += size
+        for table in tables:
+            self._by_table.setdefault(table, set()).add(key)
+        while self.bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+        return True
+
+    def invalidate_table(self, table):
+        for key in list(self._by_table.pop(table, ())):
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_table.clear()
+        self.bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.bytes,
+                "hits": self.hits, "misses": self.misses}
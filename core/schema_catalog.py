@@ -0,0 +1,132 @@
+# core/schema_catalog.py
+import os
+import time
+import asyncio
+import hashlib
+import logging
+
+from .schema_linking import parse_create_table
+
+# Schema 缓存的重新校验间隔 (秒)
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", 30))
+
+# 单条查询计算当前库的结构指纹：列定义、索引、键约束 (含外键引用) 与表注释各自的 CRC32 求和 + 列数。
+# 不使用 GROUP_CONCAT，避免受 group_concat_max_len 截断影响。
+# CHECK 约束、表选项 (引擎、字符集) 等其余 SHOW CREATE TABLE 内容不在指纹中，
+# 只修改这些内容时要等到下次完整加载 (如重启) 才会反映到 Schema 与 ETag 中。
+FINGERPRINT_SQL = """
+SELECT COUNT(*), COUNT(DISTINCT TABLE_NAME),
+       COALESCE(SUM(CRC32(CONCAT_WS('|', TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION,
+                                    COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY,
+                                    COALESCE(COLUMN_DEFAULT, ''), COLUMN_COMMENT))), 0),
+       (SELECT COALESCE(SUM(CRC32(CONCAT_WS('|', TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX,
+                                            COLUMN_NAME, NON_UNIQUE))), 0)
+        FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()),
+       (SELECT COALESCE(SUM(CRC32(CONCAT_WS('|', TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME,
+                                            ORDINAL_POSITION, COALESCE(REFERENCED_TABLE_NAME, ''),
+                                            COALESCE(REFERENCED_COLUMN_NAME, '')))), 0)
+        FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = DATABASE()),
+       (SELECT COALESCE(SUM(CRC32(CONCAT_WS('|', TABLE_NAME, TABLE_COMMENT))), 0)
+        FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE())
+FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE()
+"""
+
+
+async def fetch_db_schema(pool):
+    """从数据库获取全部表结构 (SHOW TABLES + 每张表一次 SHOW CREATE TABLE)"""
+    schema = {}
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SHOW TABLES")
+            tables = await cursor.fetchall()
+            for (t,) in tables:
+                await cursor.execute(f"SHOW CREATE TABLE `{t}`")
+                result = await cursor.fetchone()
+                if result:
+                    schema[t] = result[1]
+    return schema
+
+
+async def fetch_schema_fingerprint(pool):
+    """用一次 information_schema 查询获取结构指纹，用于廉价地检测 DDL 变化"""
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(FINGERPRINT_SQL)
+            columns, tables, *checksums = await cursor.fetchone()
+    return ":".join(str(v) for v in (tables, columns, *checksums))
+
+
+class SchemaCatalog:
+    """
+    进程内的 Schema 目录。
+    启动时加载一次，之后从内存提供表结构；每隔 ttl 秒用一次指纹查询重新校验，
+    仅当指纹变化时才重新执行 SHOW CREATE TABLE。
+    """
+
+    def __init__(self, ttl=SCHEMA_CACHE_TTL):
+        self.ttl = ttl
+        self._schema = {}
+        self.table_info = {}
+        self.primary_keys = {}
+        self.columns = {}
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self.version = 0
+        self.etag = None
+
+    async def load(self, pool):
+        """完整加载表结构并刷新版本号与 ETag"""
+        fingerprint = await fetch_schema_fingerprint(pool)
+        schema = await fetch_db_schema(pool)
+        self._install(schema, fingerprint)
+
+    def _install(self, schema, fingerprint):
+        digest = hashlib.sha1(
+            "\n".join(f"{k}\n{schema[k]}" for k in sorted(schema)).encode("utf-8")
+        ).hexdigest()
+        if f'"{digest[:16]}"' != self.etag:
+            self.version += 1
+            if self._loaded:
+                logging.info(f"检测到数据库结构变化，Schema 已更新到版本 {self.version}")
+        self._schema = schema
+        self.table_info = {name: parse_create_table(name, ddl) for name, ddl in schema.items()}
+        self.primary_keys = {t.name: t.primary_key for t in self.table_info.values()}
+        self.columns = {t.name: [c.name for c in t.columns] for t in self.table_info.values()}
+        self._fingerprint = fingerprint
+        self._checked_at = time.monotonic()
+        self._loaded = True
+        self.etag = f'"{digest[:16]}"'
+
+    async def ensure_fresh(self, pool):
+        """在 TTL 过期时重新校验指纹，必要时重新加载"""
+        if self._loaded and time.monotonic() - self._checked_at < self.ttl:
+            return
+        async with self._lock:
+            # 等锁期间可能已有其他协程完成了校验
+            if self._loaded and time.monotonic() - self._checked_at < self.ttl:
+                return
+            if not self._loaded:
+                await self.load(pool)
+                return
+            try:
+                fingerprint = await fetch_schema_fingerprint(pool)
+                if fingerprint != self._fingerprint:
+                    self._install(await fetch_db_schema(pool), fingerprint)
+                else:
+                    self._checked_at = time.monotonic()
+            except Exception as e:
+                # 校验失败时继续提供旧的 Schema，等待下一个周期再试
+                logging.warning(f"Schema 重新校验失败，继续使用缓存版本: {e}")
+                self._checked_at = time.monotonic()
+
+    async def get(self, pool, table_name=None):
+        """返回 {表名: CREATE TABLE 语句}；指定 table_name 时只返回该表，找不到返回空 dict"""
+        await self.ensure_fresh(pool)
+        if table_name:
+            if table_name in self._schema:
+                return {table_name: self._schema[table_name]}
+            return {}
+        return dict(self._schema)
@@ -0,0 +1,404 @@
+# core/schema_linking.py
+import os
+import re
+import math
+import asyncio
+import logging
+from collections import deque
+
+from .sql_cache import normalize_question
+
+# 是否在构建 Prompt 前裁剪 Schema (设为 0 时始终发送完整表结构)
+SCHEMA_LINKING = os.getenv("SCHEMA_LINKING", "1") != "0"
+# 最高分低于该值时认为链接不可靠，退回完整 Schema
+SCHEMA_LINK_MIN_SCORE = float(os.getenv("SCHEMA_LINK_MIN_SCORE", 2.0))
+# 最多保留的表数量 (不含连接路径上补充的表)
+SCHEMA_LINK_MAX_TABLES = int(os.getenv("SCHEMA_LINK_MAX_TABLES", 6))
+# 列数超过该值的表只保留键列和与问题相关的列
+SCHEMA_LINK_MAX_COLUMNS = int(os.getenv("SCHEMA_LINK_MAX_COLUMNS", 12))
+# 每张表抽样多少行用于值匹配，0 表示不抽样
+SCHEMA_LINK_SAMPLE_ROWS = int(os.getenv("SCHEMA_LINK_SAMPLE_ROWS", 200))
+
+# 各类匹配的权重
+TABLE_WEIGHT = 3.0
+COLUMN_WEIGHT = 1.5
+COMMENT_WEIGHT = 1.0
+VALUE_WEIGHT = 2.0
+
+_COLUMN_RE = re.compile(r"^\s*`([^`]+)`\s+(\w+(?:\([^)]*\))?(?:\s+unsigned)?)(.*)$", re.IGNORECASE)
+_COMMENT_RE = re.compile(r"COMMENT\s*=?\s*'((?:[^']|'')*)'", re.IGNORECASE)
+_FOREIGN_KEY_RE = re.compile(
+    r"FOREIGN KEY \(([^)]*)\) REFERENCES `([^`]+)` \(([^)]*)\)", re.IGNORECASE
+)
+_TEXT_TYPES = ("char", "varchar", "text", "tinytext", "mediumtext", "enum", "set")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CJK_RE = re.compile(r"[一-鿿]+")
+_TERM_RE = re.compile(r"[a-z0-9]+|[一-鿿]+")
+
+# 表示实体间关系的词 -> 关系表 (桥接表) 名称或注释中应出现的词首。
+# 这类词 (took, taught, advisor...) 本身很少与列名匹配，但决定了应经由哪张桥接表连接，
+# 例如 "students who took courses taught by X" 应经 takes / teaches 连接而不是经 department。
+_RELATION_WORDS = {
+    "takes": ("take",), "took": ("take",), "taken": ("take",), "taking": ("take",),
+    "teach": ("teach",), "teaches": ("teach",), "taught": ("teach",), "teaching": ("teach",),
+    "advise": ("advis",), "advised": ("advis",), "advises": ("advis",), "advisor": ("advis",),
+    "adviser": ("advis",), "advisee": ("advis",), "supervised": ("advis", "supervis"),
+    "enrol": ("enrol", "take"), "enroll": ("enrol", "take"), "enrolled": ("enrol", "take"),
+    "registered": ("regist", "enrol", "take"), "attended": ("attend", "take"),
+    "选修": ("选修",), "修读": ("修读",), "上过": ("选修",), "授课": ("授课",), "讲授": ("授课",),
+    "导师": ("导师",), "指导": ("导师", "指导"),
+}
+
+
+def _backticked(text):
+    return re.findall(r"`([^`]+)`", text)
+
+
+def _stem(word):
+    """极简英文词干：courses -> course, facilities -> facility"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def terms(text):
+    """把文本切成检索词：英文按词 (含下划线拆分) 取词干，中文取字二元组"""
+    text = text.lower()
+    result = {_stem(w) for w in _WORD_RE.findall(text.replace("_", " "))}
+    result.update(w for w in _WORD_RE.findall(text) if "_" in w)
+    for run in _CJK_RE.findall(text):
+        result.update(run[i:i + 2] for i in range(max(len(run) - 1, 1)))
+    return result
+
+
+def term_sequence(text):
+    """按出现顺序排列的检索词 (英文词干、中文字二元组)，用于需要区分词序的比较"""
+    sequence = []
+    for token in _TERM_RE.findall(text.lower().replace("_", " ")):
+        if _CJK_RE.fullmatch(token):
+            sequence.extend(token[i:i + 2] for i in range(max(len(token) - 1, 1)))
+        else:
+            sequence.append(_stem(token))
+    return sequence
+
+
+class ColumnInfo:
+    __slots__ = ("name", "type", "comment", "is_text")
+
+    def __init__(self, name, type_, comment=""):
+        self.name = name
+        self.type = type_
+        self.comment = comment
+        self.is_text = type_.lower().split("(")[0] in _TEXT_TYPES
+
+
+class TableInfo:
+    __slots__ = ("name", "columns", "primary_key", "foreign_keys", "comment")
+
+    def __init__(self, name):
+        self.name = name
+        self.columns = []
+        self.primary_key = []
+        self.foreign_keys = []  # [(本表列, 引用表, 引用列)]
+        self.comment = ""
+
+
+def parse_create_table(name, ddl):
+    """从 SHOW CREATE TABLE 的输出中解析列、主键、外键和注释"""
+    table = TableInfo(name)
+    for line in ddl.splitlines()[1:]:
+        stripped = line.strip()
+        if stripped.upper().startswith("PRIMARY KEY"):
+            table.primary_key = _backticked(stripped.split(")")[0])
+        elif "FOREIGN KEY" in stripped.upper():
+            match = _FOREIGN_KEY_RE.search(stripped)
+            if match:
+                for local, remote in zip(_backticked(match.group(1)), _backticked(match.group(3))):
+                    table.foreign_keys.append((local, match.group(2), remote))
+        elif stripped.startswith(")"):
+            comment = _COMMENT_RE.search(stripped)
+            if comment:
+                table.comment = comment.group(1).replace("''", "'")
+        else:
+            match = _COLUMN_RE.match(line)
+            if match:
+                comment = _COMMENT_RE.search(match.group(3))
+                table.columns.append(ColumnInfo(
+                    match.group(1), match.group(2),
+                    comment.group(1).replace("''", "'") if comment else ""
+                ))
+    return table
+
+
+class SchemaIndex:
+    """根据表名、列名、注释、外键图和抽样值建立的本地检索索引"""
+
+    def __init__(self, tables, values=None):
+        self.tables = {t.name: t for t in tables}
+        self.etag = None
+        # 检索词 -> [(表, 列或 None, 权重)]
+        self._postings = {}
+        for table in tables:
+            self._add(terms(table.name), table.name, None, TABLE_WEIGHT)
+            if table.comment:
+                self._add(terms(table.comment), table.name, None, COMMENT_WEIGHT)
+            for column in table.columns:
+                self._add(terms(column.name), table.name, column.name, COLUMN_WEIGHT)
+                if column.comment:
+                    self._add(terms(column.comment), table.name, column.name, COMMENT_WEIGHT)
+        # 逆文档频率：出现在越多表里的词 (如 name, id) 权重越低
+        n = max(len(tables), 1)
+        self._idf = {
+            term: math.log(1 + n / len({p[0] for p in postings}))
+            for term, postings in self._postings.items()
+        }
+        # 归一化后的值 -> {(表, 列)}
+        self._values = {}
+        for (table, column), column_values in (values or {}).items():
+            for value in column_values:
+                key = normalize_question(value)
+                if len(key) >= 3:
+                    self._values.setdefault(key, set()).add((table, column))
+        self.value_count = len(self._values)
+        self._max_value_words = max((len(v.split()) for v in self._values), default=0)
+        # 外键图 (无向)：表 -> [(相邻表, 连接条件)]
+        self._graph = {name: [] for name in self.tables}
+        for table in tables:
+            for local, remote_table, remote in table.foreign_keys:
+                if remote_table in self._graph:
+                    condition = f"{table.name}.{local} = {remote_table}.{remote}"
+                    self._graph[table.name].append((remote_table, condition))
+                    self._graph[remote_table].append((table.name, condition))
+        # 桥接表：外键引用了至少两张其他表 (如 takes -> student, section)
+        # 表名 -> (名称与注释的检索词, 引用的表)
+        self._bridges = {}
+        for table in tables:
+            referenced = list(dict.fromkeys(
+                r for _, r, _ in table.foreign_keys if r in self.tables and r != table.name))
+            if len(referenced) >= 2:
+                self._bridges[table.name] = (terms(table.name) | terms(table.comment), referenced)
+
+    def _add(self, words, table, column, weight):
+        for word in words:
+            self._postings.setdefault(word, []).append((table, column, weight))
+
+    def has_value(self, value):
+        """值是否出现在抽样中；没有抽样或值太短无法判断时返回 None"""
+        key = normalize_question(value)
+        if not self._values or len(key) < 3:
+            return None
+        return key in self._values
+
+    def _value_hits(self, question):
+        words = normalize_question(question).split()
+        hits = set()
+        for size in range(1, self._max_value_words + 1):
+            for i in range(len(words) - size + 1):
+                hits.update(self._values.get(" ".join(words[i:i + size]), ()))
+        return hits
+
+    def rank(self, question):
+        """返回 ({表: 分数}, {表: {相关列}})"""
+        table_scores = {}
+        matched_columns = {}
+        for term in terms(question):
+            matches = [(term, 1.0)] if term in self._postings else [
+                # 缩写形式的名称 (prereq, dept) 按前缀匹配，权重减半
+                (name, 0.5) for name in self._postings
+                if len(name) >= 4 and len(term) > len(name) and term.startswith(name)
+            ]
+            for name, factor in matches:
+                idf = self._idf[name]
+                seen = set()
+                for table, column, weight in self._postings[name]:
+                    if (table, column) in seen:
+                        continue
+                    seen.add((table, column))
+                    table_scores[table] = table_scores.get(table, 0.0) + weight * idf * factor
+                    if column:
+                        matched_columns.setdefault(table, set()).add(column)
+        for table, column in self._value_hits(question):
+            table_scores[table] = table_scores.get(table, 0.0) + VALUE_WEIGHT
+            matched_columns.setdefault(table, set()).add(column)
+        return table_scores, matched_columns
+
+    def _path(self, sources, target):
+        """在外键图上找从已选表集合到 target 的最短路径 (最多 3 跳)"""
+        queue = deque((s, []) for s in sources)
+        visited = set(sources)
+        while queue:
+            table, path = queue.popleft()
+            if table == target:
+                return path
+            if len(path) >= 3:
+                continue
+            for neighbour, condition in self._graph.get(table, ()):
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    queue.append((neighbour, path + [(neighbour, condition)]))
+        return None
+
+    def _relation_bridges(self, question):
+        """
+        问题中的关系词对应的桥接表。
+        返回 [(桥接表, 它引用的表)]；有关系词却找不到唯一对应的桥接表时返回 None。
+        """
+        text = question.lower()
+        words = set(_WORD_RE.findall(text))
+        found = [stems for word, stems in _RELATION_WORDS.items()
+                 if (word in words if word.isascii() else word in text)]
+        bridges = []
+        for stems in found:
+            matches = [name for name, (words, _) in self._bridges.items()
+                       if any(w.startswith(stem) for w in words for stem in stems)]
+            if len(matches) != 1:
+                return None
+            if matches[0] not in bridges:
+                bridges.append(matches[0])
+        return [(name, self._bridges[name][1]) for name in bridges]
+
+    def link(self, question):
+        """
+        选出与问题相关的表 (及连接它们所需的中间表)。
+        问题中的关系词 (took, taught, advisor...) 所对应的桥接表及其两端的表会优先加入，
+        使连接路径经由桥接表而不是恰好相连的其他表。
+        返回 (表名列表, 连接条件列表, 相关列)；置信度不足时返回 None。
+        """
+        scores, columns = self.rank(question)
+        if not scores or max(scores.values()) < SCHEMA_LINK_MIN_SCORE:
+            return None
+        bridges = self._relation_bridges(question)
+        if bridges is None:
+            # 说了关系却确定不了经由哪张表连接：给出裁剪后的子集反而可能误导，退回完整 Schema
+            return None
+        top = max(scores.values())
+        ranked = sorted((t for t, s in scores.items() if s >= top * 0.4), key=lambda t: -scores[t])
+        ranked = ranked[:SCHEMA_LINK_MAX_TABLES]
+
+        # 桥接表与它两端的表直接相连，先整体加入，其余表再经最短外键路径接到它们上面
+        selected = list(dict.fromkeys(t for bridge, referenced in bridges for t in (bridge, *referenced)))
+        if not selected:
+            selected = [ranked[0]]
+        joins = []
+        for table in ranked:
+            if table in selected:
+                continue
+            path = self._path(selected, table)
+            if path is None:
+                selected.append(table)
+                continue
+            for step, condition in path:
+                if step not in selected:
+                    selected.append(step)
+                if condition not in joins:
+                    joins.append(condition)
+        # 已选表之间的其余直接外键关系也一并给出
+        for table in selected:
+            for neighbour, condition in self._graph.get(table, ()):
+                if neighbour in selected and condition not in joins:
+                    joins.append(condition)
+        return selected, joins, columns
+
+    def render(self, table_names, joins=(), relevant_columns=None):
+        """
+        紧凑地渲染表结构：每表一行，去掉字符集、引擎等与查询无关的内容。
+        给出 relevant_columns (链接结果) 时，列数超过上限的表只保留键列和相关列；
+        为 None 时 (完整 Schema) 保留全部列。
+        """
+        lines = []
+        for name in table_names:
+            table = self.tables[name]
+            fk = {local: f"{ref}.{remote}" for local, ref, remote in table.foreign_keys}
+            keep = table.columns
+            if relevant_columns is not None and len(keep) > SCHEMA_LINK_MAX_COLUMNS:
+                wanted = set(table.primary_key) | set(fk) | relevant_columns.get(name, set())
+                keep = [c for c in table.columns if c.name in wanted]
+            parts = []
+            for column in keep:
+                part = f"{column.name} {column.type}"
+                if column.name in table.primary_key:
+                    part += " PK"
+                if column.name in fk:
+                    part += f" -> {fk[column.name]}"
+                if column.comment:
+                    part += f" '{column.comment}'"
+                parts.append(part)
+            if len(keep) < len(table.columns):
+                parts.append("...")
+            line = f"{name}({', '.join(parts)})"
+            if table.comment:
+                line += f"  -- {table.comment}"
+            lines.append(line)
+        if joins:
+            lines.append("")
+            lines.append("-- 连接路径 (Join paths):")
+            lines.extend(f"-- {condition}" for condition in joins)
+        return "\n".join(lines)
+
+    def prune(self, question):
+        """返回只包含相关子集的紧凑 Schema 文本；置信度不足时返回全部表、全部列的紧凑表示"""
+        linked = self.link(question)
+        if linked is None:
+            names = list(self.tables)
+            joins = [c for t in names for n, c in self._graph[t] if t < n]
+            return self.render(names, joins)
+        selected, joins, columns = linked
+        return self.render(selected, joins, columns)
+
+
+async def sample_text_values(pool, tables, rows=SCHEMA_LINK_SAMPLE_ROWS):
+    """每张表读取一次，抽样文本列的取值，用于把问题中的字面值链接到列"""
+    values = {}
+    if rows <= 0:
+        return values
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            for table in tables:
+                text_columns = [c.name for c in table.columns if c.is_text]
+                if not text_columns:
+                    continue
+                select_list = ", ".join(f"`{c}`" for c in text_columns)
+                await cursor.execute(f"SELECT {select_list} FROM `{table.name}` LIMIT {int(rows)}")
+                for row in await cursor.fetchall():
+                    for column, value in zip(text_columns, row):
+                        if isinstance(value, str) and value:
+                            values.setdefault((table.name, column), set()).add(value)
+    return values
+
+
+class SchemaLinker:
+    """持有与当前 Schema 版本对应的 SchemaIndex，Schema 变化时重建"""
+
+    def __init__(self, enabled=SCHEMA_LINKING):
+        self.enabled = enabled
+        self.index = None
+        self._lock = asyncio.Lock()
+
+    async def ensure(self, pool, catalog):
+        if self.index is not None and self.index.etag == catalog.etag:
+            return self.index
+        async with self._lock:
+            if self.index is not None and self.index.etag == catalog.etag:
+                return self.index
+            await catalog.ensure_fresh(pool)
+            etag = catalog.etag
+            tables = list(catalog.table_info.values())
+            try:
+                values = await sample_text_values(pool, tables)
+            except Exception as e:
+                logging.warning(f"抽样列值失败，Schema 链接将只使用名称与注释: {e}")
+                values = {}
+            index = SchemaIndex(tables, values)
+            index.etag = etag
+            self.index = index
+            logging.info(f"Schema 链接索引已构建: {len(tables)} 张表, {index.value_count} 个抽样值。")
+            return index
+
+    async def schema_text(self, pool, catalog, question):
+        """返回要放进 Prompt 的 Schema 文本；未启用时返回 None (使用完整 CREATE TABLE)"""
+        if not self.enabled:
+            return None
+        index = await self.ensure(pool, catalog)
+        return index.prune(question)
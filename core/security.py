@@ -1,13 +1,163 @@
 # core/security.py
+import os
 import re
-import sqlparse
+import hashlib
 import logging
-from sqlparse.sql import Identifier
+from collections import OrderedDict
+
+import sqlparse
+from sqlparse import tokens as T
+from sqlparse.sql import Identifier, IdentifierList, Function, Parenthesis
 
 # 安全配置
 FORBIDDEN_FIELDS = {'password', 'salary', 'ssn', 'credentials'}
 # 简易 SQL 注入模式
 SQLI_PATTERNS = re.compile(r"(\s*(--|#))|(\s*(union|select|insert|update|delete|drop|alter)\s+)", re.IGNORECASE)
+# 缓存的 SQL 分析结果与校验结论数量上限
+SECURITY_CACHE_SIZE = int(os.getenv("SECURITY_CACHE_SIZE", 4096))
+
+# 紧跟在这些关键字之后的标识符是表 (或子查询)，而不是列
+_TABLE_KEYWORDS = {'FROM', 'INTO', 'UPDATE', 'TABLE'}
+
+# 当前 Schema 的列信息 {表名: [列名]}，用于展开 SELECT *
+_schema_columns = {}
+_schema_version = None
+
+_summaries = OrderedDict()
+_verdicts = OrderedDict()
+
+class SQLSummary:
+    """一次解析得到的语句摘要：语句类型、引用的表、引用的列 (含 * 展开)"""
+
+    __slots__ = ("statement_types", "tables", "aliases", "columns", "stars")
+
+    def __init__(self):
+        self.statement_types = []
+        self.tables = set()   # 小写表名
+        self.aliases = {}    # 小写别名 -> 小写真实表名
+        self.columns = set()  # 小写列名
+        self.stars = set()    # * 的限定名，无限定时为 None
+
+    def expanded_columns(self, schema_columns):
+        """把 * / t.* 按 Schema 展开后的全部列名 (小写)；schema_columns 的键为小写表名"""
+        columns = set(self.columns)
+        for qualifier in self.stars:
+            if qualifier is None:
+                tables = self.tables
+            else:
+                qualifier = qualifier.lower()
+                tables = {self.aliases.get(qualifier, qualifier)}
+            for table in tables:
+                columns.update(c.lower() for c in schema_columns.get(table, ()))
+        return columns
+
+def _add_table(identifier, summary):
+    subqueries = [t for t in identifier.tokens if isinstance(t, Parenthesis)]
+    if subqueries:
+        # 派生表：子查询中的引用同样需要收集
+        for subquery in subqueries:
+            _walk(subquery.tokens, summary)
+        return
+    name = identifier.get_real_name()
+    if not name:
+        return
+    # MySQL 表名通常大小写不敏感 (如 SELECT * FROM Instructor)，统一按小写记录
+    name = name.lower()
+    summary.tables.add(name)
+    alias = identifier.get_alias()
+    if alias:
+        summary.aliases[alias.lower()] = name
+    summary.aliases[name] = name
+
+def _add_column(identifier, summary):
+    children = [t for t in identifier.tokens if not t.is_whitespace]
+    if any(t.is_group and not isinstance(t, Identifier) for t in children):
+        # 表达式 / 函数 / CTE 定义：继续在内部查找列
+        _walk(identifier.tokens, summary)
+        return
+    if any(t.ttype is T.Wildcard for t in children):
+        summary.stars.add(identifier.get_parent_name())
+        return
+    name = identifier.get_real_name()
+    if name:
+        summary.columns.add(name.lower())
+
+def _walk(tokens, summary, in_function=False):
+    """遍历 (已分组的) token 树一次，收集表、列与 *"""
+    expect_table = False
+    skip_alias = False
+    for token in tokens:
+        if token.is_whitespace or token.ttype in T.Comment or token.ttype is T.Punctuation:
+            continue
+        if token.ttype in T.Keyword:
+            keyword = token.normalized
+            skip_alias = keyword == 'AS'
+            expect_table = keyword in _TABLE_KEYWORDS or keyword.endswith('JOIN')
+            continue
+        if token.ttype is T.Wildcard:
+            # COUNT(*) 中的 * 不代表读取所有列
+            if not in_function:
+                summary.stars.add(None)
+        elif isinstance(token, Function):
+            for part in token.tokens:
+                if isinstance(part, Parenthesis):
+                    _walk(part.tokens, summary, in_function=True)
+        elif isinstance(token, IdentifierList) and expect_table:
+            for item in token.get_identifiers():
+                if isinstance(item, Identifier):
+                    _add_table(item, summary)
+        elif isinstance(token, Identifier):
+            if expect_table:
+                _add_table(token, summary)
+            elif not skip_alias:
+                _add_column(token, summary)
+        elif isinstance(token, Parenthesis):
+            _walk(token.tokens, summary)
+        elif token.is_group:
+            _walk(token.tokens, summary, in_function)
+        expect_table = False
+        skip_alias = False
+
+def _remember(cache, key, value):
+    cache[key] = value
+    if len(cache) > SECURITY_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def _sql_key(sql):
+    return hashlib.sha1(sql.encode('utf-8')).digest()
+
+def analyze_sql(sql: str) -> SQLSummary:
+    """解析一次 SQL 并生成可复用的摘要，结果按 SQL 哈希缓存"""
+    key = _sql_key(sql)
+    summary = _summaries.get(key)
+    if summary is not None:
+        _summaries.move_to_end(key)
+        return summary
+    summary = SQLSummary()
+    for statement in sqlparse.parse(sql):
+        if not str(statement).strip():
+            continue
+        summary.statement_types.append(statement.get_type())
+        _walk(statement.tokens, summary)
+    _remember(_summaries, key, summary)
+    return summary
+
+def set_schema_columns(schema_columns: dict, version):
+    """登记当前 Schema 的列信息 (表名按小写登记)；版本变化时清空已缓存的校验结论"""
+    global _schema_columns, _schema_version
+    if version == _schema_version:
+        return
+    _schema_columns = {table.lower(): columns for table, columns in schema_columns.items()}
+    _schema_version = version
+    _verdicts.clear()
+
+def quote_literal(value: str) -> str:
+    """
+    把字符串写成 SQL 字符串字面值。
+    MySQL 默认把反斜杠当作转义符 (未开启 NO_BACKSLASH_ESCAPES)，因此反斜杠与单引号都要转义，
+    否则以 \\ 结尾的值会吞掉结尾的引号。
+    """
+    return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
 
 def is_potential_sqli(text: str) -> bool:
     """对用户原始输入进行简单的 SQL 注入模式检查"""
@@ -17,41 +167,41 @@ def is_potential_sqli(text: str) -> bool:
     return False
 
 def is_readonly_query(sql: str) -> bool:
-    """使用 sqlparse 检查是否为只读查询"""
-    parsed = sqlparse.parse(sql)
-    for statement in parsed:
-        if statement.get_type() != 'SELECT':
-            logging.warning(f"非只读查询被拒绝: {sql}")
-            return False
+    """检查是否为只读查询"""
+    if any(t != 'SELECT' for t in analyze_sql(sql).statement_types):
+        logging.warning(f"非只读查询被拒绝: {sql}")
+        return False
     return True
 
-def _find_identifiers(tokens):
-    """一个递归生成器，用于从 token 列表中深度查找所有 Identifier 对象。"""
-    for token in tokens:
-        # 如果 token 本身就是一个 Identifier 对象，就产生它
-        if isinstance(token, Identifier):
-            yield token
-        # 如果 token 是一个包含子 token 的列表 (并且它不是一个 Identifier)
-        # 那么就递归地进入这个列表进行查找
-        elif token.is_group:
-            yield from _find_identifiers(token.tokens)
-
 def contains_forbidden_fields(sql: str) -> bool:
     """
-    检查 SQL 是否查询了被禁止的敏感字段 (基于官方文档的正确实现)。
+    检查 SQL 是否查询了被禁止的敏感字段。
+    SELECT * / t.* 会按当前 Schema 展开后再检查。
     """
-    try:
-        parsed = sqlparse.parse(sql)[0]
-        for identifier in _find_identifiers(parsed.tokens):
-            # .get_real_name() 是获取标识符真实名称的推荐方法
-            real_name = identifier.get_real_name()
-            if real_name and real_name.lower() in FORBIDDEN_FIELDS:
-                logging.warning(f"查询包含敏感字段被拒绝: {real_name}")
-                return True
-        return False
-    except IndexError:
-        # 处理空的或无效的 SQL 字符串
-        return False
+    columns = analyze_sql(sql).expanded_columns(_schema_columns)
+    forbidden = columns & FORBIDDEN_FIELDS
+    if forbidden:
+        logging.warning(f"查询包含敏感字段被拒绝: {', '.join(sorted(forbidden))}")
+        return True
+    return False
+
+def check_sql(generated_sql: str) -> (bool, str):
+    """对生成的 SQL 做只读与敏感字段检查，结论按 SQL 哈希缓存"""
+    key = _sql_key(generated_sql)
+    verdict = _verdicts.get(key)
+    if verdict is not None:
+        _verdicts.move_to_end(key)
+        return verdict
+
+    if not is_readonly_query(generated_sql):
+        verdict = (False, "Security check failed: Only SELECT queries are allowed.")
+    elif contains_forbidden_fields(generated_sql):
+        verdict = (False, "Security check failed: Query attempts to access forbidden fields.")
+    else:
+        verdict = (True, "")
+    _remember(_verdicts, key, verdict)
+    return verdict
+
 def run_all_security_checks(natural_question: str, generated_sql: str) -> (bool, str):
     """
     运行所有安全检查。
@@ -59,11 +209,5 @@ def run_all_security_checks(natural_question: str, generated_sql: str) -> (bool,
     """
     if is_potential_sqli(natural_question):
         return False, "Invalid input detected. Potential SQL injection attempt."
-    
-    if not is_readonly_query(generated_sql):
-        return False, "Security check failed: Only SELECT queries are allowed."
 
-    if contains_forbidden_fields(generated_sql):
-        return False, "Security check failed: Query attempts to access forbidden fields."
-        
-    return True, ""
\ No newline at end of file
+    return check_sql(generated_sql)
@@ -0,0 +1,191 @@
+# core/semantic_match.py
+import os
+import re
+import functools
+
+from . import security
+from .examples import ExampleStore
+from .schema_linking import term_sequence
+
+# 是否在调用 LLM 前查找近似的已验证问题 (设为 0 关闭)
+SEMANTIC_MATCH = os.getenv("SEMANTIC_MATCH", "1") != "0"
+# 参与比对的候选问题的最低相似度与数量
+SEMANTIC_MATCH_MIN_SCORE = float(os.getenv("SEMANTIC_MATCH_MIN_SCORE", 0.6))
+SEMANTIC_MATCH_CANDIDATES = int(os.getenv("SEMANTIC_MATCH_CANDIDATES", 5))
+
+# 只影响措辞、不影响语义的词；否定、比较、排序类的词不能放在这里
+STOPWORDS = {
+    "a", "an", "the", "all", "any", "of", "in", "on", "at", "for", "from", "by", "with", "to",
+    "is", "are", "was", "were", "be", "do", "doe", "does", "did", "there",
+    "what", "which", "who", "whose", "please", "show", "list", "give", "get", "find", "display",
+    "tell", "me", "us", "i", "we", "can", "you", "could", "would", "return", "name", "their", "its",
+    "请", "列出", "查询", "显示", "一下", "哪些", "所有", "有哪", "出所",
+}
+
+_STRING_LITERAL_RE = re.compile(r"'((?:[^']|'')*)'")
+_NUMBER_RE = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+_TRAILING = r"[\s?？.。!！]*"
+# 槽位值的长度上限，避免把整段措辞当成一个值
+_MAX_SLOT_CHARS = 60
+_MAX_SLOT_WORDS = 4
+# 槽位值中出现连接词时说明问题包含多个值 (如 "Fall 2009 or Spring 2010")，不能整体替换成一个值
+_CONJUNCTION_RE = re.compile(r"\b(?:or|and|nor)\b|[,，、;；/&]|[和或及与]", re.IGNORECASE)
+
+
+class SemanticMatch:
+    __slots__ = ("sql", "question", "score", "kind", "slots")
+
+    def __init__(self, sql, question, score, kind, slots=None):
+        self.sql = sql
+        self.question = question
+        self.score = score
+        self.kind = kind    # reworded: 只有措辞不同 | slots: 替换了字面值
+        self.slots = slots or {}
+
+    def to_dict(self):
+        result = {"question": self.question, "score": round(self.score, 3), "kind": self.kind}
+        if self.slots:
+            result["slots"] = dict(self.slots)
+        return result
+
+
+def _literals(sql):
+    """SQL 中的字符串与数字字面值 (去重，按出现顺序)，返回 [(值, 是否数字)]"""
+    seen = {}
+    for match in _SQL_LITERAL_RE.finditer(sql):
+        token = match.group(0)
+        if token.startswith("'"):
+            value, numeric = token[1:-1].replace("''", "'"), False
+        else:
+            value, numeric = token, True
+        if value and value.lower() not in seen:
+            seen[value.lower()] = (value, numeric)
+    return list(seen.values())
+
+
+def _words_pattern(text):
+    """把一段固定措辞转成允许空白差异的正则"""
+    words = [re.escape(w) for w in text.split()]
+    pattern = r"\s+".join(words)
+    if words and text[:1].isspace():
+        pattern = r"\s+" + pattern
+    if words and text[-1:].isspace():
+        pattern += r"\s+"
+    if not words and text:
+        pattern = r"\s+"
+    return pattern
+
+
+@functools.lru_cache(maxsize=4096)
+def question_template(question, sql):
+    """
+    用 SQL 中出现在问题里的字面值把问题变成模板。
+    返回 (编译后的正则, [(原值, 是否数字)])；每个槽位对应一个捕获组。
+    """
+    spans = []
+    for value, numeric in _literals(sql):
+        if numeric:
+            pattern = rf"(?<![\w.]){re.escape(value)}(?![\w.])"
+        else:
+            pattern = rf"(?<![A-Za-z0-9]){re.escape(value)}(?![A-Za-z0-9])"
+        match = re.search(pattern, question, re.IGNORECASE)
+        if match:
+            spans.append((match.start(), match.end(), value, numeric))
+    spans.sort()
+
+    parts, slots, position = [], [], 0
+    for start, end, value, numeric in spans:
+        if start < position:
+            continue  # 与前一个槽位重叠
+        parts.append(_words_pattern(question[position:start]))
+        parts.append(r"(\d+(?:\.\d+)?)" if numeric else r"(.+?)")
+        slots.append((value, numeric))
+        position = end
+    tail = question[position:].rstrip(" \t?？.。!！")
+    parts.append(_words_pattern(tail))
+    regex = re.compile("^" + "".join(parts) + _TRAILING + "$", re.IGNORECASE)
+    return regex, slots
+
+
+def _substitute(sql, replacements):
+    """把 SQL 中的字面值替换成新值；replacements 为 {原值小写: (新值, 是否数字)}"""
+    def replace(match):
+        token = match.group(0)
+        value = token[1:-1].replace("''", "'") if token.startswith("'") else token
+        new = replacements.get(value.lower())
+        if new is None:
+            return token
+        new_value, numeric = new
+        if numeric:
+            return new_value
+        return security.quote_literal(new_value)
+    return _SQL_LITERAL_RE.sub(replace, sql)
+
+
+def _content_terms(text):
+    """去掉虚词后的内容词，保留词序 ("students by credits" 与 "credits by students" 不同)"""
+    return [t for t in term_sequence(text) if t not in STOPWORDS]
+
+
+def match_pair(question, stored_question, stored_sql):
+    """
+    判断 question 能否直接复用 stored_sql。
+    返回 (kind, sql, slots)，不能复用时返回 None。
+    """
+    regex, slots = question_template(stored_question, stored_sql)
+    match = regex.match(question.strip())
+    if match:
+        replacements, changed = {}, {}
+        for (old, numeric), new in zip(slots, match.groups()):
+            new = new.strip()
+            if not new or len(new) > _MAX_SLOT_CHARS or len(new.split()) > _MAX_SLOT_WORDS \
+                    or _CONJUNCTION_RE.search(new):
+                return None
+            replacements[old.lower()] = (new, numeric)
+            if new.lower() != old.lower():
+                changed[old] = new
+        if not changed:
+            return "reworded", stored_sql, {}
+        return "slots", _substitute(stored_sql, replacements), changed
+
+    # 措辞不同：去掉虚词后内容词必须按相同顺序完全相同，且不能出现问题中没有的新数字
+    if _content_terms(question) == _content_terms(stored_question) \
+            and set(_NUMBER_RE.findall(question)) == set(_NUMBER_RE.findall(stored_question)):
+        return "reworded", stored_sql, {}
+    return None
+
+
+class SemanticMatcher:
+    """
+    在调用 LLM 之前，从已验证的 问题 → SQL 示例库中查找近似问题：
+    只有措辞差异时直接复用 SQL，只有字面值 (系名、年份、预算等) 不同时替换字面值后复用。
+    复用的 SQL 仍会经过安全校验与成本评估。
+    value_check(value) 用于确认替换进去的字符串是数据库中真实存在的值：
+    只有每个新的字符串值都返回 True 时才复用 (返回 None 即无法确认时同样放弃)；
+    没有 value_check 时只允许替换数字。
+    """
+
+    def __init__(self, store: ExampleStore, value_check=None, enabled=SEMANTIC_MATCH,
+                 min_score=SEMANTIC_MATCH_MIN_SCORE, candidates=SEMANTIC_MATCH_CANDIDATES):
+        self.store = store
+        self.value_check = value_check
+        self.enabled = enabled
+        self.min_score = min_score
+        self.candidates = candidates
+
+    def lookup(self, question):
+        """返回 SemanticMatch，没有足够把握时返回 None"""
+        if not self.enabled:
+            return None
+        for score, stored_question, stored_sql in self.store.search(question, self.candidates, self.min_score):
+            result = match_pair(question, stored_question, stored_sql)
+            if result is None:
+                continue
+            kind, sql, slots = result
+            strings = [new for new in slots.values() if not _NUMBER_RE.fullmatch(new)]
+            if strings and (self.value_check is None
+                            or not all(self.value_check(new) is True for new in strings)):
+                continue
+            return SemanticMatch(sql, stored_question, score, kind, slots)
+        return None
@@ -0,0 +1,163 @@
+# core/shared_cache.py
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import datetime
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+
+# 多个工作进程共享的缓存文件 (SQLite)，未设置时各进程只使用自己的内存缓存
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH") or None
+# 共享缓存的总容量 (字节)，超出后淘汰最早写入的条目
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# 每写入多少条检查一次容量
+_EVICT_EVERY = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    ns TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+);
+CREATE INDEX IF NOT EXISTS entries_stored_at ON entries (stored_at);
+"""
+
+
+def _json_default(obj):
+    """与服务器响应相同的编码：Decimal 转为数值，日期时间转为 ISO 字符串"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, bytes):
+        return obj.hex()
+    return str(obj)
+
+
+def encode(value) -> str:
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+class SharedCache:
+    """
+    同一台机器上多个工作进程共享的缓存层，存放在 WAL 模式的 SQLite 文件中。
+    条目按命名空间 (question / result / cursor) 区分，值为 JSON。
+    读写在专用线程中进行，不阻塞事件循环；写入不等待完成 (写失败只记录日志)。
+    作为各进程内存缓存之后的第二级：内存未命中时再查这里，新条目同时写入两级。
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH, max_bytes=SHARED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._writes = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _get(self, ns, key):
+        row = self._connection().execute(
+            "SELECT value, stored_at FROM entries WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _put(self, ns, key, value):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO entries (ns, key, value, size, stored_at) VALUES (?, ?, ?, ?, ?)",
+            (ns, key, value, len(value), time.time()))
+        self._writes += 1
+        if self._writes % _EVICT_EVERY == 0:
+            self._evict()
+
+    def _delete(self, ns, key):
+        self._connection().execute("DELETE FROM entries WHERE ns = ? AND key = ?", (ns, key))
+
+    def _evict(self):
+        conn = self._connection()
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_bytes:
+            return
+        # 淘汰最早写入的条目，直到回到容量的 90%
+        excess = total - int(self.max_bytes * 0.9)
+        rows = conn.execute("SELECT rowid, size FROM entries ORDER BY stored_at").fetchall()
+        doomed = []
+        for rowid, size in rows:
+            if excess <= 0:
+                break
+            doomed.append((rowid,))
+            excess -= size
+        conn.executemany("DELETE FROM entries WHERE rowid = ?", doomed)
+
+    async def get(self, ns, key):
+        """返回 (值, 写入时间)；不存在或读取失败时返回 None"""
+        if not self.enabled:
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            entry = await loop.run_in_executor(self._executor, self._get, ns, key)
+        except (sqlite3.Error, ValueError) as e:
+            logging.warning(f"读取共享缓存失败: {e}")
+            entry = None
+        metrics.SHARED_CACHE_LOOKUPS.inc(cache=ns, result="miss" if entry is None else "hit")
+        return entry
+
+    def _submit(self, fn, *args):
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(_log_failure)
+
+    def put(self, ns, key, value):
+        if self.enabled:
+            self._submit(self._put, ns, key, encode(value))
+
+    async def write(self, ns, key, value):
+        """写入并等待完成 (其他进程随后必须能读到时使用)"""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._put, ns, key, encode(value))
+        except sqlite3.Error as e:
+            logging.warning(f"写入共享缓存失败: {e}")
+
+    def delete(self, ns, key):
+        if self.enabled:
+            self._submit(self._delete, ns, key)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def close(self):
+        """等待尚未完成的写入后关闭连接 (之后再使用会重新打开)"""
+        if self.enabled:
+            self._executor.submit(self._close).result()
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.warning(f"写入共享缓存失败: {future.exception()}")
@@ -0,0 +1,50 @@
+# core/singleflight.py
+import asyncio
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同 key 的并发调用：同一时刻只执行一次，所有等待者共享结果或异常。
+    某个等待者被取消 (如客户端断开) 只影响它自己；只有当所有等待者都离开时才取消底层任务。
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.shared = 0  # 通过合并省掉的调用次数
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key, fn):
+        """以 key 合并执行 fn() 返回的协程"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.shared += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # 最后一个等待者也离开了，取消底层任务，并让后来者重新发起
+                self._forget(key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
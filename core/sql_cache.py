@@ -0,0 +1,118 @@
+# core/sql_cache.py
+import os
+import json
+import time
+import logging
+import unicodedata
+from collections import OrderedDict
+
+# 问题 → SQL 缓存配置
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", 1000))
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", 24 * 3600))
+# 设置后在启动时加载、关闭时写回该 JSON 文件，重启后缓存不会冷启动
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH")
+
+
+def normalize_question(question: str) -> str:
+    """
+    归一化用户问题：全角转半角 (NFKC)、大小写折叠、标点替换为空格、合并空白。
+    "计算机科学系（Comp. Sci.）有哪些课程？" 与 "计算机科学系 (comp sci) 有哪些课程" 得到相同结果。
+    """
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return " ".join(text.split())
+
+
+def make_key(question: str, schema_version) -> str:
+    """缓存键 = Schema 版本 + 归一化后的问题；Schema 变化后旧条目自然失效"""
+    return f"{schema_version}|{normalize_question(question)}"
+
+
+class QuestionSQLCache:
+    """
+    问题 → SQL 的 LRU 缓存，条目超过 ttl 秒后过期。
+    配置了 shared (SharedCache) 时新条目同时写入共享缓存，内存未命中时由 lookup 查共享缓存。
+    """
+
+    def __init__(self, max_entries=SQL_CACHE_SIZE, ttl=SQL_CACHE_TTL, path=SQL_CACHE_PATH, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        # key -> (sql, 写入时间)，使用墙上时间以便持久化后 TTL 仍然有效
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        sql, stored_at = entry
+        if time.time() - stored_at > self.ttl:
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return sql
+
+    async def lookup(self, key):
+        """先查内存，未命中时查共享缓存 (命中的条目放入内存)"""
+        sql = self.get(key)
+        if sql is not None or self.shared is None or not self.shared.enabled:
+            return sql
+        entry = await self.shared.get("question", key)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        self._store(key, entry[0], entry[1])
+        return entry[0]
+
+    def _store(self, key, sql, stored_at):
+        self._entries[key] = (sql, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key, sql):
+        self._store(key, sql, time.time())
+        if self.shared is not None:
+            self.shared.put("question", key, sql)
+
+    def stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def load(self):
+        """从磁盘加载缓存，文件不存在或损坏时从空缓存开始"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"加载 SQL 缓存失败，将从空缓存开始: {e}")
+            return
+        now = time.time()
+        for key, sql, stored_at in entries:
+            if now - stored_at <= self.ttl:
+                self._entries[key] = (sql, stored_at)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        logging.info(f"已从 {self.path} 加载 {len(self._entries)} 条 SQL 缓存。")
+
+    def save(self):
+        """原子地写回磁盘 (先写临时文件再替换)"""
+        if not self.path:
+            return
+        # 多个工作进程可能同时保存，各自使用不同的临时文件
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([[k, sql, t] for k, (sql, t) in self._entries.items()], f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"保存 SQL 缓存失败: {e}")
@@ -0,0 +1,225 @@
+# core/sql_extract.py
+import re
+
+# 空行之后以这些词开头时仍视为同一条 SQL 的延续
+_CONTINUATION_WORDS = {
+    "select", "from", "where", "join", "inner", "left", "right", "full", "cross", "natural",
+    "straight_join", "on", "using", "and", "or", "not", "group", "order", "by", "having", "limit",
+    "offset", "union", "except", "intersect", "with", "as", "case", "when", "then", "else", "end",
+    "in", "exists", "is", "null", "between", "like", "distinct", "all", "asc", "desc",
+    "window", "over", "partition", "lateral", "values",
+}
+# SQL 的起点：代码块，或以 SELECT / WITH 开头的行
+_START_RE = re.compile(r"```[^\n]*\n|^[ \t]*\(*[ \t]*(?:select|with)\b", re.IGNORECASE | re.MULTILINE)
+_FENCE_RE = re.compile(r"```[^\n]*\n")
+# WITH 开头的 SQL 必须是公用表表达式: WITH [RECURSIVE] 名称 [(列...)] AS (
+_CTE_RE = re.compile(r"\s*\(*\s*with\s+(?:recursive\s+)?[`\"\w]+\s*(?:\([^)]*\)\s*)?as\s*\(", re.IGNORECASE)
+# SELECT 行中说明它是 SQL 而不是英文句子 ("Select the students who ...") 的记号
+_SQL_LINE_RE = re.compile(r"[*,()=<>`]|\w\.\w|\b(?:from|as|distinct|count|sum|avg|min|max)\b", re.IGNORECASE)
+_PROSE_MIN_WORDS = 3
+_ERROR_PREFIX = "error:"
+_ERROR_END_RE = re.compile(r"\.\s|\n")
+_WORD_RE = re.compile(r"[A-Za-z_]+|[()]")
+
+
+class SQLStreamExtractor:
+    """
+    从模型的增量输出中识别第一条完整的 SQL 语句。
+    跳过语句前的说明文字与代码块标记；语句在顶层的分号、代码块结束标记或
+    后面不再是 SQL 的空行处结束，之后模型输出的解释不再需要等待。
+    以 "Error:" 开头的输出 (无法回答) 在第一行结束时返回。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.result = None
+        self._start = None   # SQL 在 buffer 中的起点
+        self._error = False
+        self._pos = 0        # 已扫描到的位置
+        self._quote = None
+        self._comment = None  # "line" | "block"
+
+    def feed(self, chunk: str):
+        """追加一段输出；识别出完整的 SQL 后返回它，否则返回 None"""
+        if self.result is not None:
+            return self.result
+        self.buffer += chunk
+        if self._start is None and not self._seek():
+            return None
+        if self._error:
+            # 错误说明在第一句或第一行结束
+            end = _ERROR_END_RE.search(self.buffer, self._start)
+            if end is not None:
+                self.result = self.buffer[self._start:end.start() + 1].strip()
+        else:
+            self._scan()
+        return self.result
+
+    def finish(self) -> str:
+        """输出结束时返回已识别的内容 (没有明确结束标记时取全部剩余文本)"""
+        if self.result is not None:
+            return self.result
+        if self._start is None and not self._seek(final=True):
+            return self.buffer.strip()
+        text = self.buffer[self._start:]
+        if not self._error:
+            text = text.split("```", 1)[0]
+        return text.strip()
+
+    def _seek(self, final=False):
+        stripped = self.buffer.lstrip()
+        if stripped[:len(_ERROR_PREFIX)].lower() == _ERROR_PREFIX:
+            self._start = len(self.buffer) - len(stripped)
+            self._error = True
+            return True
+        # 已经出现代码块时优先取代码块中的内容
+        fence = _FENCE_RE.search(self.buffer)
+        if fence is not None:
+            self._start = self._pos = fence.end()
+            return True
+        for match in _START_RE.finditer(self.buffer):
+            looks_like_sql = self._bare_start(match, final)
+            if looks_like_sql is None:
+                return False  # 信息不足，留到下一段再判断
+            if looks_like_sql:
+                self._start = self._pos = match.start()
+                return True
+        return False
+
+    def _bare_start(self, match, final=False):
+        """
+        以 SELECT / WITH 开头的行是否真的是 SQL (而不是 "With the given schema, ..." 之类的说明)：
+        返回 True / False，信息不足时返回 None。
+        """
+        # 关键词后面还没有输出 (可能是 "SELECTED" 之类的普通单词)
+        if match.end() == len(self.buffer):
+            return True if final else None
+        text = self.buffer[match.start():]
+        if match.group(0).strip().lstrip("(").strip().lower() == "with":
+            if _CTE_RE.match(text):
+                return True
+            # 到第一个左括号 (或足够长) 时仍不是公用表表达式，就不是 SQL
+            return False if final or "(" in text or len(text) > 200 else None
+        line = text.split("\n", 1)[0]
+        if _SQL_LINE_RE.search(line):
+            return True
+        if "\n" not in text and not final:
+            return None  # 等这一行输出完整
+        return len(line.split()) < _PROSE_MIN_WORDS
+
+    def _scan(self):
+        text = self.buffer
+        i = self._pos
+        n = len(text)
+        while i < n:
+            ch = text[i]
+            if self._comment == "line":
+                if ch == "\n":
+                    self._comment = None
+                i += 1
+                continue
+            if self._comment == "block":
+                if text.startswith("*/", i):
+                    self._comment = None
+                    i += 2
+                elif i + 1 == n:
+                    break
+                else:
+                    i += 1
+                continue
+            if self._quote is not None:
+                if ch == "\\" and self._quote != "`":
+                    if i + 1 == n:
+                        break
+                    i += 2
+                    continue
+                if ch == self._quote:
+                    if i + 1 == n:
+                        break  # 可能是 '' 转义，等下一段
+                    if text[i + 1] == ch:
+                        i += 2
+                        continue
+                    self._quote = None
+                i += 1
+                continue
+
+            if ch in "'\"`":
+                if ch == "`" and text.startswith("```", i):
+                    self._finish(i)
+                    return
+                if ch == "`" and i + 3 > n:
+                    break  # 可能是代码块结束标记的开头
+                self._quote = ch
+            elif ch == ";":
+                self._finish(i + 1)
+                return
+            elif ch == "#" or text.startswith("-- ", i):
+                self._comment = "line"
+            elif ch in "-/" and i + 3 > n:
+                break  # 可能是注释的开头
+            elif text.startswith("/*", i):
+                self._comment = "block"
+            elif ch == "\n":
+                blank = self._blank_line_end(text, i)
+                if blank is None:
+                    break
+                if blank:
+                    self._finish(i)
+                    return
+            i += 1
+        self._pos = i
+
+    def _blank_line_end(self, text, i):
+        """
+        i 处的换行是否开始了一个空行且其后不再是 SQL：
+        返回 True / False，信息不足 (还需更多输出) 时返回 None。
+        """
+        rest = text[i + 1:]
+        stripped = rest.lstrip(" \t\r")
+        if not stripped:
+            return None
+        if stripped[0] != "\n":
+            return False
+        following = stripped.lstrip()
+        if not following:
+            return None
+        if following[0] in "-#/":
+            # 空行后的注释仍属于这条语句 (后面可能还有 FROM 等子句)
+            if len(following) < 2:
+                return None
+            return not (following[0] == "#" or following.startswith(("--", "/*")))
+        word = _WORD_RE.match(following)
+        if word is None:
+            return True
+        if word.end() == len(following):
+            return None
+        return word.group(0).lower() not in _CONTINUATION_WORDS and word.group(0) not in "()"
+
+    def _finish(self, end):
+        self.result = self.buffer[self._start:end].strip()
+
+
+def extract_sql(text: str) -> str:
+    """从完整的模型输出中取出第一条 SQL (去掉说明文字与代码块标记)"""
+    fence = _FENCE_RE.search(text)
+    if fence is not None:
+        # 有代码块时取代码块，不理会前面说明文字中以 SELECT / WITH 开头的行
+        text = text[fence.start():]
+    extractor = SQLStreamExtractor()
+    return extractor.feed(text) or extractor.finish()
+
+
+async def read_first_statement(chunks):
+    """
+    消费模型的流式输出，识别出第一条完整的 SQL 后立即停止读取 (关闭流即中止生成)。
+    返回 (sql, 是否提前结束)。
+    """
+    extractor = SQLStreamExtractor()
+    try:
+        async for chunk in chunks:
+            sql = extractor.feed(chunk)
+            if sql is not None:
+                return sql, True
+    finally:
+        await chunks.aclose()
+    return extractor.finish(), False
@@ -0,0 +1,314 @@
+# core/value_index.py
+import os
+import re
+import time
+import asyncio
+import difflib
+import logging
+
+from .sql_cache import normalize_question
+from .result_cache import MARKERS_SQL
+from . import security
+
+# 是否建立列取值索引 (设为 0 关闭 Prompt 中的取值提示与字面值校正)
+VALUE_INDEX = os.getenv("VALUE_INDEX", "1") != "0"
+# 不同取值超过该数的列视为高基数列 (姓名、编号等)，不建索引
+VALUE_INDEX_MAX_DISTINCT = int(os.getenv("VALUE_INDEX_MAX_DISTINCT", 100))
+# 整个索引最多保存的取值数，超出后不再为剩余的列建索引
+VALUE_INDEX_MAX_VALUES = int(os.getenv("VALUE_INDEX_MAX_VALUES", 50000))
+# 后台检查表变更标记、增量刷新变化表的间隔 (秒)
+VALUE_INDEX_REFRESH = float(os.getenv("VALUE_INDEX_REFRESH", 300))
+# 模糊匹配的最低相似度
+VALUE_MATCH_MIN_SCORE = float(os.getenv("VALUE_MATCH_MIN_SCORE", 0.85))
+# 每个 Prompt 中最多列出的取值提示数
+VALUE_HINTS_MAX = int(os.getenv("VALUE_HINTS_MAX", 8))
+
+# 只为短字符串类型建索引；TEXT 类列几乎不会是低基数的枚举值
+_INDEXED_TYPES = ("char", "varchar", "enum", "set")
+# 单个取值的长度上限，更长的值不会出现在 WHERE 的等值条件里
+_MAX_VALUE_CHARS = 100
+# 缩写匹配 (Comp. Sci. ↔ computer science) 的相似度
+_ABBREVIATION_SCORE = 0.9
+
+# col = 'x' / t.col <> 'x'，以及 col [NOT] IN ('x', 'y')
+_COMPARISON_RE = re.compile(
+    r"(?<![\w.`])(?:`?(\w+)`?\s*\.\s*)?`?(\w+)`?\s*(?:=|<>|!=)\s*'((?:[^']|'')*)'")
+_IN_LIST_RE = re.compile(
+    r"(?<![\w.`])(?:`?(\w+)`?\s*\.\s*)?`?(\w+)`?\s+(?:NOT\s+)?IN\s*\(([^()]*)\)", re.IGNORECASE)
+_STRING_RE = re.compile(r"'((?:[^']|'')*)'")
+_LETTER_RE = re.compile(r"[^\W\d_]")
+
+
+def _abbreviates(short, long):
+    if len(short) > len(long):
+        short, long = long, short
+    return short == long or (len(short) >= 2 and long.startswith(short))
+
+
+def value_similarity(text, value):
+    """
+    文本与列取值的相似度 (0~1)：规范化后相同为 1；
+    逐词互为前缀 (Comp. Sci. ↔ computer science) 视为缩写；其余按编辑相似度。
+    """
+    a, b = normalize_question(text), normalize_question(value)
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    wa, wb = a.split(), b.split()
+    if len(wa) == len(wb) and all(_abbreviates(x, y) for x, y in zip(wa, wb)) \
+            and (len(wa) > 1 or min(len(a), len(b)) >= 3):
+        return _ABBREVIATION_SCORE
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def _bucket(words):
+    return words[0][:2]
+
+
+class ValueIndex:
+    """
+    低基数文本列 (dept_name、building、semester 等) 的全部不同取值。
+    每张表用一条 UNION ALL 语句批量读取，各列的 DISTINCT 都带 LIMIT，内存占用有上界；
+    之后按表变更标记只重读变化过的表。
+    用途：把问题中提到的取值写进 Prompt，以及在执行前校正生成 SQL 中写错的字面值。
+    """
+
+    def __init__(self, enabled=VALUE_INDEX, max_distinct=VALUE_INDEX_MAX_DISTINCT,
+                 max_values=VALUE_INDEX_MAX_VALUES, refresh_interval=VALUE_INDEX_REFRESH,
+                 min_score=VALUE_MATCH_MIN_SCORE):
+        self.enabled = enabled
+        self.max_distinct = max_distinct
+        self.max_values = max_values
+        self.refresh_interval = refresh_interval
+        self.min_score = min_score
+        self.etag = None
+        self.value_count = 0
+        # (表, 列) -> {小写取值: 原值}
+        self._columns = {}
+        # 小写列名 -> [(表, 列)]
+        self._by_name = {}
+        # 规范化取值的首词前两个字符 -> [(规范化词列表, 表, 列, 原值)]
+        self._buckets = {}
+        self._max_words = 0
+        self._markers = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def __len__(self):
+        return self.value_count
+
+    # --- 构建与刷新 ---
+
+    def _indexed_columns(self, table):
+        return [c.name for c in table.columns if c.type.lower().split("(")[0] in _INDEXED_TYPES]
+
+    async def _read_table(self, cursor, table):
+        """一条语句读出表中各候选列至多 max_distinct + 1 个不同取值，返回 {列: [取值]}"""
+        columns = self._indexed_columns(table)
+        if not columns:
+            return {}
+        limit = self.max_distinct + 1
+        parts = [
+            f"(SELECT %s AS c, CAST(`{c}` AS CHAR) AS v FROM (SELECT DISTINCT `{c}` FROM `{table.name}` "
+            f"WHERE `{c}` IS NOT NULL LIMIT {limit}) AS d{i})"
+            for i, c in enumerate(columns)
+        ]
+        await cursor.execute(" UNION ALL ".join(parts), columns)
+        values = {c: [] for c in columns}
+        for column, value in await cursor.fetchall():
+            values[column].append(value)
+        # 取满 LIMIT 的列说明不同取值过多，不是枚举型的列
+        return {c: v for c, v in values.items() if len(v) <= self.max_distinct}
+
+    async def _read_markers(self, cursor):
+        try:
+            try:
+                await cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+            except Exception:
+                pass  # MariaDB / 旧版本 MySQL 没有这个变量
+            await cursor.execute(MARKERS_SQL)
+            return {name: f"{updated}|{created}" for name, updated, created in await cursor.fetchall()}
+        except Exception as e:
+            logging.warning(f"读取表变更标记失败，本次只在 Schema 变化时刷新取值索引: {e}")
+            return None
+
+    async def refresh(self, pool, catalog):
+        """首次调用时为全部表建索引，之后只重读 Schema 或变更标记变化过的表"""
+        if not self.enabled:
+            return
+        async with self._lock:
+            await catalog.ensure_fresh(pool)
+            schema_changed = self.etag != catalog.etag
+            tables = catalog.table_info
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    markers = await self._read_markers(cursor)
+                    stale = [
+                        t for name, t in tables.items()
+                        if schema_changed or name not in self._markers
+                        or (markers is not None and markers.get(name) != self._markers[name])
+                    ]
+                    stale_names = {t.name for t in stale}
+                    columns = {k: v for k, v in self._columns.items()
+                               if k[0] in tables and k[0] not in stale_names}
+                    start = time.perf_counter()
+                    for table in stale:
+                        try:
+                            read = await self._read_table(cursor, table)
+                        except Exception as e:
+                            logging.warning(f"读取表 {table.name} 的列取值失败: {e}")
+                            continue
+                        for column, values in read.items():
+                            kept = {v.casefold(): v for v in values
+                                    if v and len(v) <= _MAX_VALUE_CHARS and _LETTER_RE.search(v)}
+                            if kept:
+                                columns[(table.name, column)] = kept
+                        self._markers[table.name] = (markers or {}).get(table.name)
+            self._markers = {t: m for t, m in self._markers.items() if t in tables}
+            self.etag = catalog.etag
+            self._install(columns)
+            if stale:
+                logging.info(f"列取值索引已刷新: {len(stale)} 张表, {len(self._columns)} 列, "
+                             f"{self.value_count} 个取值, 耗时 {time.perf_counter() - start:.2f}s。")
+
+    def _install(self, columns):
+        """按列名顺序装入取值，总数超过上限的列不再收录"""
+        kept, total = {}, 0
+        for key in sorted(columns):
+            if total + len(columns[key]) > self.max_values:
+                logging.warning(f"列取值索引已达上限 {self.max_values}，跳过 {key[0]}.{key[1]}。")
+                continue
+            kept[key] = columns[key]
+            total += len(columns[key])
+        by_name, buckets, max_words = {}, {}, 0
+        for (table, column), values in kept.items():
+            by_name.setdefault(column.lower(), []).append((table, column))
+            for value in values.values():
+                words = normalize_question(value).split()
+                if not words:
+                    continue
+                buckets.setdefault(_bucket(words), []).append((words, table, column, value))
+                max_words = max(max_words, len(words))
+        self._columns, self._by_name, self._buckets = kept, by_name, buckets
+        self._max_words = max_words
+        self.value_count = total
+
+    async def _run(self, pool, catalog):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh(pool, catalog)
+            except Exception as e:
+                logging.warning(f"刷新列取值索引失败: {e}")
+
+    def start(self, pool, catalog):
+        """启动后台增量刷新任务"""
+        if not self.enabled or self.refresh_interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(pool, catalog))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # --- 查询 ---
+
+    def has_value(self, value):
+        """值是否是某个已索引列的取值 (不区分大小写)"""
+        key = value.casefold()
+        return any(key in values for values in self._columns.values())
+
+    def hints(self, question, limit=VALUE_HINTS_MAX):
+        """
+        问题中提到的列取值 (精确、缩写或拼写相近)，返回 [(表, 列, 取值)]，按相似度从高到低。
+        只比较首词前两个字符相同的取值，避免与整个索引逐一比对。
+        """
+        if not self._buckets:
+            return []
+        words = normalize_question(question).split()
+        best = {}
+        for size in range(1, self._max_words + 1):
+            for i in range(len(words) - size + 1):
+                window = words[i:i + size]
+                text = " ".join(window)
+                if len(text) < 3 or not _LETTER_RE.search(text):
+                    continue
+                for value_words, table, column, value in self._buckets.get(_bucket(window), ()):
+                    if len(value_words) != size:
+                        continue
+                    score = value_similarity(text, value)
+                    if score >= self.min_score and score > best.get((table, column, value), 0.0):
+                        best[(table, column, value)] = score
+        ranked = sorted(best, key=lambda k: (-best[k], k))
+        return ranked[:limit]
+
+    def _candidate_columns(self, qualifier, column, summary):
+        candidates = self._by_name.get(column.lower(), ())
+        if qualifier:
+            table = summary.aliases.get(qualifier.lower(), qualifier)
+            return [c for c in candidates if c[0].lower() == table.lower()]
+        tables = {t.lower() for t in summary.tables}
+        return [c for c in candidates if c[0].lower() in tables]
+
+    def _closest(self, literal, columns):
+        """literal 在这些列中的唯一最佳近似取值；已是合法取值或没有把握时返回 None"""
+        key = literal.casefold()
+        if not _LETTER_RE.search(literal) or any(key in self._columns[c] for c in columns):
+            return None
+        scored = {}
+        for c in columns:
+            for value in self._columns[c].values():
+                score = value_similarity(literal, value)
+                if score >= self.min_score:
+                    scored[value] = max(score, scored.get(value, 0.0))
+        if not scored:
+            return None
+        top = max(scored.values())
+        best = [v for v, s in scored.items() if s == top]
+        return best[0] if len(best) == 1 else None
+
+    def correct_sql(self, sql):
+        """
+        把与已索引列比较的字符串字面值校正为最接近的真实取值。
+        返回 (新 SQL, [{"column", "from", "to"}])；没有需要校正的字面值时原样返回。
+        """
+        if not self._columns or "'" not in sql:
+            return sql, []
+        summary = security.analyze_sql(sql)
+        replacements = []  # [(起, 止, 新字面值)]
+        corrections = []
+
+        def consider(qualifier, column, start, end, raw):
+            columns = self._candidate_columns(qualifier, column, summary)
+            if not columns:
+                return
+            literal = raw.replace("''", "'")
+            value = self._closest(literal, columns)
+            if value is None:
+                return
+            replacements.append((start, end, security.quote_literal(value)))
+            corrections.append({"column": f"{columns[0][0]}.{columns[0][1]}", "from": literal, "to": value})
+
+        for match in _COMPARISON_RE.finditer(sql):
+            consider(match.group(1), match.group(2), match.start(3) - 1, match.end(3) + 1, match.group(3))
+        for match in _IN_LIST_RE.finditer(sql):
+            offset = match.start(3)
+            for item in _STRING_RE.finditer(match.group(3)):
+                consider(match.group(1), match.group(2),
+                         offset + item.start(), offset + item.end(), item.group(1))
+        if not replacements:
+            return sql, []
+        parts, position = [], 0
+        for start, end, text in sorted(replacements):
+            parts.append(sql[position:start])
+            parts.append(text)
+            position = end
+        parts.append(sql[position:])
+        return "".join(parts), corrections
@@ -1,53 +1,154 @@
 # mcp_server/server.py
-import sys
-import sqlparse
 import os
-
-print("--- PYTHON 环境诊断信息 ---")
-print(f"正在使用的 Python 解释器: {sys.executable}")
-print(f"代码看到的 SQLParse 版本:  {sqlparse.__version__}")
-print(f"代码加载的 SQLParse 路径:     {sqlparse.__file__}")
-print("--------------------------------------\n")
-
+import re
+import sys
 import json
+import time
+import asyncio
 import logging
+import datetime
+import functools
+from decimal import Decimal
 from logging.handlers import RotatingFileHandler
 
-import aiomysql
-import aiohttp_cors
 from aiohttp import web
 from dotenv import load_dotenv
 
-# 在所有其他导入之前加载环境变量
+# 在导入 core 之前加载环境变量 (core 的各模块在导入时读取配置，但不做校验和 I/O)
 load_dotenv()
 
 from core import orchestrator
+from core import llm_handler
+from core import metrics
+from core.query_log import LogFilter, parse_timestamp
+from mcp_server import workers
+
+# 数据库连接池的大小；最小连接数在启动时建立，服务器就绪前即可用
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
 
-# --- 日志配置 ---
-log_dir = 'logs'
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
 
-log_file_path = os.path.join(log_dir, 'app.log')
+# --- 日志配置 ---
+def configure_logging(log_dir='logs', log_name='app.log'):
+    """同时输出到控制台和按大小轮转的日志文件 (在 main 中调用，导入模块时不做任何配置)"""
+    os.makedirs(log_dir, exist_ok=True)
+    log_file_path = os.path.join(log_dir, log_name)
 
-# 创建一个 rotating file handler
-# 每个日志文件最大 5MB, 最多保留 5 个备份
-file_handler = RotatingFileHandler(log_file_path, maxBytes=5*1024*1024, backupCount=5, encoding='utf-8')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    # 创建一个 rotating file handler
+    # 每个日志文件最大 5MB, 最多保留 5 个备份
+    file_handler = RotatingFileHandler(log_file_path, maxBytes=5*1024*1024, backupCount=5, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 
-# 配置根 logger
-logging.basicConfig(level=logging.INFO, handlers=[
-    logging.StreamHandler(),  # 同时输出到控制台
-    file_handler              # 和文件
-])
+    # 配置根 logger
+    logging.basicConfig(level=logging.INFO, handlers=[
+        logging.StreamHandler(),  # 同时输出到控制台
+        file_handler              # 和文件
+    ])
 
 
 # --- 全局状态 ---
 db_pool = None
 
+# --- JSON 编码 ---
+def _json_default(obj):
+    """数据库返回的 Decimal / 日期时间等类型的 JSON 编码"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, bytes):
+        return obj.hex()
+    return str(obj)
+
+json_dumps = functools.partial(json.dumps, default=_json_default, ensure_ascii=False)
+
+def _ndjson_line(obj):
+    return (json_dumps(obj) + "\n").encode("utf-8")
+
+def _sse_event(event, obj):
+    return f"event: {event}\ndata: {json_dumps(obj)}\n\n".encode("utf-8")
+
+# --- 分页结果的传输格式 ---
+# rows: data 为对象数组 (默认)；columnar: 列名只出现一次，rows 为数组的数组；
+# arrow: Arrow IPC 流，结果中 data 以外的字段以 JSON 存放在 schema 元数据的 "nl2sql" 键中
+RESULT_FORMATS = ("rows", "columnar", "arrow")
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+
+def _result_format(data):
+    fmt = data.get("format", "rows")
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(RESULT_FORMATS)}")
+    return fmt
+
+def _columns_of(result):
+    """结果的列名：有行时取自行的键，没有行时取执行时记下的列 (旧的缓存结果可能没有)"""
+    rows = result["data"]
+    return list(rows[0].keys()) if rows else list(result.get("columns") or ())
+
+def _arrow_body(result):
+    """把一页结果编码为 Arrow IPC 流 (需要 pyarrow，未安装时抛出 ImportError)"""
+    import pyarrow as pa
+
+    rows = result["data"]
+    columns = _columns_of(result)
+    arrays = []
+    for column in columns:
+        values = [row[column] for row in rows]
+        try:
+            # 空结果的列为 null 类型，但列名仍保留在 schema 中
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # 同一列中类型不一致 (MySQL 的表达式列可能如此) 时按 JSON 编码规则转为字符串
+            arrays.append(pa.array([v if v is None or isinstance(v, str) else json_dumps(v).strip('"')
+                                    for v in values], type=pa.string()))
+    # 列名已在 schema 中
+    meta = {k: v for k, v in result.items() if k not in ("data", "columns")}
+    table = pa.Table.from_arrays(arrays, names=columns)
+    table = table.replace_schema_metadata({"nl2sql": json_dumps(meta)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _result_response(result, fmt="rows"):
+    """按请求的格式返回一页结果；出错时总是返回 JSON"""
+    if "error" in result:
+        return web.json_response(result, status=400, dumps=json_dumps)
+    if fmt == "arrow":
+        try:
+            body = _arrow_body(result)
+        except ImportError:
+            return web.json_response({"error": "Arrow format is unavailable: pyarrow is not installed."},
+                                     status=406)
+        return web.Response(body=body, content_type=ARROW_CONTENT_TYPE)
+    if fmt == "columnar":
+        rows = result["data"]
+        columns = _columns_of(result)
+        result = {k: v for k, v in result.items() if k != "data"}
+        result["columns"] = columns
+        result["rows"] = [list(row.values()) for row in rows]
+    return web.json_response(result, dumps=json_dumps)
+
+# If-None-Match 中的单个实体标签：可选的弱标记 W/ 加上引号括起的不透明标签
+_ENTITY_TAG_RE = re.compile(r'\s*(?:W/)?("[^"]*")\s*(?:,|$)')
+
+def _etag_matches(header, etag):
+    """
+    按 RFC 9110 §13.1.2 判断 If-None-Match 是否命中当前 ETag：
+    "*" 匹配任何已存在的表示；否则为逗号分隔的标签列表，按弱比较 (忽略 W/ 前缀) 逐个比对。
+    """
+    if header is None or etag is None:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag == etag for tag in _ENTITY_TAG_RE.findall(header))
+
 # --- MCP 工具处理模块 ---
 async def handle_query(request):
-    """处理 /query 工具的请求"""
+    """
+    处理 /query 工具的请求。
+    "format" 可选 rows (默认)、columnar (列名 + 数组行) 或 arrow (Arrow IPC 流)，/query/next 同样支持。
+    """
     try:
         data = await request.json()
         question = data.get("prompt")
@@ -57,12 +158,27 @@ async def handle_query(request):
         if not question:
             return web.json_response({"error": "Prompt 'question' is required."}, status=400)
 
-        result = await orchestrator.process_natural_language_query(
-            request.app['db_pool'], question, page_size, offset
-        )
-        
-        status_code = 400 if "error" in result else 200
-        return web.json_response(result, status=status_code)
+        if data.get("stream"):
+            return await stream_query(request, question, data)
+        try:
+            fmt = _result_format(data)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+        if data.get("timings"):
+            # 在响应中附带本次请求各阶段的耗时 (毫秒)
+            start = time.perf_counter()
+            with metrics.request_timings() as timings:
+                result = await orchestrator.process_natural_language_query(
+                    request.app['db_pool'], question, page_size, offset
+                )
+            timings["total"] = round((time.perf_counter() - start) * 1000, 3)
+            result["timings"] = timings
+        else:
+            result = await orchestrator.process_natural_language_query(
+                request.app['db_pool'], question, page_size, offset
+            )
+        return _result_response(result, fmt)
 
     except json.JSONDecodeError:
         return web.json_response({"error": "Invalid JSON format."}, status=400)
@@ -70,26 +186,269 @@ async def handle_query(request):
         logging.error(f"处理 /query 时发生未知错误: {e}", exc_info=True)
         return web.json_response({"error": "An internal server error occurred."}, status=500)
 
+async def stream_query(request, question, data):
+    """
+    以 NDJSON 分块流式返回完整结果集 (用于大结果集 / 导出)。
+    SQL 通过校验后立即发送 {"event": "sql_ready", "generated_sql", ...}，不等数据库返回；
+    之后是元信息 {"generated_sql", "columns", "format"}，随后每行是一批 {"rows": [...]}，
+    最后一行为 {"done": true, "row_count", "truncated"}；执行出错时以 {"error": ...} 结束。
+    format=columnar 时每行数据是数组 (列名只在第一行出现一次)，否则是对象。
+    请求头 Accept 为 text/event-stream 时以 SSE 格式发送，事件名依次为
+    sql_ready、header、rows、done (或 error)。
+    """
+    try:
+        # 在调用 LLM 之前校验参数
+        max_rows = _request_limit(data, "max_rows", orchestrator.STREAM_MAX_ROWS)
+    except ValueError as e:
+        return web.json_response({"error": f"Invalid parameter: {e}"}, status=400)
+    pool = request.app['db_pool']
+    prepared = await orchestrator.prepare_sql(pool, question)
+    if "error" in prepared:
+        return web.json_response(prepared, status=400, dumps=json_dumps)
+    sql = prepared["generated_sql"]
+
+    columnar = data.get("format") == "columnar"
+    stream = orchestrator.RowStream(pool, sql, max_rows=max_rows)
+
+    sse = "text/event-stream" in request.headers.get("Accept", "")
+    content_type = "text/event-stream" if sse else "application/x-ndjson"
+    response = web.StreamResponse(headers={"Content-Type": f"{content_type}; charset=utf-8"})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    async def send(event, obj):
+        await response.write(_sse_event(event, obj) if sse else _ndjson_line(obj))
+
+    header = {"generated_sql": sql, "columns": None, "format": "columnar" if columnar else "rows"}
+    for key in ("cost", "value_corrections"):
+        if key in prepared:
+            header[key] = prepared[key]
+    rows_iter = stream.__aiter__()
+    try:
+        # 客户端可以在结果返回前先展示 SQL
+        await send("sql_ready", {"event": "sql_ready",
+                                 **{k: v for k, v in header.items() if k not in ("columns", "format")}})
+        async for rows in rows_iter:
+            if header["columns"] is None:
+                header["columns"] = stream.columns
+                await send("header", header)
+            if not columnar:
+                rows = [dict(zip(stream.columns, row)) for row in rows]
+            # write 会在发送缓冲区满时等待，从而对数据库读取形成背压
+            await send("rows", {"rows": rows})
+        if header["columns"] is None:
+            header["columns"] = stream.columns or []
+            await send("header", header)
+        await send("done", {
+            "done": True, "row_count": stream.row_count, "truncated": stream.truncated
+        })
+        orchestrator.log_query(question, sql, "success")
+        orchestrator.question_cache.put(prepared["cache_key"], sql)
+    except ConnectionResetError:
+        logging.info("流式查询的客户端已断开。")
+        return response
+    except Exception as e:
+        logging.error(f"流式执行 SQL 时出错: {e}")
+        orchestrator.log_query(question, sql, "error", str(e))
+        await send("error", {"error": f"Database execution error: {e}"})
+    finally:
+        await rows_iter.aclose()
+    await response.write_eof()
+    return response
+
+def _request_limit(data, name, maximum):
+    """请求中的上限参数 (并发数、行数) 必须是正整数，且不能超过服务器配置"""
+    value = data.get(name, maximum)
+    try:
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a positive integer.") from None
+    if value < 1:
+        raise ValueError(f"'{name}' must be a positive integer.")
+    return min(value, maximum)
+
+async def handle_query_batch(request):
+    """
+    处理 /query/batch：一次提交多个问题 {"prompts": [...]}，每个问题的结果独立返回，
+    部分失败不影响其余问题。重复的问题只处理一次，结果中以 duplicate_of 指向第一次出现的位置。
+    "stream": true 时按完成顺序以 NDJSON 逐项返回，最后一行为汇总。
+    """
+    try:
+        data = await request.json()
+        prompts = data.get("prompts")
+        if not isinstance(prompts, list) or not prompts:
+            return web.json_response({"error": "'prompts' must be a non-empty list."}, status=400)
+        if len(prompts) > orchestrator.BATCH_MAX_ITEMS:
+            return web.json_response(
+                {"error": f"At most {orchestrator.BATCH_MAX_ITEMS} prompts per batch."}, status=400)
+        if not all(isinstance(p, str) and p.strip() for p in prompts):
+            return web.json_response({"error": "Every prompt must be a non-empty string."}, status=400)
+        page_size = int(data.get("page_size", 10))
+        llm_concurrency = _request_limit(data, "llm_concurrency", orchestrator.BATCH_LLM_CONCURRENCY)
+        db_concurrency = _request_limit(data, "db_concurrency", orchestrator.BATCH_DB_CONCURRENCY)
+    except json.JSONDecodeError:
+        return web.json_response({"error": "Invalid JSON format."}, status=400)
+    except (TypeError, ValueError) as e:
+        return web.json_response({"error": f"Invalid parameter: {e}"}, status=400)
+
+    batch = orchestrator.run_batch(request.app['db_pool'], prompts, page_size,
+                                   llm_concurrency, db_concurrency)
+    summary = {"total": len(prompts), "unique": 0, "succeeded": 0, "failed": 0}
+
+    def items(indices, result):
+        summary["unique"] += 1
+        outcome = "failed" if "error" in result else "succeeded"
+        summary[outcome] += len(indices)
+        first = indices[0]
+        return [{"index": i, "prompt": prompts[i], **({"duplicate_of": first} if i != first else {}), **result}
+                for i in indices]
+
+    if data.get("stream"):
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        try:
+            async for indices, result in batch:
+                await response.write(b"".join(_ndjson_line(item) for item in items(indices, result)))
+            await response.write(_ndjson_line({"done": True, **summary}))
+        except ConnectionResetError:
+            logging.info("批量查询的客户端已断开。")
+            return response
+        finally:
+            await batch.aclose()
+        await response.write_eof()
+        return response
+
+    results = [None] * len(prompts)
+    try:
+        async for indices, result in batch:
+            for item in items(indices, result):
+                results[item["index"]] = item
+    finally:
+        await batch.aclose()
+    return web.json_response({"results": results, "summary": summary}, dumps=json_dumps)
+
+async def handle_query_next(request):
+    """处理 /query/next 请求：通过游标获取下一页，不再重新生成 SQL"""
+    try:
+        data = await request.json()
+        cursor_id = data.get("cursor")
+        if not cursor_id:
+            return web.json_response({"error": "'cursor' is required."}, status=400)
+        try:
+            fmt = _result_format(data)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+        result = await orchestrator.fetch_next_page(request.app['db_pool'], cursor_id)
+        return _result_response(result, fmt)
+
+    except json.JSONDecodeError:
+        return web.json_response({"error": "Invalid JSON format."}, status=400)
+    except Exception as e:
+        logging.error(f"处理 /query/next 时发生未知错误: {e}", exc_info=True)
+        return web.json_response({"error": "An internal server error occurred."}, status=500)
+
 async def handle_schema(request):
     """处理 /schema 工具的请求"""
     try:
         table_name = request.query.get("table_name")
+        catalog = orchestrator.schema_catalog
+        # 先确定请求的表存在：不存在的表即使带着当前 ETag 也应返回 404 而不是 304
         schema = await orchestrator.get_db_schema(request.app['db_pool'], table_name)
         if table_name and not schema:
             return web.json_response({"error": f"Table '{table_name}' not found."}, status=404)
-        return web.json_response(schema)
+        # 支持条件请求：Schema 未变化时直接返回 304
+        if _etag_matches(request.headers.get("If-None-Match"), catalog.etag):
+            return web.Response(status=304, headers={"ETag": catalog.etag})
+        return web.json_response(schema, headers={"ETag": catalog.etag})
     except Exception as e:
         logging.error(f"处理 /schema 时发生错误: {e}", exc_info=True)
         return web.json_response({"error": "An internal server error occurred."}, status=500)
 
 async def handle_logs(request):
-    """处理 /logs 工具的请求"""
-    return web.json_response({"logs": orchestrator.query_logs})
+    """
+    处理 /logs 工具的请求，按时间从新到旧分页返回查询日志。
+    可选参数: status, since / until (ISO 8601 时间), q (问题/SQL/错误信息中的子串),
+    limit (默认 50，最多 500), cursor (上一页返回的 next_cursor)。
+    """
+    params = request.query
+    try:
+        log_filter = LogFilter(
+            status=params.get("status") or None,
+            since=parse_timestamp(params["since"]) if params.get("since") else None,
+            until=parse_timestamp(params["until"]) if params.get("until") else None,
+            text=params.get("q") or None,
+        )
+        limit = min(max(int(params.get("limit", 50)), 1), 500)
+        before = int(params["cursor"]) if params.get("cursor") else None
+    except ValueError as e:
+        return web.json_response({"error": f"Invalid query parameter: {e}"}, status=400)
+
+    result = await orchestrator.query_log.search(log_filter, before=before, limit=limit)
+    return web.json_response(result, dumps=json_dumps)
+
+async def handle_metrics(request):
+    """以 Prometheus 文本格式导出进程内指标"""
+    return web.Response(body=metrics.registry.render().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """按路由记录 HTTP 请求耗时 (流式响应包含整个传输过程)"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    except asyncio.CancelledError:
+        status = 499  # 客户端已断开
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - start, route=route, status=status)
+
+
+async def handle_health(request):
+    """就绪检查：启动预热在开始监听之前完成，能响应即表示已就绪；附带各启动阶段的耗时"""
+    app = request.app
+    return web.json_response({
+        "status": "ready",
+        "pid": os.getpid(),
+        "startup_ms": app['startup_timings'],
+        "uptime_seconds": round(time.monotonic() - app['ready_at'], 3),
+    })
 
 
 # --- 服务器主程序 ---
+def config_errors():
+    """检查启动所需的配置，返回问题描述列表"""
+    errors = llm_handler.config_errors()
+    for name in ("DB_HOST", "DB_PORT", "DB_USER", "DB_NAME"):
+        if not os.getenv(name):
+            errors.append(f"环境变量 {name} 未设置。")
+    if os.getenv("DB_PORT") and not os.getenv("DB_PORT").isdigit():
+        errors.append(f"DB_PORT 必须是端口号: {os.getenv('DB_PORT')}")
+    if not 0 <= DB_POOL_MIN_SIZE <= DB_POOL_MAX_SIZE or DB_POOL_MAX_SIZE < 1:
+        errors.append("DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE 须满足 0 <= 最小连接数 <= 最大连接数，且最大连接数至少为 1。")
+    return errors
+
+async def validate_config(app):
+    """启动时校验配置，一次报告所有问题"""
+    errors = config_errors()
+    if errors:
+        raise ValueError("配置错误:\n  " + "\n  ".join(errors))
+
 async def init_db_pool(app):
-    """初始化数据库连接池并存储在 app 对象中"""
+    """初始化数据库连接池 (建立最小连接数的连接) 并存储在 app 对象中"""
+    import aiomysql
     logging.info("正在初始化数据库连接池...")
     try:
         app['db_pool'] = await aiomysql.create_pool(
@@ -98,6 +457,8 @@ async def init_db_pool(app):
             user=os.getenv("DB_USER"),
             password=os.getenv("DB_PASSWORD"),
             db=os.getenv("DB_NAME"),
+            minsize=DB_POOL_MIN_SIZE,
+            maxsize=DB_POOL_MAX_SIZE,
             autocommit=True
         )
         logging.info("数据库连接池初始化成功。")
@@ -105,20 +466,120 @@ async def init_db_pool(app):
         logging.error(f"数据库连接失败: {e}")
         raise
 
+async def load_schema_catalog(app):
+    """启动时预加载 Schema 目录，避免请求路径上的 N+1 次 SHOW CREATE TABLE"""
+    await orchestrator.schema_catalog.load(app['db_pool'])
+    logging.info(f"Schema 目录加载完成 (版本 {orchestrator.schema_catalog.version})。")
+    if orchestrator.schema_linker.enabled:
+        await orchestrator.schema_linker.ensure(app['db_pool'], orchestrator.schema_catalog)
+
+async def start_value_index(app):
+    """构建低基数文本列的取值索引，并启动后台增量刷新任务"""
+    index = orchestrator.value_index
+    try:
+        await index.refresh(app['db_pool'], orchestrator.schema_catalog)
+    except Exception as e:
+        logging.warning(f"构建列取值索引失败，将由后台任务重试: {e}")
+    index.start(app['db_pool'], orchestrator.schema_catalog)
+
+async def stop_value_index(app):
+    """停止取值索引的后台刷新 (须在关闭连接池之前)"""
+    await orchestrator.value_index.stop()
+
 async def cleanup_db_pool(app):
-    """关闭数据库连接池"""
+    """关闭数据库连接池 (启动在建立连接池之前失败时不做任何事)"""
+    pool = app.get('db_pool')
+    if pool is None:
+        return
     logging.info("正在关闭数据库连接池...")
-    app['db_pool'].close()
-    await app['db_pool'].wait_closed()
+    pool.close()
+    await pool.wait_closed()
     logging.info("数据库连接池已关闭。")
 
-def main():
-    app = web.Application()
-    
+async def load_sql_cache(app):
+    """从磁盘加载问题 → SQL 缓存 (未配置 SQL_CACHE_PATH 时不做任何事)"""
+    orchestrator.question_cache.load()
+
+async def save_sql_cache(app):
+    """将问题 → SQL 缓存写回磁盘"""
+    orchestrator.question_cache.save()
+
+async def start_query_log(app):
+    """恢复最近的查询日志并启动后台写盘任务"""
+    orchestrator.query_log.load()
+    orchestrator.query_log.start()
+
+async def load_examples(app):
+    """从查询日志中执行成功的记录重建 few-shot 示例库"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, orchestrator.example_store.load_from_log,
+                               orchestrator.query_log.history())
+
+async def stop_query_log(app):
+    """写出尚未落盘的查询日志"""
+    await orchestrator.query_log.stop()
+
+async def prewarm(app):
+    """预热解析器、示例检索与 LLM SDK，使首个请求不承担这些一次性开销"""
+    await orchestrator.warm_up()
+
+async def close_shared_cache(app):
+    """等待共享缓存中尚未完成的写入并关闭它"""
+    await asyncio.get_running_loop().run_in_executor(None, orchestrator.shared_cache.close)
+
+async def cleanup_llm_client(app):
+    """关闭 LLM 客户端 (释放后端线程池)"""
+    llm_handler.close_clients()
+
+def _timed(hook):
+    """记录启动阶段的耗时 (毫秒)，由 /health 返回"""
+    @functools.wraps(hook)
+    async def wrapper(app):
+        start = time.perf_counter()
+        await hook(app)
+        app['startup_timings'][hook.__name__] = round((time.perf_counter() - start) * 1000, 1)
+    return wrapper
+
+async def mark_ready(app):
+    app['ready_at'] = time.monotonic()
+    total = sum(app['startup_timings'].values())
+    logging.info(f"服务器预热完成，启动用时 {total:.0f} ms: {app['startup_timings']}")
+    # 由多进程主进程启动时通知它本进程已就绪 (滚动重启据此继续下一个进程)
+    workers.notify_ready()
+
+# 启动流程依次执行，全部完成后服务器才开始监听
+STARTUP_HOOKS = [
+    validate_config,
+    init_db_pool,
+    load_schema_catalog,
+    load_sql_cache,
+    start_query_log,
+    load_examples,
+    start_value_index,
+    prewarm,
+]
+
+def create_app():
+    """
+    应用工厂：注册启动 / 清理流程与路由。不做任何 I/O，
+    配置校验、连接池与预热都在应用启动时进行。
+    """
+    import aiohttp_cors
+
+    app = web.Application(middlewares=[metrics_middleware])
+    app['startup_timings'] = {}
+
     # 注册启动和清理事件
-    app.on_startup.append(init_db_pool)
+    for hook in STARTUP_HOOKS:
+        app.on_startup.append(_timed(hook))
+    app.on_startup.append(mark_ready)
+    app.on_cleanup.append(stop_value_index)
     app.on_cleanup.append(cleanup_db_pool)
-    
+    app.on_cleanup.append(cleanup_llm_client)
+    app.on_cleanup.append(save_sql_cache)
+    app.on_cleanup.append(stop_query_log)
+    app.on_cleanup.append(close_shared_cache)
+
     # 配置 CORS
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
@@ -127,15 +588,42 @@ def main():
             allow_headers="*",
         )
     })
-    
+
     # 注册路由并应用 CORS
     cors.add(app.router.add_post('/query', handle_query))
+    cors.add(app.router.add_post('/query/next', handle_query_next))
+    cors.add(app.router.add_post('/query/batch', handle_query_batch))
     cors.add(app.router.add_get('/schema', handle_schema))
     cors.add(app.router.add_get('/logs', handle_logs))
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/health', handle_health)
+    return app
 
+def main():
+    sock = workers.inherited_socket()
+    slot = os.getenv(workers.WORKER_SLOT_ENV)
+    # 多个工作进程不能轮转同一个日志文件，各自写入 app-worker{编号}.log
+    configure_logging(log_name=f'app-worker{slot}.log' if slot is not None else 'app.log')
+    logging.info(f"Python {sys.version.split()[0]} ({sys.executable})")
     port = int(os.getenv("PORT", 8080))
-    logging.info(f"MCP 服务器将在 http://0.0.0.0:{port} 启动")
-    web.run_app(app, host='0.0.0.0', port=port)
+
+    if sock is None and workers.SERVER_WORKERS > 1:
+        if os.name == 'posix':
+            logging.info(f"MCP 服务器将在 http://0.0.0.0:{port} 启动 (多进程)")
+            workers.run('0.0.0.0', port)
+            return
+        logging.warning("当前平台不支持多进程模式，以单进程运行")
+
+    app = create_app()
+    if sock is None:
+        logging.info(f"MCP 服务器将在 http://0.0.0.0:{port} 启动")
+    else:
+        logging.info(f"工作进程 {slot} (pid {os.getpid()}) 开始启动")
+    # 客户端断开时取消处理协程，使排队或进行中的 LLM 调用及时释放名额；
+    # 停止时 (SIGTERM) 先不再接收新连接，最多等待 SERVER_DRAIN_TIMEOUT 秒让进行中的请求完成
+    web.run_app(app, host=None if sock else '0.0.0.0', port=None if sock else port, sock=sock,
+                shutdown_timeout=workers.SERVER_DRAIN_TIMEOUT, handler_cancellation=True)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,264 @@
+# mcp_server/workers.py
+"""
+多进程运行服务器 (SERVER_WORKERS > 1 时由 server.main 调用)。
+
+主进程只负责监听端口和管理工作进程：绑定一个监听 socket 后启动 SERVER_WORKERS 个
+`python -m mcp_server.server` 工作进程，工作进程继承这个 socket 并各自 accept，
+由内核在它们之间分配连接。主进程不处理请求。
+
+- 数据库连接总数 DB_MAX_CONNECTIONS 平均分给各工作进程的连接池；
+- 问题 → SQL、查询结果与游标经 SHARED_CACHE_PATH (SQLite) 在工作进程间共享；
+- 各进程的查询日志写入同一个 QUERY_LOG_DIR，/logs 与示例库看到的是所有进程的日志；
+- 工作进程异常退出时自动重启 (连续失败时逐渐拉长间隔)；
+- 收到 SIGHUP 时滚动重启：逐个让工作进程停止接收新连接、等进行中的请求 (包括 LLM 调用)
+  在 SERVER_DRAIN_TIMEOUT 内完成后退出，再启动新进程并等它就绪，其余进程照常服务；
+- 收到 SIGTERM / SIGINT 时同样先排空所有工作进程再退出。
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import asyncio
+import logging
+
+from core.query_log import LOG_ID_WORKERS
+
+# 工作进程数，1 表示单进程运行 (不启动主进程)
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))
+# 所有工作进程的数据库连接总数，平均分给各进程的连接池 (未设置时取 DB_POOL_MAX_SIZE)
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS") or os.getenv("DB_POOL_MAX_SIZE") or 10)
+# 停止工作进程时等待进行中请求完成的最长时间 (秒)
+SERVER_DRAIN_TIMEOUT = float(os.getenv("SERVER_DRAIN_TIMEOUT", 60))
+# 等待新工作进程完成预热的最长时间 (秒)
+SERVER_READY_TIMEOUT = float(os.getenv("SERVER_READY_TIMEOUT", 120))
+# 多进程且未设置 SHARED_CACHE_PATH 时使用的共享缓存文件
+DEFAULT_SHARED_CACHE_PATH = os.path.join("logs", "shared_cache.sqlite3")
+
+# 工作进程从这些环境变量得知监听 socket、就绪通知管道和自己的编号
+WORKER_FD_ENV = "SERVER_WORKER_FD"
+READY_FD_ENV = "SERVER_READY_FD"
+WORKER_SLOT_ENV = "SERVER_WORKER_SLOT"
+
+# 重启异常退出的工作进程前的等待时间 (秒)：连续失败时翻倍，运行超过 _STABLE_AFTER 秒后复位
+_RESPAWN_BACKOFF = (1.0, 30.0)
+_STABLE_AFTER = 60.0
+
+
+def config_errors(workers=SERVER_WORKERS, connections=DB_MAX_CONNECTIONS):
+    errors = []
+    if workers < 1:
+        errors.append("SERVER_WORKERS 必须至少为 1。")
+    elif workers > LOG_ID_WORKERS:
+        errors.append(f"SERVER_WORKERS 不能超过 {LOG_ID_WORKERS} (查询日志 id 中的工作进程编号位数有限)。")
+    elif connections < workers:
+        errors.append(f"DB_MAX_CONNECTIONS ({connections}) 不能小于工作进程数 ({workers})，"
+                      "否则有的工作进程分不到数据库连接。")
+    if SERVER_DRAIN_TIMEOUT < 0:
+        errors.append("SERVER_DRAIN_TIMEOUT 不能为负数。")
+    return errors
+
+
+def pool_sizes(workers=SERVER_WORKERS, connections=DB_MAX_CONNECTIONS, min_size=None):
+    """每个工作进程连接池的 (最小, 最大) 连接数"""
+    if min_size is None:
+        min_size = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+    per_worker = max(1, connections // workers)
+    return min(min_size, per_worker), per_worker
+
+
+def notify_ready():
+    """工作进程预热完成后通知主进程 (不是由主进程启动时不做任何事)"""
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b"1")
+        os.close(int(fd))
+    except OSError as e:
+        logging.warning(f"通知主进程就绪失败: {e}")
+
+
+def inherited_socket():
+    """由主进程启动时返回继承的监听 socket，否则返回 None"""
+    fd = os.getenv(WORKER_FD_ENV)
+    return socket.socket(fileno=int(fd)) if fd else None
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Worker:
+    def __init__(self, slot, process, ready_fd):
+        self.slot = slot
+        self.process = process
+        self.ready_fd = ready_fd
+        self.started_at = time.monotonic()
+        self.retiring = False
+
+
+class Supervisor:
+    """管理工作进程：启动、异常退出后重启、滚动重启与整体停止"""
+
+    def __init__(self, sock, workers=SERVER_WORKERS, connections=DB_MAX_CONNECTIONS,
+                 drain_timeout=SERVER_DRAIN_TIMEOUT, ready_timeout=SERVER_READY_TIMEOUT):
+        self.sock = sock
+        self.workers = workers
+        self.connections = connections
+        self.drain_timeout = drain_timeout
+        self.ready_timeout = ready_timeout
+        self._slots = {}
+        self._backoff = {}
+        self._stopping = False
+        self._restarting = None
+        self._stopped = asyncio.Event()
+
+    def _worker_env(self, slot, ready_w):
+        env = dict(os.environ)
+        min_size, max_size = pool_sizes(self.workers, self.connections)
+        env.update({
+            WORKER_FD_ENV: str(self.sock.fileno()),
+            READY_FD_ENV: str(ready_w),
+            WORKER_SLOT_ENV: str(slot),
+            "DB_POOL_MIN_SIZE": str(min_size),
+            "DB_POOL_MAX_SIZE": str(max_size),
+        })
+        if not env.get("SHARED_CACHE_PATH"):
+            env["SHARED_CACHE_PATH"] = DEFAULT_SHARED_CACHE_PATH
+        # 查询日志仍使用同一个 QUERY_LOG_DIR：各进程只写、只轮转文件名带自己编号的分段，
+        # 查询时合并所有进程的分段 (见 core.query_log)
+        return env
+
+    async def _spawn(self, slot):
+        ready_r, ready_w = os.pipe()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "mcp_server.server",
+                env=self._worker_env(slot, ready_w),
+                pass_fds=(self.sock.fileno(), ready_w),
+                # 独立的会话：终端的 Ctrl-C 只发给主进程，由主进程有序地停止工作进程
+                start_new_session=True)
+        except BaseException:
+            os.close(ready_r)
+            raise
+        finally:
+            os.close(ready_w)
+        worker = Worker(slot, process, ready_r)
+        self._slots[slot] = worker
+        logging.info(f"工作进程 {slot} 已启动 (pid {process.pid})")
+        asyncio.ensure_future(self._watch(worker))
+        return worker
+
+    async def _wait_ready(self, worker):
+        """等待工作进程预热完成；进程在此之前退出或超时时返回 False"""
+        loop = asyncio.get_running_loop()
+        # 工作进程退出时管道写端随之关闭，read 返回空字节
+        read = loop.run_in_executor(None, os.read, worker.ready_fd, 1)
+        try:
+            data = await asyncio.wait_for(asyncio.shield(read), self.ready_timeout)
+        except asyncio.TimeoutError:
+            # 结束该进程，由 _watch 按退避间隔重新启动
+            logging.error(f"工作进程 {worker.slot} 在 {self.ready_timeout}s 内没有就绪，结束该进程")
+            worker.process.kill()
+            data = await read
+        os.close(worker.ready_fd)
+        return data == b"1"
+
+    async def _watch(self, worker):
+        code = await worker.process.wait()
+        if self._stopping or worker.retiring:
+            return
+        logging.error(f"工作进程 {worker.slot} (pid {worker.process.pid}) 意外退出，退出码 {code}")
+        if time.monotonic() - worker.started_at > _STABLE_AFTER:
+            self._backoff.pop(worker.slot, None)
+        delay = self._backoff.get(worker.slot, _RESPAWN_BACKOFF[0])
+        self._backoff[worker.slot] = min(delay * 2, _RESPAWN_BACKOFF[1])
+        await asyncio.sleep(delay)
+        if not self._stopping and self._slots.get(worker.slot) is worker:
+            await self._wait_ready(await self._spawn(worker.slot))
+
+    async def _stop_worker(self, worker):
+        """发送 SIGTERM 让工作进程排空后退出，超时仍未退出时强制结束"""
+        worker.retiring = True
+        if worker.process.returncode is not None:
+            return
+        worker.process.terminate()
+        try:
+            # 工作进程自身最多等待 drain_timeout，这里多留出执行清理流程的时间
+            await asyncio.wait_for(worker.process.wait(), self.drain_timeout + 5)
+        except asyncio.TimeoutError:
+            logging.warning(f"工作进程 {worker.slot} (pid {worker.process.pid}) 未能按时退出，强制结束")
+            worker.process.kill()
+            await worker.process.wait()
+
+    async def rolling_restart(self):
+        """
+        逐个重启工作进程：先排空并停止旧进程，再启动新进程并等它就绪，然后处理下一个。
+        先停后启使数据库连接总数不超过预算；任一时刻最多只有一个进程不可用。
+        """
+        logging.info("开始滚动重启工作进程...")
+        for slot in range(self.workers):
+            if self._stopping:
+                return
+            old = self._slots.get(slot)
+            if old is not None:
+                await self._stop_worker(old)
+            if self._stopping:
+                return
+            new = await self._spawn(slot)
+            if not await self._wait_ready(new):
+                # 新进程起不来时停止滚动，保留其余仍在运行的旧进程 (该槽位由 _watch 继续重试)
+                logging.error(f"工作进程 {slot} 重启后未能就绪，停止滚动重启")
+                return
+        logging.info("滚动重启完成。")
+
+    def _on_hup(self):
+        if self._restarting is not None and not self._restarting.done():
+            logging.info("滚动重启正在进行中，忽略 SIGHUP")
+            return
+        self._restarting = asyncio.ensure_future(self.rolling_restart())
+
+    def _on_stop(self):
+        if not self._stopping:
+            self._stopping = True
+            self._stopped.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, self._on_hup)
+        loop.add_signal_handler(signal.SIGTERM, self._on_stop)
+        loop.add_signal_handler(signal.SIGINT, self._on_stop)
+
+        workers = [await self._spawn(slot) for slot in range(self.workers)]
+        ready = await asyncio.gather(*(self._wait_ready(w) for w in workers))
+        if all(ready):
+            logging.info(f"{self.workers} 个工作进程均已就绪")
+        else:
+            logging.error("部分工作进程未能就绪，请检查各工作进程的日志")
+
+        await self._stopped.wait()
+        logging.info("正在停止所有工作进程 (等待进行中的请求完成)...")
+        if self._restarting is not None:
+            self._restarting.cancel()
+        await asyncio.gather(*(self._stop_worker(w) for w in list(self._slots.values())))
+        logging.info("所有工作进程已退出。")
+
+
+def run(host, port):
+    """绑定端口并运行主进程，直到收到 SIGTERM / SIGINT"""
+    errors = config_errors()
+    if errors:
+        raise ValueError("配置错误:\n  " + "\n  ".join(errors))
+    min_size, max_size = pool_sizes()
+    logging.info(f"以 {SERVER_WORKERS} 个工作进程运行，每个进程的数据库连接池为 {min_size}-{max_size}")
+    sock = bind_socket(host, port)
+    try:
+        asyncio.run(Supervisor(sock).run())
+    finally:
+        sock.close()
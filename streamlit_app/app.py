@@ -2,10 +2,16 @@
 import streamlit as st
 import requests
 import pandas as pd
+import pyarrow as pa
 import json
 
 # --- 配置 ---
 MCP_SERVER_URL = "http://localhost:8080" # MCP 服务器地址
+PAGE_SIZE = 10                  # 每页行数
+SCHEMA_CHECK_INTERVAL = 30      # 向服务器确认 Schema 版本的间隔 (秒)
+RESULT_CACHE_TTL = 60           # 第一页结果的缓存时间 (秒)
+RESULT_CACHE_ENTRIES = 64       # 最多缓存的查询数
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
 
 # --- Streamlit 页面配置 ---
 st.set_page_config(page_title="自然语言数据库查询系统", layout="wide")
@@ -15,30 +21,126 @@ st.caption("基于大语言模型与 MCP 服务的数据库查询")
 # --- 会话状态管理 ---
 if 'query_history' not in st.session_state:
     st.session_state.query_history = []
-if 'current_result_data' not in st.session_state:
-    st.session_state.current_result_data = []
+if 'current_df' not in st.session_state:
+    st.session_state.current_df = None # 已加载的所有行 (每加载一页追加一次，不在每次重新渲染时重建)
+if 'next_offset' not in st.session_state:
+    st.session_state.next_offset = None
 if 'current_sql' not in st.session_state:
     st.session_state.current_sql = ""
 if 'error_message' not in st.session_state:
     st.session_state.error_message = ""
 if 'last_prompt' not in st.session_state:
     st.session_state.last_prompt = ""
-if 'next_offset' not in st.session_state:
-    st.session_state.next_offset = 0
+if 'cursor' not in st.session_state:
+    st.session_state.cursor = None
 
 # --- API 调用函数 ---
-def query_mcp_server(prompt, page_size=10, offset=0):
-    """向 MCP 服务器发送查询请求"""
+@st.cache_resource
+def http_session():
+    """所有会话共用的 HTTP 会话，复用到服务器的连接 (keep-alive)"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def decode_page(response):
+    """把一页结果解码为 (元信息, DataFrame)：Arrow IPC 直接转换，JSON 时按列构造"""
+    if response.headers.get("Content-Type", "").startswith(ARROW_CONTENT_TYPE):
+        table = pa.ipc.open_stream(response.content).read_all()
+        meta = json.loads(table.schema.metadata[b"nl2sql"])
+        return meta, table.to_pandas()
+    result = response.json()
+    if "rows" in result:
+        return result, pd.DataFrame(result.pop("rows"), columns=result.pop("columns"))
+    return result, pd.DataFrame(result.pop("data", []), columns=result.pop("columns", None) or None)
+
+def post_page(path, payload):
+    """
+    请求一页结果 (优先使用 Arrow 格式，服务器未安装 pyarrow 时改用列式 JSON)。
+    成功时返回的字典中 "df" 为该页的 DataFrame。
+    """
+    session = http_session()
     try:
-        response = requests.post(
-            f"{MCP_SERVER_URL}/query",
-            json={"prompt": prompt, "page_size": page_size, "offset": offset},
-            timeout=60  # 60秒超时
-        )
-        response.raise_for_status() # 如果是 4xx 或 5xx 错误，会抛出异常
-        return response.json()
+        response = session.post(f"{MCP_SERVER_URL}{path}", json={**payload, "format": "arrow"}, timeout=60)
+        if response.status_code == 406:
+            response = session.post(f"{MCP_SERVER_URL}{path}", json={**payload, "format": "columnar"},
+                                    timeout=60)
+        if response.status_code == 400:
+            return response.json() # 服务器说明了错误原因 (如 SQL 未通过校验)
+        response.raise_for_status() # 其他 4xx 或 5xx 错误会抛出异常
     except requests.exceptions.RequestException as e:
         return {"error": f"无法连接到 MCP 服务器: {e}"}
+    result, df = decode_page(response)
+    result["df"] = df
+    return result
+
+def query_mcp_server(prompt, page_size=PAGE_SIZE, offset=0):
+    """向 MCP 服务器发送查询请求"""
+    return post_page("/query", {"prompt": prompt, "page_size": page_size, "offset": offset})
+
+def fetch_next_page(cursor_id):
+    """通过服务端游标获取下一页，不会重新生成 SQL"""
+    return post_page("/query/next", {"cursor": cursor_id})
+
+class QueryFailed(Exception):
+    """查询出错 (抛出异常使 st.cache_data 不缓存错误结果)"""
+
+    def __init__(self, result):
+        super().__init__(result.get("error"))
+        self.result = result
+
+@st.cache_data(ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_ENTRIES, show_spinner=False)
+def cached_first_page(prompt, page_size, schema_version):
+    """
+    第一页结果，按 (问题, 每页行数, Schema 版本) 在所有会话间缓存；Schema 变化后自动失效。
+    游标是有状态的 (每翻一页前进一次)，不能在会话之间共享：缓存中的结果不带游标，
+    实际发出请求的会话把游标放在自己的 session_state 中 (见 first_page)，
+    其他会话从缓存取得的结果通过 next_offset 加载下一页。
+    """
+    result = query_mcp_server(prompt, page_size)
+    if "error" in result:
+        raise QueryFailed(result)
+    # 只在缓存未命中时执行，此时的会话就是发出请求的会话
+    st.session_state.first_page_cursor = result.pop("cursor", None)
+    return result
+
+def first_page(prompt, page_size):
+    """第一页结果；若本会话刚刚向服务器发出了请求，带上服务器返回的游标"""
+    st.session_state.first_page_cursor = None
+    result = cached_first_page(prompt, page_size, schema_version())
+    result["cursor"] = st.session_state.pop("first_page_cursor", None)
+    return result
+
+@st.cache_data(ttl=SCHEMA_CHECK_INTERVAL, show_spinner=False)
+def fetch_schema_version():
+    """Schema 的版本标签 (服务器返回的 ETag)，每 SCHEMA_CHECK_INTERVAL 秒最多确认一次"""
+    response = http_session().head(f"{MCP_SERVER_URL}/schema", timeout=10)
+    response.raise_for_status()
+    return response.headers.get("ETag")
+
+def schema_version():
+    """当前的 Schema 版本标签；连接失败时返回 None (失败不会被缓存，下次重新确认)"""
+    try:
+        return fetch_schema_version()
+    except requests.exceptions.RequestException:
+        return None
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_schema(version):
+    """按版本标签缓存 Schema，版本不变时不再重新下载"""
+    response = http_session().get(f"{MCP_SERVER_URL}/schema", timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+def show_page(result, append=False):
+    """把一页结果放入会话状态：追加到已加载的 DataFrame，而不是从全部行重建"""
+    df = result["df"]
+    if append and st.session_state.current_df is not None:
+        df = pd.concat([st.session_state.current_df, df], ignore_index=True)
+    st.session_state.current_df = df
+    st.session_state.next_offset = result.get("next_offset")
+    st.session_state.cursor = result.get("cursor")
 
 # --- UI 界面 ---
 col1, col2 = st.columns([2, 1])
@@ -54,21 +156,23 @@ with col1:
 
     if submitted:
         st.session_state.last_prompt = natural_language_query
-        st.session_state.next_offset = 0 # 新查询，重置 offset
-        st.session_state.current_result_data = [] # 新查询，重置数据
+        st.session_state.cursor = None # 新查询，重置游标
+        st.session_state.next_offset = None
+        st.session_state.current_df = None # 新查询，重置数据
         
         with st.spinner("正在思考并查询数据库..."):
-            result = query_mcp_server(natural_language_query, offset=0)
+            try:
+                result = first_page(natural_language_query, PAGE_SIZE)
+            except QueryFailed as e:
+                result = e.result
             
             if "error" in result:
                 st.session_state.error_message = result.get("error")
                 st.session_state.current_sql = result.get("generated_sql", "")
-                st.session_state.current_result_data = []
             else:
                 st.session_state.error_message = ""
                 st.session_state.current_sql = result.get("generated_sql", "")
-                st.session_state.current_result_data = result.get("data", [])
-                st.session_state.next_offset = result.get("next_offset")
+                show_page(result)
             
             # 记录历史
             st.session_state.query_history.insert(0, {
@@ -88,21 +192,26 @@ if st.session_state.error_message:
 if st.session_state.current_sql:
     st.code(st.session_state.current_sql, language="sql")
 
-if st.session_state.current_result_data:
-    df = pd.DataFrame(st.session_state.current_result_data)
-    st.dataframe(df)
-    st.success(f"当前已加载 {len(st.session_state.current_result_data)} 条记录。")
+if st.session_state.current_df is not None and len(st.session_state.current_df):
+    st.dataframe(st.session_state.current_df)
+    st.success(f"当前已加载 {len(st.session_state.current_df)} 条记录。")
 
 # --- 分页按钮逻辑 ---
-if st.session_state.next_offset:
+if st.session_state.cursor or st.session_state.next_offset is not None:
     if st.button("加载下一页 (Load More)"):
         with st.spinner("正在加载更多结果..."):
-            result = query_mcp_server(st.session_state.last_prompt, offset=st.session_state.next_offset)
+            if st.session_state.cursor:
+                result = fetch_next_page(st.session_state.cursor)
+            else:
+                # 第一页来自缓存，没有游标：按偏移量请求下一页 (服务器会命中问题 → SQL 缓存并返回新游标)
+                result = query_mcp_server(st.session_state.last_prompt, PAGE_SIZE,
+                                          offset=st.session_state.next_offset)
             if "error" in result:
                 st.session_state.error_message = result.get("error")
+                st.session_state.cursor = None
+                st.session_state.next_offset = None
             else:
-                st.session_state.current_result_data.extend(result.get("data", []))
-                st.session_state.next_offset = result.get("next_offset")
+                show_page(result, append=True)
             st.rerun() # 重新渲染页面以显示新数据
             
 # --- 侧边栏 ---
@@ -131,14 +240,14 @@ if 'test_query' in st.session_state:
 with col2:
     st.subheader("Schema (表结构)")
     with st.spinner("正在加载 Schema..."):
-        try:
-            schema_res = requests.get(f"{MCP_SERVER_URL}/schema", timeout=10)
-            if schema_res.status_code == 200:
-                st.json(schema_res.json(), expanded=False)
-            else:
-                st.error("加载 Schema 失败。请确保 MCP 服务器正在运行。")
-        except requests.exceptions.RequestException:
+        version = schema_version()
+        if version is None:
             st.error("无法连接到 MCP 服务器。")
+        else:
+            try:
+                st.json(load_schema(version), expanded=False)
+            except requests.exceptions.RequestException:
+                st.error("加载 Schema 失败。请确保 MCP 服务器正在运行。")
 
     st.subheader("查询历史")
     if not st.session_state.query_history: